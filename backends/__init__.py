@@ -0,0 +1,65 @@
+# file name:	backends/__init__.py
+# description:	Geoprocessing backends of the Solar Stream Tools. The processing modules report messages, read and
+#               write rasters and feature classes, and run the remaining ESRI tools through a backend instead of
+#               importing arcpy, so the same tool entry points run with or without ArcGIS. The ARCPY backend uses the
+#               ESRI arcpy module, and the OPEN backend uses the GDAL/OGR Python bindings, for Linux machines without
+#               ArcGIS. The backend of a process is chosen at runtime by use(), by the SOLARSTREAM_BACKEND environment
+#               variable, or otherwise ARCPY if arcpy can be imported and OPEN if not.
+# author:		South Fork Research, Inc.
+# dependencies: ESRI arcpy module or GDAL/OGR Python bindings (osgeo)
+
+import os
+from .base import Backend
+
+BACKENDS = ["ARCPY", "OPEN"]
+BACKEND_ENV = "SOLARSTREAM_BACKEND"
+_instances = {}
+_detected = []
+
+
+def default_name():
+    """Name of the backend used when none is selected"""
+    if os.environ.get(BACKEND_ENV):
+        return os.environ[BACKEND_ENV].upper()
+    if not _detected:
+        try:
+            import arcpy
+            _detected.append("ARCPY")
+        except ImportError:
+            _detected.append("OPEN")
+    return _detected[0]
+
+
+def get(name=None):
+    """Returns a backend by name, or the backend selected for this process. The backend module (and arcpy or GDAL)
+    is only imported the first time a backend is used."""
+    name = (name or default_name()).upper()
+    if name not in BACKENDS:
+        raise ValueError("Unknown geoprocessing backend {0}. Use one of {1}.".format(name, ", ".join(BACKENDS)))
+    if name not in _instances:
+        if name == "ARCPY":
+            from .arcpy_backend import ArcpyBackend
+            _instances[name] = ArcpyBackend()
+        else:
+            from .gdal_backend import GdalBackend
+            _instances[name] = GdalBackend()
+    return _instances[name]
+
+
+def use(name):
+    """Selects the backend of this process, and of the worker processes that it starts"""
+    backend = get(name)
+    os.environ[BACKEND_ENV] = backend.name
+    return backend
+
+
+def message(text):
+    get().message(text)
+
+
+def warning(text):
+    get().warning(text)
+
+
+def error(text):
+    get().error(text)
@@ -0,0 +1,262 @@
+# file name:	backends/arcpy_backend.py
+# description:	ARCPY geoprocessing backend, which uses the ESRI arcpy module. Rasters are read with
+#               arcpy.RasterToNumPyArray and saved with the Copy Raster tool, features are read and written with the
+#               arcpy.da cursors, and the ARCGIS solar backend uses the Spatial Analyst solar radiation tools.
+# author:		South Fork Research, Inc.
+# dependencies: ESRI arcpy module, Spatial Analyst extension, numpy, raster_io.py
+
+import os
+import uuid
+import contextlib
+import arcpy
+import numpy as np
+import raster_io as rio
+from .base import Backend
+
+
+def _spatial_reference(spatial_ref):
+    """arcpy SpatialReference of a well-known text string, or None"""
+    if not spatial_ref:
+        return None
+    sr = arcpy.SpatialReference()
+    sr.loadFromString(spatial_ref)
+    return sr
+
+
+def _vertex_arrays(shape):
+    """Splits an arcpy geometry into vertex arrays, one per polyline part or polygon ring. Interior rings of a polygon
+    part are separated by a null point."""
+    if shape is None:
+        return None
+    arrays = []
+    for part in shape:
+        ring = []
+        for point in part:
+            if point is None:
+                if ring:
+                    arrays.append(np.array(ring, dtype=np.float64))
+                ring = []
+            else:
+                ring.append((point.X, point.Y))
+        if ring:
+            arrays.append(np.array(ring, dtype=np.float64))
+    return arrays
+
+
+class ArcpyBackend(Backend):
+
+    name = "ARCPY"
+    solar_tools = True
+
+    def __init__(self):
+        arcpy.env.overwriteOutput = True
+
+    def message(self, text):
+        arcpy.AddMessage(text)
+
+    def warning(self, text):
+        arcpy.AddWarning(text)
+
+    def error(self, text):
+        arcpy.AddError(text)
+
+    def check_out_extension(self, extension):
+        return arcpy.CheckOutExtension(extension) == "CheckedOut"
+
+    def check_in_extension(self, extension):
+        arcpy.CheckInExtension(extension)
+
+    def set_environment(self, in_raster, workspace):
+        arcpy.env.outputCoordinateSystem = in_raster
+        arcpy.env.snapRaster = in_raster
+        arcpy.env.mask = in_raster
+        arcpy.env.cellSize = arcpy.Describe(in_raster).meanCellHeight
+        arcpy.env.workspace = workspace
+        arcpy.env.scratchWorkspace = workspace
+        arcpy.env.extent = arcpy.Raster(in_raster).extent
+
+    def create_workspace(self, folder, name):
+        workspace = os.path.join(folder, name + ".gdb")
+        if not arcpy.Exists(workspace):
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            arcpy.CreateFileGDB_management(folder, name + ".gdb")
+        return workspace
+
+    def dataset_path(self, workspace, name):
+        return os.path.join(workspace, name)
+
+    def raster_grid(self, in_raster):
+        ras = arcpy.Raster(str(in_raster))
+        return rio.RasterGrid(ras.extent.XMin, ras.extent.YMax, ras.meanCellWidth, ras.height, ras.width,
+                              ras.spatialReference.exportToString())
+
+    def read_raster(self, in_raster, grid, window):
+        """Cells outside of an integer raster without a NoData value are read as 0"""
+        ras = arcpy.Raster(str(in_raster))
+        x, y = grid.lower_left(window)
+        if ras.pixelType.startswith("F"):
+            nodata = np.nan
+        else:
+            nodata = ras.noDataValue if ras.noDataValue is not None else 0
+        arr = arcpy.RasterToNumPyArray(ras, arcpy.Point(x, y), window[3] - window[2], window[1] - window[0], nodata)
+        arr = arr.astype(np.float32)
+        if ras.noDataValue is not None and not ras.pixelType.startswith("F"):
+            arr[arr == np.float32(ras.noDataValue)] = np.nan
+        return arr
+
+    def save_raster(self, bil_path, out_raster):
+        arcpy.CopyRaster_management(str(bil_path), out_raster)
+
+    @contextlib.contextmanager
+    def tiled_output(self, enabled=True):
+        """Sets the geoprocessing environment in raster_io.TILED_OUTPUT_ENV, and restores the previous environment on
+        exit"""
+        saved = {}
+        if enabled:
+            saved = dict([(name, getattr(arcpy.env, name)) for name in rio.TILED_OUTPUT_ENV])
+        try:
+            if enabled:
+                for name, value in rio.TILED_OUTPUT_ENV.items():
+                    setattr(arcpy.env, name, value)
+            yield
+        finally:
+            for name, value in saved.items():
+                setattr(arcpy.env, name, value)
+
+    def read_features(self, in_fc, fields, spatial_ref=None):
+        tokens = ["SHAPE@WKB" if field == "WKB@" else field for field in fields]
+        shape_index = [i for i, field in enumerate(fields) if field == "SHAPE@"]
+        wkb_index = [i for i, field in enumerate(fields) if field == "WKB@"]
+        with arcpy.da.SearchCursor(in_fc, tokens, spatial_reference=_spatial_reference(spatial_ref)) as cursor:
+            for row in cursor:
+                if shape_index or wkb_index:
+                    row = list(row)
+                    for i in shape_index:
+                        row[i] = _vertex_arrays(row[i])
+                    for i in wkb_index:
+                        row[i] = bytes(row[i]) if row[i] is not None else None
+                yield tuple(row)
+
+    def update_features(self, in_fc, fields, update):
+        with arcpy.da.UpdateCursor(in_fc, fields) as cursor:
+            for row in cursor:
+                cursor.updateRow(update(row))
+
+    def add_field(self, in_fc, field_name, field_type):
+        arcpy.AddField_management(in_fc, field_name, field_type)
+
+    def field_names(self, in_fc):
+        return [field.name for field in arcpy.ListFields(in_fc)]
+
+    def copy_features(self, in_fc, out_fc):
+        arcpy.CopyFeatures_management(in_fc, out_fc)
+        return out_fc
+
+    def make_layer(self, in_fc, layer_name):
+        arcpy.MakeFeatureLayer_management(in_fc, layer_name)
+        return layer_name
+
+    def extent(self, dataset):
+        desc = arcpy.Describe(dataset)
+        extent = desc.extent
+        return (extent.XMin, extent.YMin, extent.XMax, extent.YMax), desc.spatialReference.exportToString()
+
+    def latitude(self, x, y, spatial_ref):
+        """Projects the point to WGS 1984, rather than every feature of a feature class"""
+        point = arcpy.PointGeometry(arcpy.Point(x, y), _spatial_reference(spatial_ref))
+        return point.projectAs(arcpy.SpatialReference(4326)).firstPoint.Y
+
+    def exists(self, dataset):
+        return arcpy.Exists(dataset)
+
+    def delete(self, dataset):
+        arcpy.Delete_management(dataset)
+
+    def is_raster(self, dataset):
+        return arcpy.Describe(dataset).dataType in ("RasterDataset", "RasterBand", "RasterLayer")
+
+    def catalog_path(self, dataset):
+        path = str(dataset)
+        if not os.path.exists(path) and not os.path.exists(os.path.dirname(path)) and arcpy.Exists(path):
+            path = arcpy.Describe(path).catalogPath  # layer names
+        return path
+
+    def copy_dataset(self, from_dataset, out_dataset):
+        from_desc = arcpy.Describe(from_dataset)
+        # layer names are unique to each copy, so copies running at the same time in a process don't collide
+        layer = "from_lyr_{0}".format(uuid.uuid4().hex[:8])
+        if from_desc.dataType == "DbaseTable":
+            arcpy.MakeTableView_management(from_dataset, layer)
+            arcpy.CopyRows_management(layer, out_dataset)
+            arcpy.Delete_management(layer)
+        elif from_desc.dataType == "FeatureClass" or from_desc.dataType == "ShapeFile":
+            arcpy.MakeFeatureLayer_management(from_dataset, layer)
+            arcpy.CopyFeatures_management(layer, out_dataset)
+            arcpy.Delete_management(layer)
+        elif from_desc.dataType == "RasterDataset":
+            arcpy.MakeRasterLayer_management(from_dataset, layer)
+            arcpy.CopyRaster_management(layer, out_dataset)
+            arcpy.Delete_management(layer)
+        return out_dataset
+
+    def clear_memory(self, run_id=None):
+        workspace = arcpy.env.workspace
+        arcpy.env.workspace = r"IN_MEMORY"
+        arcpy.AddMessage("Deleting in_memory data...")
+
+        wild_card = "*_{0}".format(run_id) if run_id else ""
+        list_fc = arcpy.ListFeatureClasses(wild_card)
+        list_tbl = arcpy.ListTables(wild_card)
+
+        ### for each FeatClass in the list of fcs's, delete it.
+        for f in list_fc:
+            arcpy.Delete_management(f)
+            ### for each TableClass in the list of tab's, delete it.
+        for t in list_tbl:
+            arcpy.Delete_management(t)
+        arcpy.env.workspace = workspace
+
+    def area_solar_radiation(self, in_surface, out_raster, latitude, sky_size, time_config, day_intrvl, hour_intrvl):
+        area_solar = arcpy.sa.AreaSolarRadiation(in_surface, latitude, sky_size, time_config, day_intrvl, hour_intrvl)
+        area_solar.save(out_raster)
+        return out_raster
+
+    def points_solar_radiation(self, in_surface, in_mask, out_raster, scratch, latitude, sky_size, time_config,
+                               day_intrvl, hour_intrvl):
+        """Calculates solar insolation at the center of each stream corridor cell only. The whole surface is still
+        used to model shading.
+
+            Args:
+                in_mask: Stream corridor mask raster dataset, with a value of 1 within the corridor
+                scratch: RunScratch namespace of the run, for the corridor cell points
+        """
+        cellSize = arcpy.Describe(in_surface).meanCellHeight
+        corridor_pts = scratch.path("corridor_pts")
+        arcpy.RasterToPoint_conversion(in_mask, corridor_pts, "VALUE")
+        corridor_solar_pts = scratch.path("corridor_solar_pts")
+        arcpy.sa.PointsSolarRadiation(in_surface, corridor_pts, corridor_solar_pts, "", latitude, sky_size,
+                                      time_config, day_intrvl, hour_intrvl)
+        arcpy.PointToRaster_conversion(corridor_solar_pts, "T0", out_raster, "MAXIMUM", "", cellSize)
+        return out_raster
+
+    def solar_tile(self, in_surface, tile_path, read_xy, core_xy, latitude, sky_size, time_config, day_intrvl,
+                   hour_intrvl):
+        """Runs Area Solar Radiation over the read extent of a tile, and clips the result to the tile core"""
+        arcpy.env.overwriteOutput = True
+        arcpy.env.outputCoordinateSystem = in_surface
+        arcpy.env.snapRaster = in_surface
+        with self.licensed("Spatial"):
+            arcpy.env.extent = arcpy.Extent(*read_xy)
+            area_solar = arcpy.sa.AreaSolarRadiation(in_surface, latitude, sky_size, time_config, day_intrvl,
+                                                     hour_intrvl)
+            arcpy.env.extent = arcpy.Extent(*core_xy)
+            arcpy.Clip_management(area_solar, "{0} {1} {2} {3}".format(*core_xy), tile_path)
+        return tile_path
+
+    def mosaic(self, in_rasters, out_raster, in_surface, cell_size):
+        out_dir = os.path.dirname(out_raster)
+        out_name = os.path.basename(out_raster)
+        arcpy.MosaicToNewRaster_management(";".join(in_rasters), out_dir, out_name,
+                                           arcpy.Describe(in_surface).spatialReference, "32_BIT_FLOAT", cell_size, 1)
+        return out_raster
@@ -0,0 +1,196 @@
+# file name:	backends/base.py
+# description:	Interface of the geoprocessing backends. A backend reports tool messages, reads and writes rasters
+#               and feature classes, and provides the geoprocessing tools that have no NumPy equivalent (the ESRI solar
+#               radiation tools). Rasterizing features and zonal statistics use the NumPy engines in rasterize.py and
+#               zonal.py with every backend, reading features through the backend.
+# author:		South Fork Research, Inc.
+# dependencies: numpy
+
+import contextlib
+
+
+class Backend(object):
+    """Geoprocessing backend. Datasets are passed as paths (or, for the ARCPY backend, layer names), feature
+    geometry as lists of vertex arrays, and spatial references as well-known text strings."""
+
+    name = None
+    solar_tools = False  # True if the backend has the ESRI Area Solar Radiation and Points Solar Radiation tools
+
+    # messages
+
+    def message(self, text):
+        raise NotImplementedError
+
+    def warning(self, text):
+        raise NotImplementedError
+
+    def error(self, text):
+        raise NotImplementedError
+
+    # licenses and environment
+
+    def check_out_extension(self, extension):
+        """Checks out a license extension (i.e. Spatial), if the backend needs one"""
+        return True
+
+    def check_in_extension(self, extension):
+        return
+
+    @contextlib.contextmanager
+    def licensed(self, extension, enabled=True):
+        """Checks out a license extension for the duration of the context, and checks it back in on exit, so license
+        seats are only held while a run needs them.
+
+        Args:
+            enabled: If False, no license is checked out
+
+        Raises:
+            RuntimeError: if the extension license is not available
+        """
+        if enabled and not self.check_out_extension(extension):
+            raise RuntimeError("The {0} extension license is not available".format(extension))
+        try:
+            yield
+        finally:
+            if enabled:
+                self.check_in_extension(extension)
+
+    def set_environment(self, in_raster, workspace):
+        """Sets the processing environment of a run to the grid of a raster and a scratch workspace"""
+        return
+
+    def create_workspace(self, folder, name):
+        """Creates a scratch workspace in a folder, and returns its path"""
+        raise NotImplementedError
+
+    def dataset_path(self, workspace, name):
+        """Path of a new feature class in a workspace"""
+        raise NotImplementedError
+
+    # raster input and output
+
+    def raster_grid(self, in_raster):
+        """RasterGrid (see raster_io.py) of a raster dataset"""
+        raise NotImplementedError
+
+    def read_raster(self, in_raster, grid, window):
+        """Reads a (row start, row end, column start, column end) window of a raster, in its own grid, as float32
+        with NoData converted to NaN.
+
+        Args:
+            in_raster: Raster dataset
+            grid: RasterGrid of the raster, from raster_grid()
+            window: Window within the raster
+        """
+        raise NotImplementedError
+
+    def save_raster(self, bil_path, out_raster):
+        """Copies a BIL flat raster file to an output raster dataset, in the format given by the output name"""
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def tiled_output(self, enabled=True):
+        """Writes the rasters saved within the context as internally tiled, compressed rasters with overview
+        pyramids and statistics"""
+        yield
+
+    # rasterizing and zonal statistics, with the NumPy engines
+
+    def rasterize(self, in_fc, grid, out_bil, feature_type="POLYLINE"):
+        """Burns polyline or polygon features onto a grid (see rasterize.burn)"""
+        import rasterize as rz
+        return rz.burn(in_fc, grid, out_bil, feature_type)
+
+    def zonal_stats(self, zone_index, in_raster, percentiles=()):
+        """Statistics of a value raster for each zone of a zonal.ZoneIndex (see zonal.zonal_stats)"""
+        return zone_index.zonal_stats(in_raster, percentiles)
+
+    # feature input and output
+
+    def read_features(self, in_fc, fields, spatial_ref=None):
+        """Reads the features of a feature class.
+
+        Args:
+            in_fc: Feature class or layer
+            fields: Attribute field names, or the tokens OID@ (feature ID), SHAPE@ (a list of (n, 2) vertex arrays,
+                one per polyline part or polygon ring, or None for an empty geometry) and WKB@ (well-known binary
+                geometry, as bytes)
+            spatial_ref: Optional spatial reference that the geometry is projected to as it is read
+
+        Yields:
+            A tuple of the field values of each feature.
+        """
+        raise NotImplementedError
+
+    def update_features(self, in_fc, fields, update):
+        """Updates attribute values of every feature of a feature class.
+
+        Args:
+            in_fc: Feature class or layer
+            fields: Attribute field names, or the OID@ token. Geometry can't be updated.
+            update: Function called with a list of the field values of each feature, which returns the list of new
+                values
+        """
+        raise NotImplementedError
+
+    def add_field(self, in_fc, field_name, field_type):
+        """Adds an attribute field of an ESRI field type (DOUBLE, FLOAT, LONG, SHORT or TEXT)"""
+        raise NotImplementedError
+
+    def field_names(self, in_fc):
+        raise NotImplementedError
+
+    def copy_features(self, in_fc, out_fc):
+        raise NotImplementedError
+
+    def make_layer(self, in_fc, layer_name):
+        """Returns a dataset reference to a feature class that later calls can use, i.e. a feature layer"""
+        return in_fc
+
+    def extent(self, dataset):
+        """Extent of a feature class, as (xmin, ymin, xmax, ymax), and its spatial reference"""
+        raise NotImplementedError
+
+    def latitude(self, x, y, spatial_ref):
+        """Latitude of a point (decimal degrees), with coordinates in a spatial reference"""
+        raise NotImplementedError
+
+    # datasets
+
+    def exists(self, dataset):
+        raise NotImplementedError
+
+    def delete(self, dataset):
+        raise NotImplementedError
+
+    def is_raster(self, dataset):
+        """Checks if a dataset is a raster dataset, rather than a feature class or table"""
+        raise NotImplementedError
+
+    def catalog_path(self, dataset):
+        """Path of the dataset behind a layer name, or the dataset itself"""
+        return str(dataset)
+
+    def copy_dataset(self, from_dataset, out_dataset):
+        """Copies a raster, feature class or table that can't be copied file by file"""
+        raise NotImplementedError
+
+    def clear_memory(self, run_id=None):
+        """Deletes in-memory datasets, or only the in-memory datasets named with a run ID"""
+        return
+
+    # ESRI solar radiation tools, used by the ARCGIS solar backend
+
+    def area_solar_radiation(self, in_surface, out_raster, latitude, sky_size, time_config, day_intrvl, hour_intrvl):
+        raise NotImplementedError("The {0} backend has no Area Solar Radiation tool".format(self.name))
+
+    def points_solar_radiation(self, in_surface, in_mask, out_raster, scratch, latitude, sky_size, time_config,
+                               day_intrvl, hour_intrvl):
+        raise NotImplementedError("The {0} backend has no Points Solar Radiation tool".format(self.name))
+
+    def solar_tile(self, in_surface, tile_path, read_xy, core_xy, latitude, sky_size, time_config, day_intrvl,
+                   hour_intrvl):
+        raise NotImplementedError("The {0} backend has no Area Solar Radiation tool".format(self.name))
+
+    def mosaic(self, in_rasters, out_raster, in_surface, cell_size):
+        raise NotImplementedError("The {0} backend has no raster mosaic tool".format(self.name))
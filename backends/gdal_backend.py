@@ -0,0 +1,277 @@
+# file name:	backends/gdal_backend.py
+# description:	OPEN geoprocessing backend, which uses the GDAL/OGR Python bindings instead of arcpy, so the tools run
+#               on Linux machines without ArcGIS. Rasters are read and written with GDAL (GeoTIFF, ERDAS IMAGINE, BIL
+#               and any other format GDAL can read), and feature classes with OGR (shapefiles and GeoPackages, and
+#               file geodatabases for reading). Tool messages are written to standard output. The ESRI solar radiation
+#               tools are not available, so solar insolation is calculated with the NumPy solar backend.
+# author:		South Fork Research, Inc.
+# dependencies: GDAL/OGR Python bindings (osgeo), numpy, raster_io.py, stage_cache.py
+
+import os
+import sys
+import shutil
+import contextlib
+import numpy as np
+from osgeo import gdal, ogr, osr
+import raster_io as rio
+import stage_cache as sc
+from .base import Backend
+
+gdal.UseExceptions()
+ogr.UseExceptions()
+
+# GDAL raster driver of each output raster file extension
+RASTER_DRIVERS = {".tif": "GTiff",
+                  ".tiff": "GTiff",
+                  ".img": "HFA",
+                  ".bil": "EHdr",
+                  ".asc": "AAIGrid"}
+# OGR vector driver of each output feature class file extension, with GeoPackage for names without an extension
+VECTOR_DRIVERS = {".shp": "ESRI Shapefile",
+                  ".gpkg": "GPKG",
+                  ".geojson": "GeoJSON"}
+# OGR field type of each ESRI field type
+FIELD_TYPES = {"DOUBLE": ogr.OFTReal,
+               "FLOAT": ogr.OFTReal,
+               "LONG": ogr.OFTInteger,
+               "SHORT": ogr.OFTInteger,
+               "TEXT": ogr.OFTString}
+# GeoTIFF creation options matching raster_io.TILED_OUTPUT_ENV
+TILED_OPTIONS = ["TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512", "COMPRESS=LZW"]
+
+
+def _srs(spatial_ref):
+    """OSR spatial reference of a well-known text string (ESRI or OGC), with coordinates in x, y order"""
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(spatial_ref)
+    if hasattr(srs, "SetAxisMappingStrategy"):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def _vertex_arrays(geom):
+    """Splits an OGR geometry into vertex arrays, one per line string or polygon ring"""
+    if geom.GetGeometryCount() > 0:
+        arrays = []
+        for i in range(geom.GetGeometryCount()):
+            arrays.extend(_vertex_arrays(geom.GetGeometryRef(i)))
+        return arrays
+    if geom.GetPointCount() == 0:
+        return []
+    return [np.array(geom.GetPoints(), dtype=np.float64)[:, :2]]
+
+
+class GdalBackend(Backend):
+
+    name = "OPEN"
+    solar_tools = False
+
+    def __init__(self):
+        self.tiled = False
+
+    def message(self, text):
+        sys.stdout.write("{0}\n".format(text))
+        sys.stdout.flush()
+
+    def warning(self, text):
+        self.message("WARNING: {0}".format(text))
+
+    def error(self, text):
+        self.message("ERROR: {0}".format(text))
+
+    def create_workspace(self, folder, name):
+        workspace = os.path.join(folder, name)
+        if not os.path.isdir(workspace):
+            os.makedirs(workspace)
+        return workspace
+
+    def dataset_path(self, workspace, name):
+        # OGR can't create feature classes in a file geodatabase, so they are stored as GeoPackages in the folder
+        # containing it, as with util.get_scratch_folder
+        if str(workspace).lower().endswith(".gdb"):
+            workspace = os.path.dirname(str(workspace))
+        return os.path.join(workspace, name + ".gpkg")
+
+    def raster_grid(self, in_raster):
+        ds = gdal.Open(str(in_raster))
+        xmin, cell_width, row_rotation, ymax, col_rotation, cell_height = ds.GetGeoTransform()
+        if row_rotation or col_rotation or abs(abs(cell_height) - cell_width) > cell_width * 1e-6:
+            raise ValueError("The raster {0} is rotated or has non-square cells".format(in_raster))
+        return rio.RasterGrid(xmin, ymax, cell_width, ds.RasterYSize, ds.RasterXSize, ds.GetProjection())
+
+    def read_raster(self, in_raster, grid, window):
+        # the dataset is kept referenced while the band is read, because a band can outlive its dataset with older
+        # GDAL bindings
+        ds = gdal.Open(str(in_raster))
+        band = ds.GetRasterBand(1)
+        raw = band.ReadAsArray(int(window[2]), int(window[0]), int(window[3] - window[2]),
+                               int(window[1] - window[0]))
+        arr = raw.astype(np.float32)
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            arr[raw == raw.dtype.type(nodata)] = np.nan
+        band = None
+        ds = None
+        return arr
+
+    def save_raster(self, bil_path, out_raster):
+        ext = os.path.splitext(str(out_raster))[1].lower()
+        if ext not in RASTER_DRIVERS:
+            raise ValueError("The {0} backend can't write {1}. Use a GeoTIFF (.tif) output raster.".format(
+                self.name, out_raster))
+        options = TILED_OPTIONS if self.tiled and RASTER_DRIVERS[ext] == "GTiff" else []
+        out_dir = os.path.dirname(str(out_raster))
+        if out_dir and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        src = gdal.Open(str(bil_path))
+        dst = gdal.GetDriverByName(RASTER_DRIVERS[ext]).CreateCopy(str(out_raster), src, 0, options)
+        if self.tiled:
+            levels = []
+            size = max(dst.RasterXSize, dst.RasterYSize)
+            while size // (2 ** (len(levels) + 1)) >= 256:
+                levels.append(2 ** (len(levels) + 1))
+            if levels:
+                dst.BuildOverviews("BILINEAR", levels)
+            dst.GetRasterBand(1).ComputeStatistics(False)
+        dst = None
+        return out_raster
+
+    @contextlib.contextmanager
+    def tiled_output(self, enabled=True):
+        saved = self.tiled
+        self.tiled = self.tiled or enabled
+        try:
+            yield
+        finally:
+            self.tiled = saved
+
+    def _open_layer(self, in_fc, update=False):
+        """Opens the first layer of a vector dataset. Returns the data source, which must be kept open while the
+        layer is used, and the layer."""
+        ds = ogr.Open(str(in_fc), 1 if update else 0)
+        if ds is None:
+            raise IOError("Unable to open {0}".format(in_fc))
+        return ds, ds.GetLayer(0)
+
+    def read_features(self, in_fc, fields, spatial_ref=None):
+        ds, layer = self._open_layer(in_fc)
+        transform = None
+        source = layer.GetSpatialRef()
+        if spatial_ref and source is not None:
+            target = _srs(spatial_ref)
+            if hasattr(source, "SetAxisMappingStrategy"):
+                source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            if not source.IsSame(target):
+                transform = osr.CoordinateTransformation(source, target)
+        layer.ResetReading()
+        for feature in layer:
+            geom = feature.GetGeometryRef()
+            if geom is not None and transform is not None:
+                geom = geom.Clone()
+                geom.Transform(transform)
+            row = []
+            for field in fields:
+                if field == "OID@":
+                    row.append(feature.GetFID())
+                elif field == "SHAPE@":
+                    row.append(_vertex_arrays(geom) if geom is not None else None)
+                elif field == "WKB@":
+                    row.append(bytes(geom.ExportToWkb()) if geom is not None else None)
+                else:
+                    row.append(feature.GetField(field))
+            yield tuple(row)
+        ds = None
+
+    def update_features(self, in_fc, fields, update):
+        ds, layer = self._open_layer(in_fc, True)
+        # every row is written in a single transaction, so GeoPackages are not committed row by row
+        layer.StartTransaction()
+        try:
+            layer.ResetReading()
+            for feature in layer:
+                row = [feature.GetFID() if field == "OID@" else feature.GetField(field) for field in fields]
+                for field, value in zip(fields, update(row)):
+                    if field == "OID@":
+                        continue
+                    if value is None:
+                        feature.UnsetField(field)
+                    else:
+                        feature.SetField(field, value)
+                layer.SetFeature(feature)
+        except Exception:
+            layer.RollbackTransaction()
+            raise
+        layer.CommitTransaction()
+        ds.FlushCache()
+        ds = None
+
+    def add_field(self, in_fc, field_name, field_type):
+        ds, layer = self._open_layer(in_fc, True)
+        if field_name not in self.field_names(in_fc):
+            layer.StartTransaction()
+            try:
+                layer.CreateField(ogr.FieldDefn(field_name, FIELD_TYPES[field_type.upper()]))
+            except Exception:
+                layer.RollbackTransaction()
+                raise
+            layer.CommitTransaction()
+        ds = None
+
+    def field_names(self, in_fc):
+        ds, layer = self._open_layer(in_fc)
+        defn = layer.GetLayerDefn()
+        return [defn.GetFieldDefn(i).GetName() for i in range(defn.GetFieldCount())]
+
+    def copy_features(self, in_fc, out_fc):
+        ext = os.path.splitext(str(out_fc))[1].lower()
+        driver = ogr.GetDriverByName(VECTOR_DRIVERS.get(ext, "GPKG"))
+        if os.path.exists(str(out_fc)):
+            self.delete(out_fc)
+        out_dir = os.path.dirname(str(out_fc))
+        if out_dir and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        src, layer = self._open_layer(in_fc)
+        dst = driver.CreateDataSource(str(out_fc))
+        dst.CopyLayer(layer, os.path.splitext(os.path.basename(str(out_fc)))[0])
+        dst = None
+        return out_fc
+
+    def extent(self, dataset):
+        ds, layer = self._open_layer(dataset)
+        xmin, xmax, ymin, ymax = layer.GetExtent()
+        srs = layer.GetSpatialRef()
+        return (xmin, ymin, xmax, ymax), srs.ExportToWkt() if srs is not None else ""
+
+    def latitude(self, x, y, spatial_ref):
+        wgs84 = osr.SpatialReference()
+        wgs84.ImportFromEPSG(4326)
+        if hasattr(wgs84, "SetAxisMappingStrategy"):
+            wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        return osr.CoordinateTransformation(_srs(spatial_ref), wgs84).TransformPoint(x, y)[1]
+
+    def exists(self, dataset):
+        return os.path.exists(str(dataset))
+
+    def is_raster(self, dataset):
+        """Vector sources raise an error rather than returning None, because GDAL exceptions are enabled"""
+        try:
+            return gdal.OpenEx(str(dataset), gdal.OF_RASTER) is not None
+        except RuntimeError:
+            return False
+
+    def delete(self, dataset):
+        path = str(dataset)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+            return
+        for file_path in sc.dataset_files(path):
+            os.remove(file_path)
+
+    def copy_dataset(self, from_dataset, out_dataset):
+        if self.is_raster(from_dataset):
+            src = gdal.Open(str(from_dataset))
+            ext = os.path.splitext(str(out_dataset))[1].lower()
+            dst = gdal.GetDriverByName(RASTER_DRIVERS.get(ext, "GTiff")).CreateCopy(str(out_dataset), src, 0)
+            dst = None
+            return out_dataset
+        return self.copy_features(from_dataset, out_dataset)
@@ -0,0 +1,288 @@
+# file name:	batch.py
+# description:	Headless batch runner for the Solar Stream Tools. Reads a manifest (CSV or JSON) of watersheds, input
+#               datasets, time windows and realization names, and runs the Create Riverscapes Project, Generate Solar
+#               Insolation Surface and Solar Insolation for a Stream Network tools for each job. Jobs run in separate
+#               worker processes, each with its own scratch workspace under the batch scratch folder. The status,
+#               wall time and outputs of every job are recorded in a JSON ledger, so a batch that is interrupted or
+#               has failed jobs can be rerun, and jobs whose outputs are newer than their inputs are skipped.
+# author:		South Fork Research, Inc.
+# dependencies: backends, create_project.py, solar_raster.py, solar_vector.py, riverscapes.py, stage_cache.py
+#
+# usage:        python batch.py <manifest.csv|manifest.json> <scratch folder> [--processes N] [--ledger ledger.json]
+#               [--force] [--backend ARCPY|OPEN]
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import traceback
+import multiprocessing
+import backends
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+LEDGER_NAME = "batch_ledger.json"
+# manifest columns required for every job
+REQUIRED_FIELDS = ["in_dem", "in_canopy", "in_stream", "in_strm_area", "time_config", "day_intrvl", "hour_intrvl",
+                   "out_raster", "out_fc"]
+# optional manifest columns, and their defaults
+OPTIONAL_FIELDS = {"job": "",
+                   "region": "",
+                   "watershed": "",
+                   "project_name": "",
+                   "rs_dir": "",
+                   "real_name": "",
+                   "in_strm_indx": "LineOID",
+                   "solar_backend": "ARCGIS",
+                   "tile_size": "0",
+                   "search_distance": "",
+                   "processes": "1",
+                   "corridor_buffer": "",
+                   "tile_latitude": "false",
+                   "tiled_tiff": "false",
+                   "raster_storage": "FLOAT32",
+                   "field_storage": "FLOAT64",
+                   "storage_scale": "1.0",
+                   "storage_offset": "0.0"}
+INPUT_FIELDS = ["in_dem", "in_canopy", "in_stream", "in_strm_area"]
+OUTPUT_FIELDS = ["out_raster", "out_fc"]
+
+
+def read_manifest(manifest_path):
+    """Reads the jobs of a batch manifest. CSV manifests have a header row with the field names, and JSON manifests
+    are a list of objects.
+
+    Returns:
+        A list of job dictionaries, with optional fields set to their defaults and a unique job ID.
+    """
+    if manifest_path.lower().endswith(".json"):
+        with open(manifest_path, "r") as f:
+            rows = json.load(f)
+    else:
+        with open(manifest_path, "r") as f:
+            rows = [row for row in csv.DictReader(f)]
+    jobs = []
+    job_ids = set()
+    for i, row in enumerate(rows):
+        job = dict(OPTIONAL_FIELDS)
+        job.update(dict([(k.strip(), str(v).strip()) for k, v in row.items() if k and v not in (None, "")]))
+        missing = [field for field in REQUIRED_FIELDS if not job.get(field)]
+        if missing:
+            raise ValueError("Manifest job {0} is missing {1}".format(i + 1, ", ".join(missing)))
+        if job["rs_dir"] and not (job["watershed"] and job["real_name"]):
+            raise ValueError("Manifest job {0} is a Riverscapes project, and needs a watershed and real_name"
+                             .format(i + 1))
+        if not job["job"]:
+            job["job"] = "_".join([v for v in [job["watershed"], job["real_name"]] if v]) or "job{0}".format(i + 1)
+        job["job"] = re.sub(r"[^A-Za-z0-9_]", "_", job["job"])
+        if job["job"] in job_ids:
+            raise ValueError("Manifest job ID {0} is not unique".format(job["job"]))
+        job_ids.add(job["job"])
+        jobs.append(job)
+    return jobs
+
+
+def job_key(job):
+    """Hashes the settings of a job, so that a job is rerun if any of its settings change"""
+    return hashlib.sha1(json.dumps(job, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_ledger(ledger_path):
+    if os.path.isfile(ledger_path):
+        with open(ledger_path, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def save_ledger(ledger, ledger_path):
+    """Writes the ledger to a temporary file first, so an interrupted batch never leaves a partial ledger"""
+    tmp_path = ledger_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(ledger, f, indent=2, sort_keys=True)
+    if os.path.isfile(ledger_path):
+        os.remove(ledger_path)
+    os.rename(tmp_path, ledger_path)
+
+
+def newest_mtime(datasets):
+    """Latest modification time of the files storing a list of datasets, or None if any dataset has no files"""
+    import stage_cache as sc
+    mtimes = []
+    for dataset in datasets:
+        files = sc.dataset_files(dataset)
+        if not files:
+            return None
+        mtimes.append(max([os.path.getmtime(f) for f in files]))
+    return max(mtimes)
+
+
+def is_current(job, entry):
+    """Checks if a job completed with its current settings, and all of its outputs are newer than its inputs"""
+    if not entry or entry.get("status") != "done" or entry.get("key") != job_key(job):
+        return False
+    inputs = newest_mtime([job[field] for field in INPUT_FIELDS])
+    outputs = [newest_mtime([job[field]]) for field in OUTPUT_FIELDS]
+    if inputs is None or None in outputs:
+        return False
+    return min(outputs) >= inputs
+
+
+def run_job(job, scratch_root):
+    """Runs all of the tools for one job in the current process, with a scratch workspace used only by this job.
+
+    Returns:
+        A dictionary of the job outputs.
+    """
+    import create_project
+    import riverscapes as rs
+    import solar_raster
+    import solar_vector
+
+    gp = backends.get()
+    workspace_temp = gp.create_workspace(os.path.join(scratch_root, job["job"]), "scratch")
+
+    rs_bool = "true" if job["rs_dir"] else "false"
+    # realization IDs are unique per job, so jobs started in the same minute never share a realization folder
+    real_id = rs.getRealID("{0}_{1}".format(time.strftime("%Y%m%d%H%M%S"), job["job"]))
+    if job["rs_dir"] and not os.path.isfile(os.path.join(job["rs_dir"], "project.rs.xml")):
+        create_project.main(job["rs_dir"], job["region"], job["watershed"], job["project_name"])
+
+    solar_raster.main(job["in_dem"], job["in_canopy"], job["in_stream"], job["in_strm_area"], workspace_temp,
+                      job["time_config"], job["day_intrvl"], job["hour_intrvl"], job["out_raster"], rs_bool,
+                      job["rs_dir"], job["project_name"], job["real_name"], job["solar_backend"], job["tile_size"],
+                      job["search_distance"], job["processes"], job["corridor_buffer"], False, job["tile_latitude"],
+                      job["tiled_tiff"], job["raster_storage"], job["storage_scale"], job["storage_offset"],
+                      real_id)
+    solar_vector.main(job["out_raster"], job["in_stream"], job["in_strm_indx"], job["in_strm_area"], job["out_fc"],
+                      workspace_temp, rs_bool, job["rs_dir"], job["project_name"], job["real_name"],
+                      job["processes"], False, job["field_storage"], job["storage_scale"], job["storage_offset"])
+
+    missing = [job[field] for field in OUTPUT_FIELDS if not gp.exists(job[field])]
+    if missing:
+        raise RuntimeError("Job finished without writing " + ", ".join(missing))
+    outputs = dict([(field, job[field]) for field in OUTPUT_FIELDS])
+    if job["rs_dir"]:
+        outputs["rs_xml"] = os.path.join(job["rs_dir"], "project.rs.xml")
+    return outputs
+
+
+def job_worker(job, scratch_root, results):
+    """Worker process entry point. Tool messages are written to a log file in the job scratch folder, and the job
+    result is put on the results queue."""
+    job_dir = os.path.join(scratch_root, job["job"])
+    if not os.path.isdir(job_dir):
+        os.makedirs(job_dir)
+    log_path = os.path.join(job_dir, "job.log")
+    sys.stdout = sys.stderr = open(log_path, "a")
+    start = time.time()
+    result = {"job": job["job"], "log": log_path}
+    try:
+        result["outputs"] = run_job(job, scratch_root)
+        result["status"] = "done"
+    except (Exception, SystemExit):
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+        print(result["error"])
+    result["wall_time"] = round(time.time() - start, 1)
+    sys.stdout.flush()
+    results.put(result)
+
+
+def run_batch(manifest_path, scratch_root, processes=1, ledger_path=None, force=False):
+    """Runs every job of a manifest that is not already current, with up to a number of jobs at the same time.
+    Each job runs in a new process, so that arcpy environment settings and in_memory datasets are never shared
+    between jobs.
+
+    Args:
+        manifest_path: CSV or JSON manifest of jobs
+        scratch_root: Folder for the job scratch workspaces, logs and ledger
+        processes: Number of jobs to run at the same time. 0 uses all available CPUs.
+        ledger_path: JSON status ledger. Defaults to batch_ledger.json in the scratch folder.
+        force: Rerun jobs even if they are current
+
+    Returns:
+        The ledger dictionary, of job ID to status, wall time, outputs and errors.
+    """
+    import tiling
+    jobs = read_manifest(manifest_path)
+    if not os.path.isdir(scratch_root):
+        os.makedirs(scratch_root)
+    ledger_path = ledger_path or os.path.join(scratch_root, LEDGER_NAME)
+    ledger = load_ledger(ledger_path)
+    processes = int(processes) if processes else 0
+    processes = processes if processes > 0 else multiprocessing.cpu_count()
+
+    pending = []
+    for job in jobs:
+        if not force and is_current(job, ledger.get(job["job"])):
+            print("Skipping {0}, outputs are current".format(job["job"]))
+            continue
+        ledger[job["job"]] = {"status": "pending", "key": job_key(job)}
+        pending.append(job)
+    save_ledger(ledger, ledger_path)
+
+    tiling.set_worker_executable()
+    results = multiprocessing.Queue()
+    running = {}
+    while pending or running:
+        # jobs that write to the same Riverscapes project are run one at a time, so the project XML is never
+        # written by two jobs at once
+        busy = set([job["rs_dir"] for job, worker in running.values() if job["rs_dir"]])
+        ready = [job for job in pending if not job["rs_dir"] or job["rs_dir"] not in busy]
+        while ready and len(running) < processes:
+            job = ready.pop(0)
+            pending.remove(job)
+            if job["rs_dir"]:
+                ready = [j for j in ready if j["rs_dir"] != job["rs_dir"]]
+            worker = multiprocessing.Process(target=job_worker, args=(job, scratch_root, results))
+            worker.start()
+            running[job["job"]] = (job, worker)
+            ledger[job["job"]].update({"status": "running", "started": time.strftime("%Y-%m-%d %H:%M:%S")})
+            save_ledger(ledger, ledger_path)
+            print("Started {0}".format(job["job"]))
+        try:
+            result = results.get(timeout=5)
+        except Empty:
+            # a worker that exits without a result (i.e. killed, or crashed in arcpy) is a failed job
+            for job_id, (job, worker) in list(running.items()):
+                if not worker.is_alive() and results.empty():
+                    worker.join()
+                    ledger[job_id].update({"status": "failed",
+                                           "error": "Worker exited with code {0}".format(worker.exitcode)})
+                    save_ledger(ledger, ledger_path)
+                    print("Failed {0}".format(job_id))
+                    del running[job_id]
+            continue
+        job_id = result.pop("job")
+        running.pop(job_id)[1].join()
+        ledger[job_id].update(result)
+        save_ledger(ledger, ledger_path)
+        print("{0} {1} in {2} s".format(result["status"].capitalize(), job_id, result["wall_time"]))
+
+    failed = [job["job"] for job in jobs if ledger.get(job["job"], {}).get("status") == "failed"]
+    if failed:
+        print("{0} job(s) failed: {1}. Rerun the batch to retry them.".format(len(failed), ", ".join(failed)))
+    return ledger
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the Solar Stream Tools for every job of a manifest.")
+    parser.add_argument("manifest", help="CSV or JSON manifest of jobs")
+    parser.add_argument("scratch", help="Folder for the job scratch workspaces, logs and status ledger")
+    parser.add_argument("--processes", type=int, default=1, help="Number of jobs to run at the same time")
+    parser.add_argument("--ledger", default=None, help="JSON status ledger (default: batch_ledger.json in scratch)")
+    parser.add_argument("--force", action="store_true", help="Rerun jobs whose outputs are current")
+    parser.add_argument("--backend", choices=backends.BACKENDS, default=None,
+                        help="Geoprocessing backend (default: ARCPY if arcpy is installed, otherwise OPEN)")
+    args = parser.parse_args()
+    if args.backend:
+        backends.use(args.backend)
+    ledger = run_batch(args.manifest, args.scratch, args.processes, args.ledger, args.force)
+    jobs = read_manifest(args.manifest)
+    sys.exit(1 if [job for job in jobs if ledger[job["job"]].get("status") == "failed"] else 0)
@@ -0,0 +1,286 @@
+# file name:	run_benchmarks.py
+# description:	Offline benchmarks of the NumPy processing stages of the Solar Raster and Solar Vector tools, on
+#               synthetic watersheds of several grid sizes (see synthetic.py). Each grid size runs in its own Python
+#               process, which generates the inputs, then times rasterizing the stream network and bankfull polygons,
+#               building the vegetation and topography surface and the stream corridor mask, calculating insolation
+#               for the stream corridor, dividing the stream area by segment, updating the division for an edited
+#               segment (the incremental mode, which is also checked against the full division), summarizing the
+#               segments and writing the segment field. Stages are timed with profiling.Profiler, and the report lists wall time, CPU
+#               time, throughput (cells or segments per second) and the peak memory of the process at the end of each
+#               stage. Results can be saved as JSON and compared to a previous run to find performance regressions.
+#
+#               Runs without ArcGIS: when arcpy can't be imported, the arcpy stand-in in benchmarks/standin is used
+#               for the feature cursors of the ARCPY geoprocessing backend, and all rasters are BIL flat files.
+#
+#               usage: python benchmarks/run_benchmarks.py --sizes 1000 2000 4000 --output results.json
+#                      python benchmarks/run_benchmarks.py --baseline results.json
+# author:		South Fork Research, Inc.
+# dependencies: numpy, backends, rasterize.py, surface.py, tiling.py, segments.py, zonal.py, profiling.py,
+#               synthetic.py, ESRI arcpy module (optional)
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+try:
+    import arcpy
+except ImportError:
+    sys.path.insert(0, os.path.join(BENCH_DIR, "standin"))
+    import arcpy
+import backends
+# the synthetic feature classes are arcpy (or stand-in) feature classes
+backends.use("ARCPY")
+
+import numpy as np
+import rasterize as rz
+import surface as sf
+import tiling
+import segments
+import zonal
+import profiling
+import synthetic
+
+DEFAULT_SIZES = [1000, 2000, 4000]
+# throughput unit of each stage, which is the count that the stage's processing time scales with
+STAGE_UNITS = [("synthetic_data", "cells"),
+               ("rasterize_lines", "cells"),
+               ("rasterize_polygons", "cells"),
+               ("fuse_surface", "cells"),
+               ("corridor_mask", "cells"),
+               ("solar_radiation", "cells"),
+               ("segment_hashes", "segments"),
+               ("segment_zones", "segments"),
+               ("segment_vertices", "segments"),
+               ("stream_area_cells", "cells"),
+               ("nearest_segment", "cells"),
+               ("update_zones", "segments"),
+               ("zonal_stats", "cells"),
+               ("zonal_stats_subset", "cells"),
+               ("write_field", "segments")]
+
+
+def run_size(size, args):
+    """Generates the inputs for one grid size and times each stage.
+
+    Returns:
+        A dictionary of the grid size, cell and segment counts, and the stage totals from profiling.Profiler.
+    """
+    work_dir = os.path.join(args.workdir, "size_{0}".format(size))
+    grid = synthetic.make_grid(size, args.cell_size)
+    prof = profiling.Profiler("benchmark_{0}".format(size))
+
+    with prof.stage("synthetic_data"):
+        data = synthetic.watershed(os.path.join(work_dir, "inputs"), grid, args.seed, args.basin_cells)
+
+    # Solar Raster stages
+    strm_ras = os.path.join(work_dir, "strm_ras.bil")
+    poly_ras = os.path.join(work_dir, "poly_ras.bil")
+    surface = os.path.join(work_dir, "surface.bil")
+    strm_mask = os.path.join(work_dir, "strm_mask.bil")
+    with prof.stage("rasterize_lines", [strm_ras]):
+        rz.burn(data["stream"], grid, strm_ras, "POLYLINE")
+    with prof.stage("rasterize_polygons", [poly_ras]):
+        rz.burn(data["bankfull"], grid, poly_ras, "POLYGON")
+    with prof.stage("fuse_surface", [surface, strm_mask]):
+        sf.fuse_surface(data["dem"], data["canopy"], strm_ras, poly_ras, surface, strm_mask)
+    corridor_mask = os.path.join(work_dir, "corridor.bil")
+    with prof.stage("corridor_mask", [corridor_mask]):
+        corridor_cells = sf.expand_mask(strm_mask, corridor_mask, int(np.ceil(args.corridor_buffer / grid.cell_size)))
+    solar = surface
+    if not args.skip_solar:
+        solar = os.path.join(work_dir, "solar.bil")
+        with prof.stage("solar_radiation", [solar]):
+            tiling.tiled_solar(surface, solar, work_dir, synthetic.LATITUDE, args.sky_size, args.time_config,
+                               args.day_interval, args.hour_interval, "NUMPY", args.tile_size, args.search_distance,
+                               args.processes, corridor_mask)
+
+    # Solar Vector stages
+    seg_zones = os.path.join(work_dir, "seg_zones.bil")
+    with prof.stage("segment_hashes"):
+        hashes = segments.segment_hashes(data["stream"])
+    with prof.stage("segment_zones", [seg_zones]):
+        segments.segment_zones(data["stream"], [strm_ras, poly_ras], grid, seg_zones, processes=args.processes)
+        zone_index = zonal.ZoneIndex.from_raster(seg_zones, grid)
+    with prof.stage("update_zones"):
+        affected = check_incremental(zone_index, hashes, data["stream"], [strm_ras, poly_ras])
+    with prof.stage("zonal_stats"):
+        stats = zone_index.zonal_stats(solar)
+    with prof.stage("zonal_stats_subset"):
+        zone_index.subset(affected).zonal_stats(solar)
+    backends.get().add_field(data["stream"], "area_solar", "DOUBLE")
+    with prof.stage("write_field"):
+        zonal.write_field(data["stream"], "OID@", stats["MAX"], "area_solar")
+    prof.finish()
+
+    return {"size": size,
+            "cells": grid.nrows * grid.ncols,
+            "segments": data["segments"],
+            "corridor_cells": corridor_cells,
+            "arcpy": "stand-in" if getattr(arcpy, "STANDIN", False) else "ArcGIS",
+            "stages": prof.summary()}
+
+
+def check_incremental(zone_index, hashes, in_stream, in_area):
+    """Runs the incremental mode of the Solar Vector tool on the benchmark network. With no changed segments, the
+    updated index must be the same as the full index. One segment is then marked as edited, by changing its stored
+    hash, and the updated index must still cover the same stream area cells.
+
+    Returns:
+        The set of zone IDs that were divided again for the edited segment.
+    """
+    index, affected = segments.update_zones(zone_index, hashes, hashes, in_stream, in_area)
+    if affected or not all([np.array_equal(a, b) for a, b in zip(index.cells(), zone_index.cells())]):
+        raise RuntimeError("The incremental zone index of an unchanged stream network differs from the full index")
+    edited = dict(hashes)
+    key = sorted(edited)[len(edited) // 2]
+    edited[key] = [edited[key][0], "edited"]
+    index, affected = segments.update_zones(zone_index, edited, hashes, in_stream, in_area)
+    if hashes[key][0] not in affected:
+        raise RuntimeError("The incremental zone index did not divide the edited segment again")
+    old_rows, old_cols = zone_index.cells()[:2]
+    new_rows, new_cols = index.cells()[:2]
+    if not (np.array_equal(old_rows, new_rows) and np.array_equal(old_cols, new_cols)):
+        raise RuntimeError("The incremental zone index does not cover the same stream area cells as the full index")
+    return affected
+
+
+def run_worker(size, args, result_path):
+    """Runs one grid size in a new Python process, so that each size starts with a fresh peak memory counter"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", str(size), "--result", result_path,
+           "--workdir", args.workdir, "--cell-size", str(args.cell_size), "--seed", str(args.seed),
+           "--basin-cells", str(args.basin_cells), "--processes", str(args.processes),
+           "--tile-size", str(args.tile_size), "--search-distance", str(args.search_distance),
+           "--corridor-buffer", str(args.corridor_buffer), "--time-config", args.time_config,
+           "--day-interval", str(args.day_interval), "--hour-interval", str(args.hour_interval),
+           "--sky-size", str(args.sky_size)]
+    if args.skip_solar:
+        cmd.append("--skip-solar")
+    log_path = os.path.join(args.workdir, "size_{0}.log".format(size))
+    with open(log_path, "w") as log:
+        code = subprocess.call(cmd, stdout=None if args.verbose else log, stderr=subprocess.STDOUT)
+    if code != 0 or not os.path.isfile(result_path):
+        with open(log_path, "r") as log:
+            raise RuntimeError("Benchmark of grid size {0} failed:\n{1}".format(size, log.read()[-4000:]))
+    with open(result_path, "r") as f:
+        return json.load(f)
+
+
+def throughput(result, stage):
+    """Cells or segments processed per second by a stage, with the unit"""
+    unit = dict(STAGE_UNITS).get(stage["name"], "cells")
+    count = result["cells"] if unit == "cells" else result["segments"]
+    return count / max(stage["wall_time"], 1e-9), unit
+
+
+def report(results, baseline=None, tolerance=0.25):
+    """Prints the results of each grid size, compared to the baseline results if supplied.
+
+    Returns:
+        A list of (size, stage name, time ratio) tuples for stages that were slower than the baseline by more than
+        the tolerance.
+    """
+    regressions = []
+    base = {}
+    for result in baseline or []:
+        for stage in result["stages"]:
+            base[(result["size"], stage["name"])] = stage["wall_time"]
+    for result in results:
+        print("")
+        print("Grid {0} x {0}: {1} cells, {2} segments, {3} corridor cells (arcpy {4})".format(
+            result["size"], result["cells"], result["segments"], result["corridor_cells"], result["arcpy"]))
+        header = "{0:<20}{1:>10}{2:>10}{3:>22}{4:>14}".format("stage", "wall (s)", "cpu (s)", "throughput",
+                                                              "peak (MB)")
+        if base:
+            header += "{0:>14}".format("vs baseline")
+        print(header)
+        for stage in result["stages"]:
+            rate, unit = throughput(result, stage)
+            peak = "{0:.0f}".format(stage["peak_rss"] / 1048576.0) if stage["peak_rss"] is not None else "-"
+            line = "{0:<20}{1:>10.2f}{2:>10.2f}{3:>22}{4:>14}".format(
+                stage["name"], stage["wall_time"], stage["cpu_time"], "{0:,.0f} {1}/s".format(rate, unit), peak)
+            key = (result["size"], stage["name"])
+            if key in base and base[key] > 0:
+                ratio = stage["wall_time"] / base[key]
+                line += "{0:>13.2f}x".format(ratio)
+                if ratio > 1.0 + tolerance and stage["name"] != "synthetic_data":
+                    regressions.append((result["size"], stage["name"], ratio))
+                    line += "  SLOWER"
+            print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the Solar Stream processing stages on synthetic "
+                                                 "watersheds.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Grid sizes to benchmark, in cells per side")
+    parser.add_argument("--cell-size", type=float, default=1.0, help="Grid cell size (meters)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic inputs")
+    parser.add_argument("--basin-cells", type=int, default=500, help="Width of each stream network basin, in cells")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes for the parallel stages")
+    parser.add_argument("--tile-size", type=int, default=tiling.DEFAULT_TILE_SIZE,
+                        help="Insolation tile size, in cells per side")
+    parser.add_argument("--search-distance", type=float, default=1000.0,
+                        help="Insolation horizon search distance (meters)")
+    parser.add_argument("--corridor-buffer", type=float, default=10.0,
+                        help="Stream corridor buffer (meters) for the insolation stage")
+    parser.add_argument("--time-config", default="MultiDays 2016 182 243", help="Insolation time configuration")
+    parser.add_argument("--day-interval", type=float, default=7, help="Insolation day interval")
+    parser.add_argument("--hour-interval", type=float, default=2, help="Insolation hour interval")
+    parser.add_argument("--sky-size", type=int, default=400, help="Insolation sky size")
+    parser.add_argument("--skip-solar", action="store_true",
+                        help="Skip the insolation stage, and summarize the surface raster instead")
+    parser.add_argument("--workdir", help="Folder for the synthetic data. Defaults to a temporary folder, which is "
+                                          "deleted when the benchmarks finish.")
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Fraction that a stage can be slower than the baseline before it is reported")
+    parser.add_argument("--verbose", action="store_true", help="Show the tool messages of each grid size")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        result = run_size(args.worker, args)
+        with open(args.result, "w") as f:
+            json.dump(result, f, indent=1)
+        return 0
+
+    temp_dir = args.workdir is None
+    if temp_dir:
+        args.workdir = tempfile.mkdtemp(prefix="solarstream_bench_")
+    elif not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+    try:
+        results = []
+        for size in args.sizes:
+            print("Benchmarking grid size {0} x {0}...".format(size))
+            results.append(run_worker(size, args, os.path.join(args.workdir, "result_{0}.json".format(size))))
+    finally:
+        if temp_dir:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.tolerance)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    if regressions:
+        print("")
+        print("{0} stage(s) slower than the baseline by more than {1:.0%}".format(len(regressions), args.tolerance))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
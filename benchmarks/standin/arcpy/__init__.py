@@ -0,0 +1,225 @@
+# file name:	arcpy/__init__.py
+# description:	Minimal stand-in for the parts of the ESRI arcpy module that are used by the NumPy processing stages, so
+#               that the benchmarks can run on a machine without ArcGIS. Feature classes are held in memory for the
+#               life of the process, and features are read in their stored coordinates (no projection on the fly).
+#               Raster tools only support BIL flat files. This module is only put on the Python path by
+#               benchmarks/run_benchmarks.py when arcpy can't be imported, and is not a replacement for arcpy.
+# author:		South Fork Research, Inc.
+# dependencies: none
+
+import os
+import copy
+import shutil
+import struct
+
+STANDIN = True  # lets the benchmarks report which arcpy they ran with
+
+FEATURE_CLASSES = {}  # feature classes and layers, keyed by normalized path or layer name
+
+
+class ExecuteError(Exception):
+    pass
+
+
+class _Env(object):
+    def __init__(self):
+        self.workspace = None
+        self.scratchWorkspace = None
+        self.overwriteOutput = True
+        self.outputCoordinateSystem = None
+        self.snapRaster = None
+        self.extent = None
+
+
+env = _Env()
+
+
+def AddMessage(message):
+    print(message)
+
+
+def AddWarning(message):
+    print("WARNING: {0}".format(message))
+
+
+def AddError(message):
+    print("ERROR: {0}".format(message))
+
+
+def CheckOutExtension(extension):
+    return "CheckedOut"
+
+
+def CheckInExtension(extension):
+    return "CheckedIn"
+
+
+class Point(object):
+    def __init__(self, X=0.0, Y=0.0, Z=None, M=None, ID=None):
+        self.X = X
+        self.Y = Y
+        self.Z = Z
+        self.M = M
+        self.ID = ID
+
+
+class Array(list):
+    def add(self, item):
+        self.append(item)
+
+    @property
+    def count(self):
+        return len(self)
+
+
+class SpatialReference(object):
+    def __init__(self, item=None):
+        self.factoryCode = item if isinstance(item, int) else 0
+        self.wkt = ""
+
+    def loadFromString(self, string):
+        self.wkt = string
+
+    def exportToString(self):
+        return self.wkt
+
+
+class Geometry(object):
+    """Polyline or polygon geometry, stored as a list of parts. Polygon parts may contain a None point between rings,
+    the same as arcpy."""
+    WKB_TYPES = {"polyline": 5, "polygon": 6}  # MultiLineString and MultiPolygon
+
+    def __init__(self, shape_type, inputs, spatial_reference=None):
+        self.type = shape_type
+        self.spatialReference = spatial_reference
+        if len(inputs) and isinstance(inputs[0], (list, tuple)):
+            self.parts = [Array(part) for part in inputs]
+        else:
+            self.parts = [Array(inputs)]
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def getPart(self, index=None):
+        return self.parts if index is None else self.parts[index]
+
+    @property
+    def partCount(self):
+        return len(self.parts)
+
+    @property
+    def pointCount(self):
+        return sum([len([p for p in part if p is not None]) for part in self.parts])
+
+    @property
+    def firstPoint(self):
+        return self.parts[0][0]
+
+    @property
+    def WKB(self):
+        """Well-known binary of the geometry, with polygon rings each written as a separate polygon"""
+        parts = []
+        for part in self.parts:
+            ring = []
+            for point in list(part) + [None]:
+                if point is None:
+                    if ring:
+                        parts.append(ring)
+                    ring = []
+                else:
+                    ring.append((point.X, point.Y))
+        wkb = struct.pack("<BII", 1, self.WKB_TYPES[self.type], len(parts))
+        for coords in parts:
+            if self.type == "polygon":
+                wkb += struct.pack("<BII", 1, 3, 1)
+            else:
+                wkb += struct.pack("<BI", 1, 2)
+            wkb += struct.pack("<I", len(coords)) + struct.pack("<{0}d".format(2 * len(coords)),
+                                                                *[c for xy in coords for c in xy])
+        return bytearray(wkb)
+
+
+class Polyline(Geometry):
+    def __init__(self, inputs, spatial_reference=None, has_z=False, has_m=False):
+        Geometry.__init__(self, "polyline", inputs, spatial_reference)
+
+
+class Polygon(Geometry):
+    def __init__(self, inputs, spatial_reference=None, has_z=False, has_m=False):
+        Geometry.__init__(self, "polygon", inputs, spatial_reference)
+
+
+class _FeatureClass(object):
+    def __init__(self, shape_type, spatial_reference=None):
+        self.shapeType = shape_type.capitalize()
+        self.spatialReference = spatial_reference
+        self.OIDFieldName = "OBJECTID"
+        self.fields = []
+        self.rows = []
+        self.next_oid = 1
+
+
+def _key(dataset):
+    return os.path.normcase(os.path.normpath(str(dataset)))
+
+
+def _feature_class(dataset):
+    try:
+        return FEATURE_CLASSES[_key(dataset)]
+    except KeyError:
+        raise ExecuteError("Dataset {0} does not exist or is not supported".format(dataset))
+
+
+def CreateFeatureclass_management(out_path, out_name, geometry_type="POLYGON", template=None, has_m=None,
+                                  has_z=None, spatial_reference=None, *args):
+    FEATURE_CLASSES[_key(os.path.join(out_path, out_name))] = _FeatureClass(geometry_type, spatial_reference)
+
+
+def AddField_management(in_table, field_name, field_type, *args, **kwargs):
+    fc = _feature_class(in_table)
+    if field_name not in fc.fields:
+        fc.fields.append(field_name)
+        for row in fc.rows:
+            row[field_name] = None
+
+
+def MakeFeatureLayer_management(in_features, out_layer, *args):
+    FEATURE_CLASSES[_key(out_layer)] = _feature_class(in_features)
+
+
+def CopyFeatures_management(in_features, out_feature_class, *args):
+    FEATURE_CLASSES[_key(out_feature_class)] = copy.deepcopy(_feature_class(in_features))
+
+
+def Describe(dataset):
+    return _feature_class(dataset)
+
+
+def Exists(dataset):
+    return _key(dataset) in FEATURE_CLASSES or os.path.exists(str(dataset))
+
+
+def Delete_management(dataset, *args):
+    if _key(dataset) in FEATURE_CLASSES:
+        del FEATURE_CLASSES[_key(dataset)]
+    elif os.path.isdir(str(dataset)):
+        shutil.rmtree(str(dataset))
+    elif os.path.isfile(str(dataset)):
+        stem = os.path.splitext(str(dataset))[0]
+        for ext in [os.path.splitext(str(dataset))[1], ".hdr", ".prj"]:
+            if os.path.isfile(stem + ext):
+                os.remove(stem + ext)
+
+
+def CopyRaster_management(in_raster, out_rasterdataset, *args):
+    """Copies a BIL flat raster file to another BIL flat raster file"""
+    in_stem, in_ext = os.path.splitext(str(in_raster))
+    out_stem, out_ext = os.path.splitext(str(out_rasterdataset))
+    if in_ext.lower() != ".bil" or out_ext.lower() != ".bil":
+        raise ExecuteError("The arcpy stand-in only copies BIL flat raster files")
+    for ext in [".bil", ".hdr", ".prj"]:
+        if os.path.isfile(in_stem + ext):
+            shutil.copyfile(in_stem + ext, out_stem + ext)
+
+
+from . import da
@@ -0,0 +1,85 @@
+# file name:	arcpy/da.py
+# description:	Stand-in for the arcpy.da search, update and insert cursors, over the in-memory feature classes of the
+#               arcpy stand-in. Supports the OID@, SHAPE@ and SHAPE@WKB tokens and attribute fields.
+# author:		South Fork Research, Inc.
+# dependencies: none
+
+import arcpy
+
+
+class _Cursor(object):
+    def __init__(self, in_table, field_names):
+        self.fc = arcpy._feature_class(in_table)
+        if isinstance(field_names, str):
+            field_names = [field_names]
+        self.fields = []
+        for name in field_names:
+            if name == "OID@" or name == self.fc.OIDFieldName:
+                self.fields.append("OID@")
+            elif name.upper() == "SHAPE@WKB":
+                self.fields.append("SHAPE@WKB")
+            elif name.upper().startswith("SHAPE@"):
+                self.fields.append("SHAPE@")
+            elif name in self.fc.fields:
+                self.fields.append(name)
+            else:
+                raise RuntimeError("Cannot find field '{0}'".format(name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def _values(self, row):
+        values = []
+        for field in self.fields:
+            if field == "SHAPE@WKB":
+                values.append(row["SHAPE@"].WKB if row["SHAPE@"] is not None else None)
+            else:
+                values.append(row[field])
+        return values
+
+    def reset(self):
+        pass
+
+
+class SearchCursor(_Cursor):
+    def __init__(self, in_table, field_names, where_clause=None, spatial_reference=None, *args, **kwargs):
+        _Cursor.__init__(self, in_table, field_names)
+
+    def __iter__(self):
+        for row in list(self.fc.rows):
+            yield tuple(self._values(row))
+
+
+class UpdateCursor(_Cursor):
+    def __init__(self, in_table, field_names, where_clause=None, spatial_reference=None, *args, **kwargs):
+        _Cursor.__init__(self, in_table, field_names)
+        self.current = None
+
+    def __iter__(self):
+        for row in list(self.fc.rows):
+            self.current = row
+            yield self._values(row)
+
+    def updateRow(self, values):
+        for field, value in zip(self.fields, values):
+            if field not in ("OID@", "SHAPE@WKB"):
+                self.current[field] = value
+
+    def deleteRow(self):
+        self.fc.rows.remove(self.current)
+
+
+class InsertCursor(_Cursor):
+    def insertRow(self, values):
+        row = dict([(field, None) for field in self.fc.fields])
+        row["OID@"] = self.fc.next_oid
+        row["SHAPE@"] = None
+        self.fc.next_oid += 1
+        for field, value in zip(self.fields, values):
+            if field != "OID@":
+                row[field] = value
+        self.fc.rows.append(row)
+        return row["OID@"]
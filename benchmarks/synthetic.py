@@ -0,0 +1,236 @@
+# file name:	synthetic.py
+# description:	Generates synthetic watershed inputs for the benchmarks: a fractal DEM and canopy height grid written as
+#               BIL flat files, a branching stream network with a LineOID field, and bankfull polygons around each
+#               stream segment. Terrain is fractional Brownian motion noise, summed over octaves of smoothly
+#               interpolated random lattices and written block by block, so grids of 20,000 x 20,000 cells can be
+#               generated without holding a whole grid in memory. The grid is tiled by square basins, each drained by
+#               its own stream network, so larger grids have proportionally more stream segments and subnetworks.
+#               Every output is seeded, so runs with the same settings use identical inputs.
+# author:		South Fork Research, Inc.
+# dependencies: ESRI arcpy module (or the benchmark stand-in), numpy, raster_io.py
+
+import os
+import math
+import arcpy
+import numpy as np
+import raster_io as rio
+
+# NAD 1983 UTM Zone 10N, which puts the synthetic grids in the Pacific Northwest
+SPATIAL_REF = ('PROJCS["NAD_1983_UTM_Zone_10N",GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983",'
+               'SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],'
+               'UNIT["Degree",0.0174532925199433]],PROJECTION["Transverse_Mercator"],'
+               'PARAMETER["False_Easting",500000.0],PARAMETER["False_Northing",0.0],'
+               'PARAMETER["Central_Meridian",-123.0],PARAMETER["Scale_Factor",0.9996],'
+               'PARAMETER["Latitude_Of_Origin",0.0],UNIT["Meter",1.0]]')
+ORIGIN = (500000.0, 5000000.0)  # upper left corner of the synthetic grids (about 45 degrees north)
+LATITUDE = 45.0
+GEN_BLOCK_ROWS = 256
+
+
+def make_grid(size, cell_size=1.0):
+    """RasterGrid of a square synthetic grid with size x size cells"""
+    return rio.RasterGrid(ORIGIN[0], ORIGIN[1], cell_size, size, size, SPATIAL_REF)
+
+
+def _octaves(grid, seed, hurst=0.8, min_period=4):
+    """Random lattices for each octave of fractal noise, from the size of the grid down to the minimum period (cells
+    between lattice points). Octave amplitudes are proportional to period ** hurst, and sum to 1."""
+    rng = np.random.RandomState(seed)
+    octaves = []
+    period = max(grid.nrows, grid.ncols)
+    while period >= min_period:
+        lattice = (rng.random_sample((grid.nrows // period + 2, grid.ncols // period + 2)) * 2.0 - 1.0)
+        octaves.append((period, lattice.astype(np.float32), float(period) ** hurst))
+        period //= 2
+    total = sum([amplitude for period, lattice, amplitude in octaves])
+    return [(period, lattice, amplitude / total) for period, lattice, amplitude in octaves]
+
+
+def _noise_block(octaves, r0, r1, ncols):
+    """Fractal noise values for the rows r0 to r1 of a grid, with values in the range -1 to 1"""
+    out = np.zeros((r1 - r0, ncols), dtype=np.float32)
+    rows = np.arange(r0, r1) + 0.5
+    cols = np.arange(ncols) + 0.5
+    for period, lattice, amplitude in octaves:
+        y = rows / period
+        x = cols / period
+        i = np.floor(y).astype(np.int64)
+        j = np.floor(x).astype(np.int64)
+        # smoothstep weights avoid visible creases along the lattice lines
+        fy = (y - i)[:, np.newaxis]
+        fx = (x - j)[np.newaxis, :]
+        fy = (fy * fy * (3.0 - 2.0 * fy)).astype(np.float32)
+        fx = (fx * fx * (3.0 - 2.0 * fx)).astype(np.float32)
+        top = lattice[np.ix_(i, j)] * (1 - fx) + lattice[np.ix_(i, j + 1)] * fx
+        bottom = lattice[np.ix_(i + 1, j)] * (1 - fx) + lattice[np.ix_(i + 1, j + 1)] * fx
+        out += amplitude * (top * (1 - fy) + bottom * fy)
+    return out
+
+
+def fractal_dem(out_bil, grid, seed=0, relief=None):
+    """Writes a fractal DEM, sloping down from north to south so that streams drain to the south edge.
+
+    Args:
+        out_bil: Output BIL flat file
+        grid: RasterGrid of the DEM
+        seed: Random seed
+        relief: Elevation range of the fractal noise (meters). Defaults to a tenth of the grid width.
+    """
+    if relief is None:
+        relief = 0.1 * grid.ncols * grid.cell_size
+    octaves = _octaves(grid, seed)
+    dem = rio.create_flat(out_bil, grid, "float32", rio.FLOAT_NODATA)
+    for window in rio.iter_windows(grid, GEN_BLOCK_ROWS):
+        rows = np.arange(window[0], window[1], dtype=np.float32)[:, np.newaxis]
+        slope = 0.05 * grid.cell_size * (grid.nrows - rows)
+        dem[window[0]:window[1]] = 1000.0 + relief * _noise_block(octaves, window[0], window[1], grid.ncols) + slope
+    dem.flush()
+    del dem
+    return out_bil
+
+
+def canopy_height(out_bil, grid, seed=1, max_height=45.0, gap_fraction=0.2):
+    """Writes a canopy height grid, with patches of open ground (height 0) covering about the gap fraction of the
+    grid.
+
+    Args:
+        out_bil: Output BIL flat file
+        grid: RasterGrid of the canopy grid
+        seed: Random seed
+        max_height: Tallest vegetation height (meters)
+        gap_fraction: Approximate fraction of cells without vegetation
+    """
+    octaves = _octaves(grid, seed, hurst=0.5)
+    # noise values are roughly normal, with most values within 0.5 of zero
+    threshold = (gap_fraction - 0.5) * 0.5
+    canopy = rio.create_flat(out_bil, grid, "float32", rio.FLOAT_NODATA)
+    for window in rio.iter_windows(grid, GEN_BLOCK_ROWS):
+        noise = _noise_block(octaves, window[0], window[1], grid.ncols)
+        canopy[window[0]:window[1]] = max_height * np.clip((noise - threshold) / (0.5 - threshold), 0.0, 1.0)
+    canopy.flush()
+    del canopy
+    return out_bil
+
+
+def stream_network(grid, seed=2, basin_cells=1000, depth=4, step_cells=5.0):
+    """Generates branching stream networks, one per square basin of the grid. Each network starts at an outlet at
+    the south edge of its basin and branches in two at the end of every segment, with meandering segments that get
+    shorter and narrower upstream. Segments are cut short where they leave their basin.
+
+    Args:
+        grid: RasterGrid that the networks cover
+        seed: Random seed
+        basin_cells: Width of each basin, in cells
+        depth: Number of branching levels, so each basin has up to 2 ** (depth + 1) - 1 segments
+        step_cells: Distance between segment vertices, in cells
+
+    Returns:
+        A list of (LineOID, stream order, (n, 2) vertex array) tuples, where the order is 1 for the outlet segment
+        and increases upstream.
+    """
+    rng = np.random.RandomState(seed)
+    step = step_cells * grid.cell_size
+    basin = basin_cells * grid.cell_size
+    margin = 2.0 * grid.cell_size
+    width, height = grid.ncols * grid.cell_size, grid.nrows * grid.cell_size
+    streams = []
+    for by in np.arange(0.0, height, basin):
+        for bx in np.arange(0.0, width, basin):
+            x0 = grid.xmin + bx
+            x1 = grid.xmin + min(bx + basin, width)
+            y1 = grid.ymax - by
+            y0 = grid.ymax - min(by + basin, height)
+            # segments to grow, as (start point, heading, length, order)
+            pending = [((x0 + (x1 - x0) / 2.0, y0 + margin), math.pi / 2.0, 0.3 * basin, 1)]
+            while pending:
+                start, heading, length, order = pending.pop(0)
+                vertices = [start]
+                x, y = start
+                for i in range(max(int(length / step), 1)):
+                    heading += rng.normal(0.0, 0.15)
+                    x, y = x + step * math.cos(heading), y + step * math.sin(heading)
+                    if not (x0 + margin < x < x1 - margin and y0 + margin < y < y1 - margin):
+                        break
+                    vertices.append((x, y))
+                if len(vertices) < 2:
+                    continue
+                streams.append((len(streams) + 1, order, np.array(vertices, dtype=np.float64)))
+                if order <= depth and len(vertices) > length / step / 2.0:
+                    for side in [-1.0, 1.0]:
+                        pending.append((vertices[-1], heading + side * rng.uniform(0.35, 0.65), length * 0.7,
+                                        order + 1))
+    return streams
+
+
+def bankfull_polygon(vertices, width):
+    """Polygon ring around a stream centerline, offset by half of the bankfull width on each side"""
+    direction = np.zeros_like(vertices)
+    segment = vertices[1:] - vertices[:-1]
+    segment /= np.maximum(np.hypot(segment[:, 0], segment[:, 1]), 1e-12)[:, np.newaxis]
+    # vertex directions average the directions of the adjacent line segments
+    direction[:-1] += segment
+    direction[1:] += segment
+    direction /= np.maximum(np.hypot(direction[:, 0], direction[:, 1]), 1e-12)[:, np.newaxis]
+    normal = np.column_stack([-direction[:, 1], direction[:, 0]]) * (width / 2.0)
+    ring = np.vstack([vertices + normal, (vertices - normal)[::-1]])
+    return np.vstack([ring, ring[:1]])
+
+
+def bankfull_width(order, basin_cells, cell_size):
+    """Bankfull width of a stream segment, narrowing upstream from 2% of the basin width at the outlet"""
+    return max(0.02 * basin_cells * cell_size * 0.7 ** (order - 1), 1.5 * cell_size)
+
+
+def write_features(out_fc, shape_type, shapes, fields, values, spatial_ref):
+    """Writes polyline or polygon features with attribute values.
+
+    Args:
+        out_fc: Output feature class (i.e. a shapefile)
+        shape_type: POLYLINE or POLYGON
+        shapes: List of (n, 2) vertex arrays, one per feature
+        fields: List of (field name, field type) tuples
+        values: List of attribute value lists, one per feature
+        spatial_ref: Spatial reference of the output, as an ESRI well-known text string
+    """
+    sr = arcpy.SpatialReference()
+    sr.loadFromString(spatial_ref)
+    arcpy.CreateFeatureclass_management(os.path.dirname(out_fc), os.path.basename(out_fc), shape_type,
+                                        spatial_reference=sr)
+    for name, field_type in fields:
+        arcpy.AddField_management(out_fc, name, field_type)
+    geometry = arcpy.Polygon if shape_type == "POLYGON" else arcpy.Polyline
+    with arcpy.da.InsertCursor(out_fc, ["SHAPE@"] + [name for name, field_type in fields]) as cursor:
+        for vertices, row in zip(shapes, values):
+            shape = geometry(arcpy.Array([arcpy.Point(x, y) for x, y in vertices]), sr)
+            cursor.insertRow([shape] + list(row))
+    return out_fc
+
+
+def watershed(out_dir, grid, seed=0, basin_cells=1000):
+    """Generates a complete set of synthetic inputs for the Solar Stream tools.
+
+    Args:
+        out_dir: Folder for the output rasters and feature classes
+        grid: RasterGrid of the DEM and canopy grids
+        seed: Random seed. Each input uses its own seed derived from this one.
+        basin_cells: Width of each stream network basin, in cells
+
+    Returns:
+        A dictionary with the paths of the dem, canopy, stream and bankfull datasets, and the number of stream
+        segments.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    dem = fractal_dem(os.path.join(out_dir, "dem.bil"), grid, seed)
+    canopy = canopy_height(os.path.join(out_dir, "canopy.bil"), grid, seed + 1)
+    streams = stream_network(grid, seed + 2, basin_cells)
+    stream_fc = write_features(os.path.join(out_dir, "streams.shp"), "POLYLINE",
+                               [vertices for oid, order, vertices in streams],
+                               [("LineOID", "LONG"), ("StrmOrder", "SHORT")],
+                               [(oid, order) for oid, order, vertices in streams], grid.spatial_ref)
+    bankfull_fc = write_features(os.path.join(out_dir, "bankfull.shp"), "POLYGON",
+                                 [bankfull_polygon(vertices, bankfull_width(order, basin_cells, grid.cell_size))
+                                  for oid, order, vertices in streams],
+                                 [("LineOID", "LONG")], [(oid,) for oid, order, vertices in streams],
+                                 grid.spatial_ref)
+    return {"dem": dem, "canopy": canopy, "stream": stream_fc, "bankfull": bankfull_fc, "segments": len(streams)}
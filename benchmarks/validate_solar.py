@@ -0,0 +1,164 @@
+# file name:	validate_solar.py
+# description:	Measures the agreement of the NumPy solar engine (insolation.py) with a reference calculation of the Area
+#               Solar Radiation model (Fu and Rich, 2002), on planar surfaces where the model has a closed form. The
+#               reference integrates direct insolation over a continuous sun track (every day of the time
+#               configuration, in one minute steps, without snapping sun positions to a sun map) and diffuse
+#               insolation over a continuous uniform sky, so the measured difference is the error of the engine's
+#               sun map, day and hour intervals and sky sectors. The default cases use the run settings of the Solar
+#               Raster tool (MultiDays 2016 182 243, 7 day interval, 2 hour interval).
+#
+#               When the ESRI arcpy module and a Spatial Analyst license are available, the same planes are also run
+#               through the Area Solar Radiation tool with --arcgis, and the NumPy engine is compared with its output.
+#
+#               usage: python benchmarks/validate_solar.py
+#                      python benchmarks/validate_solar.py --arcgis --workdir C:\temp\solar_validation
+# author:		South Fork Research, Inc.
+# dependencies: numpy, insolation.py, raster_io.py, backends (--arcgis only), ESRI arcpy module (--arcgis only)
+
+import os
+import sys
+import math
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import numpy as np
+import insolation as ins
+import raster_io as rio
+
+# agreement required for every case, as a fraction of the reference (or Area Solar Radiation) value
+TOLERANCE = 0.05
+# planar test surfaces: (name, slope in degrees, aspect in degrees clockwise from north)
+CASES = [("flat", 0.0, 0.0),
+         ("south_20", 20.0, 180.0),
+         ("north_20", 20.0, 0.0),
+         ("east_30", 30.0, 90.0),
+         ("west_30", 30.0, 270.0)]
+GRID_SIZE = 9  # cells per side of each plane; the center cell is compared
+CELL_SIZE = 10.0
+
+
+def plane(slope, aspect, size=GRID_SIZE, cell_size=CELL_SIZE, base=1000.0):
+    """Elevation grid of a plane with a slope and aspect (degrees), with rows running north to south"""
+    rows, cols = np.mgrid[0:size, 0:size].astype(np.float64)
+    east = (cols - size // 2) * cell_size
+    north = (size // 2 - rows) * cell_size
+    grade = math.tan(math.radians(slope))
+    # elevation falls toward the aspect direction
+    elev = base - grade * (east * math.sin(math.radians(aspect)) + north * math.cos(math.radians(aspect)))
+    return elev.astype(np.float32)
+
+
+def reference(latitude, slope, aspect, elevation, time_config, step_minutes=1.0,
+              diffuse_prop=ins.DIFFUSE_PROP, transmittivity=ins.TRANSMITTIVITY):
+    """Direct and diffuse insolation (WH/m2) of a plane without obstructions, integrated over a continuous sun track
+    and a continuous uniform sky, with the equations of the Area Solar Radiation model"""
+    config_type, year, start_day, end_day, start_hr, end_hr = ins.parse_time_config(time_config)
+    lat = math.radians(latitude)
+    slope_r = math.radians(slope)
+    aspect_r = math.radians(aspect)
+    normal = np.array([math.sin(slope_r) * math.sin(aspect_r), math.sin(slope_r) * math.cos(aspect_r),
+                       math.cos(slope_r)])
+    path_factor = math.exp(-0.000118 * elevation - 1.638e-9 * elevation ** 2) * math.log(transmittivity)
+    step = step_minutes / 60.0
+    hours = np.arange(start_hr, end_hr, step) + step / 2.0
+    direct = 0.0
+    global_normal = 0.0
+    for day in range(start_day, end_day + 1):
+        decl = math.radians(23.45) * math.sin(2.0 * math.pi * (284.0 + day) / 365.0)
+        hour_angle = np.radians(15.0 * (hours - 12.0))
+        sin_alt = math.sin(lat) * math.sin(decl) + math.cos(lat) * math.cos(decl) * np.cos(hour_angle)
+        up = sin_alt > 0
+        alt = np.arcsin(np.clip(sin_alt[up], -1.0, 1.0))
+        cos_az = (math.sin(decl) - np.sin(alt) * math.sin(lat)) / (np.cos(alt) * math.cos(lat))
+        az = np.arccos(np.clip(cos_az, -1.0, 1.0))
+        az = np.where(hour_angle[up] > 0, 2.0 * math.pi - az, az)
+        sun = np.vstack([np.cos(alt) * np.sin(az), np.cos(alt) * np.cos(az), np.sin(alt)])
+        beam = ins.SOLAR_CONST * np.exp(path_factor / np.sin(alt)) * step
+        direct += float(np.sum(beam * np.maximum(normal.dot(sun), 0.0)))
+        global_normal += float(np.sum(beam))
+
+    # uniform sky: the diffuse proportion of each sky direction is proportional to its solid angle, and a plane tilted
+    # by its slope sees (1 + cos(slope)) / 2 of the sky, weighted by the cosine of incidence
+    sky_view = (1.0 + math.cos(slope_r)) / 4.0
+    diffuse = global_normal * (diffuse_prop / (1.0 - diffuse_prop)) * sky_view
+    return direct, diffuse
+
+
+def engine(latitude, slope, aspect, time_config, day_intrvl, hour_intrvl, sky_size):
+    """Insolation of the center cell of a plane, calculated with the NumPy engine"""
+    elev = plane(slope, aspect)
+    result = ins.area_solar_radiation(elev, CELL_SIZE, latitude, time_config, day_intrvl, hour_intrvl, sky_size)
+    return float(result[GRID_SIZE // 2, GRID_SIZE // 2])
+
+
+def arcgis(latitude, slope, aspect, time_config, day_intrvl, hour_intrvl, sky_size, work_dir):
+    """Insolation of the center cell of a plane, calculated with the Area Solar Radiation tool"""
+    import backends
+    gp = backends.use("ARCPY")
+    grid = rio.RasterGrid(0.0, GRID_SIZE * CELL_SIZE, CELL_SIZE, GRID_SIZE, GRID_SIZE, "")
+    name = "plane_{0:g}_{1:g}".format(slope, aspect)
+    bil = rio.create_flat(os.path.join(work_dir, name + ".bil"), grid)
+    bil[:] = plane(slope, aspect)
+    bil.flush()
+    del bil
+    out_raster = os.path.join(work_dir, name + "_arcgis.tif")
+    with gp.licensed("Spatial"):
+        gp.area_solar_radiation(os.path.join(work_dir, name + ".bil"), out_raster, latitude, sky_size,
+                                time_config, day_intrvl, hour_intrvl)
+    window = (GRID_SIZE // 2, GRID_SIZE // 2 + 1, GRID_SIZE // 2, GRID_SIZE // 2 + 1)
+    return float(gp.read_raster(out_raster, gp.raster_grid(out_raster), window)[0, 0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures the agreement of the NumPy solar engine with the Area "
+                                                 "Solar Radiation model on planar surfaces.")
+    parser.add_argument("--latitude", type=float, default=45.0, help="Latitude of the planes (decimal degrees)")
+    parser.add_argument("--time-config", default="MultiDays 2016 182 243", help="Insolation time configuration")
+    parser.add_argument("--day-interval", type=float, default=7, help="Insolation day interval")
+    parser.add_argument("--hour-interval", type=float, default=2, help="Insolation hour interval")
+    parser.add_argument("--sky-size", type=int, default=400, help="Insolation sky size")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="Largest difference allowed, as a fraction of the reference value")
+    parser.add_argument("--arcgis", action="store_true",
+                        help="Also compare with the Area Solar Radiation tool (needs arcpy and Spatial Analyst)")
+    parser.add_argument("--workdir", help="Folder for the --arcgis plane rasters. Defaults to a temporary folder.")
+    args = parser.parse_args(argv)
+    if args.arcgis and not args.workdir:
+        args.workdir = tempfile.mkdtemp(prefix="solarstream_validate_")
+
+    failures = 0
+    header = "{0:<12}{1:>16}{2:>16}{3:>10}".format("plane", "reference", "numpy", "diff")
+    if args.arcgis:
+        header += "{0:>16}{1:>10}".format("arcgis", "diff")
+    print(header)
+    for name, slope, aspect in CASES:
+        direct, diffuse = reference(args.latitude, slope, aspect, 1000.0, args.time_config)
+        expected = direct + diffuse
+        value = engine(args.latitude, slope, aspect, args.time_config, args.day_interval, args.hour_interval,
+                       args.sky_size)
+        diff = (value - expected) / expected
+        line = "{0:<12}{1:>16,.0f}{2:>16,.0f}{3:>9.2%}".format(name, expected, value, diff)
+        if abs(diff) > args.tolerance:
+            failures += 1
+        if args.arcgis:
+            esri = arcgis(args.latitude, slope, aspect, args.time_config, args.day_interval, args.hour_interval,
+                          args.sky_size, args.workdir)
+            esri_diff = (value - esri) / esri
+            line += "{0:>16,.0f}{1:>9.2%}".format(esri, esri_diff)
+            if abs(esri_diff) > args.tolerance:
+                failures += 1
+        print(line)
+    if failures:
+        print("")
+        print("{0} comparison(s) differ by more than {1:.0%}".format(failures, args.tolerance))
+        return 1
+    print("")
+    print("All planes are within {0:.0%}".format(args.tolerance))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,12 +4,12 @@
 #               projects, and can't be used to alter existing Riverscapes project. Running this tool
 #               is optional, but it should be run before solar modeling if this is a Riverscapes
 #               project.
-# dependencies: arcpy
+# dependencies: backends
 
-import arcpy
 import os.path
 import metadata.meta_rs as meta_rs
 import riverscapes as rs
+import backends
 
 
 def metadata(solarXML,
@@ -33,7 +33,7 @@ def metadata(solarXML,
 
 
 def main(rs_dir, region_name, wshd_name, proj_name):
-    rs_xml = "{0}\\{1}".format(rs_dir, "project.rs.xml")
+    rs_xml = os.path.join(rs_dir, "project.rs.xml")
     # initiate Riverscapes project XML object and create folders, if user-supplied workspace is blank
     if not os.path.isfile(os.path.join(rs_dir, rs_xml)):
         rs.writeRSRoot(rs_dir)
@@ -41,6 +41,6 @@ def main(rs_dir, region_name, wshd_name, proj_name):
         projectXML = meta_rs.ProjectXML("new", rs_xml, "Solar", proj_name)
         metadata(projectXML, region_name, wshd_name, proj_name)
     else:
-        arcpy.AddError("Riverscapes project file already exists! Please choose an empty directory...")
+        backends.error("Riverscapes project file already exists! Please choose an empty directory...")
 
     return
\ No newline at end of file
@@ -0,0 +1,394 @@
+# file name:	insolation.py
+# description:	Pure NumPy implementation of hemispherical viewshed solar insolation modeling, used as an alternative
+#               to ESRI's Area Solar Radiation tool. The model follows the approach documented for Area Solar
+#               Radiation (Fu and Rich, 2002): horizon angles are calculated per search direction, sun positions
+#               are generated from the time configuration, and direct and diffuse insolation are integrated for
+#               each cell of the surface. Insolation values are returned in watt hours per square meter (WH/m2).
+# author:		South Fork Research, Inc.
+# dependencies: numpy
+
+import os
+import math
+import hashlib
+import numpy as np
+
+# solar model constants, matching the Area Solar Radiation tool defaults
+SOLAR_CONST = 1367.0  # W/m2
+TRANSMITTIVITY = 0.5
+DIFFUSE_PROP = 0.3
+CALC_DIRECTIONS = 32
+ZENITH_DIVS = 8
+AZIMUTH_DIVS = 8
+DIFFUSE_MODELS = ["UNIFORM_SKY", "STANDARD_OVERCAST_SKY"]
+SPECIAL_DAYS = [80, 172, 266, 355]  # spring equinox, summer solstice, fall equinox, winter solstice
+NEAR_STEPS = 16  # horizon search steps sampled at every cell before switching to log spacing
+FAR_STEPS = 32
+LATITUDE_PRECISION = 2  # decimal places of latitude used for cached sun and sky tables (~1 km)
+CACHE_VERSION = 1  # increment when the sun map or sky map calculations change
+
+
+def is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def parse_time_config(time_config):
+    """Parses an Area Solar Radiation time configuration string.
+
+    Args:
+        time_config: Time configuration text, as supplied by the GPSATimeConfiguration parameter (i.e.
+            'MultiDays 2016 182 243', 'WithinDay 2016 182 6 18', 'WholeYear 2016', 'SpecialDays 2016').
+
+    Returns:
+        A tuple of the configuration type, year, start day, end day, start hour and end hour.
+    """
+    tokens = str(time_config).replace(",", " ").split()
+    if not tokens:
+        raise ValueError("Time configuration is empty")
+    config_type = tokens[0].replace("Time", "")
+    values = [float(t) for t in tokens[1:]]
+    if config_type == "MultiDays" and len(values) == 3:
+        return config_type, int(values[0]), int(values[1]), int(values[2]), 0.0, 24.0
+    elif config_type == "WithinDay" and len(values) == 4:
+        return config_type, int(values[0]), int(values[1]), int(values[1]), values[2], values[3]
+    elif config_type == "WholeYear" and len(values) == 1:
+        year = int(values[0])
+        return config_type, year, 1, 366 if is_leap_year(year) else 365, 0.0, 24.0
+    elif config_type == "SpecialDays" and len(values) == 1:
+        return config_type, int(values[0]), SPECIAL_DAYS[0], SPECIAL_DAYS[-1], 0.0, 24.0
+    raise ValueError("Unsupported time configuration: {0}".format(time_config))
+
+
+def day_blocks(time_config, day_intrvl):
+    """Splits the time configuration into blocks of days, each represented by the sun track of its middle day.
+
+    Returns:
+        A list of (representative day, number of days, start hour, end hour) tuples.
+    """
+    config_type, year, start_day, end_day, start_hr, end_hr = parse_time_config(time_config)
+    if config_type == "SpecialDays":
+        return [(day, 1, start_hr, end_hr) for day in SPECIAL_DAYS]
+    days = range(start_day, end_day + 1)
+    step = max(int(round(float(day_intrvl))), 1)
+    blocks = []
+    for i in range(0, len(days), step):
+        block = days[i:i + step]
+        blocks.append((block[0] + (len(block) - 1) / 2.0, len(block), start_hr, end_hr))
+    return blocks
+
+
+def sun_positions(latitude, time_config, day_intrvl, hour_intrvl, sky_size=400):
+    """Generates the sun map for a latitude and time configuration.
+
+    Sun positions are snapped to the cell centers of a sky_size x sky_size hemispherical sun map, in the same way the
+    Area Solar Radiation tool discretizes the sun track.
+
+    Returns:
+        Arrays of sun zenith angle (radians), sun azimuth angle (radians, clockwise from north) and duration (hours)
+        for every sun position above the horizon.
+    """
+    lat = math.radians(float(latitude))
+    hour_step = float(hour_intrvl)
+    zenith, azimuth, duration = [], [], []
+    for day, ndays, start_hr, end_hr in day_blocks(time_config, day_intrvl):
+        decl = math.radians(23.45) * math.sin(2.0 * math.pi * (284.0 + day) / 365.0)
+        cos_ws = max(min(-math.tan(lat) * math.tan(decl), 1.0), -1.0)
+        half_day = math.degrees(math.acos(cos_ws)) / 15.0
+        t_start = max(start_hr, 12.0 - half_day)
+        t_end = min(end_hr, 12.0 + half_day)
+        edges = np.arange(t_start, t_end, hour_step)
+        if edges.size == 0:
+            continue
+        step_len = np.minimum(hour_step, t_end - edges)
+        hour_angle = np.radians(15.0 * (edges + step_len / 2.0 - 12.0))
+        sin_alt = math.sin(lat) * math.sin(decl) + math.cos(lat) * math.cos(decl) * np.cos(hour_angle)
+        alt = np.arcsin(np.clip(sin_alt, -1.0, 1.0))
+        cos_az = (math.sin(decl) - np.sin(alt) * math.sin(lat)) / np.maximum(np.cos(alt) * math.cos(lat), 1e-12)
+        az = np.arccos(np.clip(cos_az, -1.0, 1.0))
+        az = np.where(hour_angle > 0, 2.0 * math.pi - az, az)
+        zenith.append(math.pi / 2.0 - alt)
+        azimuth.append(az)
+        duration.append(step_len * ndays)
+    if not zenith:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    zenith = np.concatenate(zenith)
+    azimuth = np.concatenate(azimuth)
+    duration = np.concatenate(duration)
+
+    # snap positions to the sun map grid, which uses an equal-angle hemispherical projection
+    cell = 180.0 / float(sky_size)
+    x = np.degrees(zenith) * np.sin(azimuth)
+    y = np.degrees(zenith) * np.cos(azimuth)
+    x = (np.floor(x / cell) + 0.5) * cell
+    y = (np.floor(y / cell) + 0.5) * cell
+    zenith = np.radians(np.hypot(x, y))
+    azimuth = np.mod(np.arctan2(x, y), 2.0 * math.pi)
+
+    above = zenith < math.pi / 2.0
+    return zenith[above], azimuth[above], duration[above]
+
+
+def sky_sectors(zenith_divs=ZENITH_DIVS, azimuth_divs=AZIMUTH_DIVS, diffuse_model="UNIFORM_SKY"):
+    """Builds the sky map sectors used for diffuse insolation.
+
+    Returns:
+        Arrays of zenith band lower and upper bounds (radians), sector centroid zenith and azimuth (radians) and the
+        proportion of diffuse radiation originating from each sector. Arrays are ordered by zenith band, then azimuth.
+    """
+    if diffuse_model not in DIFFUSE_MODELS:
+        raise ValueError("Unsupported diffuse model type: {0}".format(diffuse_model))
+    bounds = np.linspace(0.0, math.pi / 2.0, zenith_divs + 1)
+    z0 = np.repeat(bounds[:-1], azimuth_divs)
+    z1 = np.repeat(bounds[1:], azimuth_divs)
+    az_width = 2.0 * math.pi / azimuth_divs
+    centroid_az = np.tile((np.arange(azimuth_divs) + 0.5) * az_width, zenith_divs)
+    if diffuse_model == "UNIFORM_SKY":
+        weight = (np.cos(z0) - np.cos(z1)) / azimuth_divs
+    else:
+        weight = (2.0 * np.cos(z0) + np.cos(2.0 * z0) - 2.0 * np.cos(z1) - np.cos(2.0 * z1)) / (4.0 * azimuth_divs)
+    return z0, z1, (z0 + z1) / 2.0, centroid_az, weight
+
+
+def default_cache_dir():
+    """Folder storing cached sun and sky tables. Can be set with the SOLARSTREAM_CACHE environment variable."""
+    root = os.environ.get("SOLARSTREAM_CACHE", os.path.join(os.path.expanduser("~"), ".solarstream"))
+    return os.path.join(root, "sky_tables")
+
+
+def solar_tables(latitude,
+                 time_config,
+                 day_intrvl,
+                 hour_intrvl,
+                 sky_size=400,
+                 zenith_divs=ZENITH_DIVS,
+                 azimuth_divs=AZIMUTH_DIVS,
+                 diffuse_model="UNIFORM_SKY",
+                 cache_dir=None):
+    """Returns the sun map and sky map tables, loading them from the on-disk cache when possible.
+
+    Tables are keyed by a hash of the solar parameters, with latitude rounded to LATITUDE_PRECISION decimal places, so
+    that runs for nearby watersheds with the same time configuration share the same tables.
+
+    Args:
+        cache_dir: Folder storing cached tables. If None, the tables are calculated without caching.
+
+    Returns:
+        A tuple of the sun_positions arrays (zenith, azimuth, duration) and sky_sectors arrays (zenith band lower and
+        upper bounds, centroid zenith, centroid azimuth, weight).
+    """
+    latitude = round(float(latitude), LATITUDE_PRECISION)
+    cache_file = None
+    if cache_dir:
+        params = [CACHE_VERSION, latitude, " ".join(str(time_config).split()), float(day_intrvl), float(hour_intrvl),
+                  int(sky_size), zenith_divs, azimuth_divs, diffuse_model]
+        key = hashlib.sha1("|".join([str(p) for p in params]).encode("utf-8")).hexdigest()
+        cache_file = os.path.join(cache_dir, key + ".npz")
+        if os.path.isfile(cache_file):
+            tables = np.load(cache_file)
+            return tuple(tables["sun_{0}".format(i)] for i in range(3)), tuple(tables["sky_{0}".format(i)]
+                                                                               for i in range(5))
+
+    sun = sun_positions(latitude, time_config, day_intrvl, hour_intrvl, sky_size)
+    sky = sky_sectors(zenith_divs, azimuth_divs, diffuse_model)
+    if cache_file:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write to a temporary file first, so concurrent runs never read a partially written table
+        tmp_file = "{0}.{1}.tmp.npz".format(cache_file[:-4], os.getpid())
+        arrays = dict(("sun_{0}".format(i), a) for i, a in enumerate(sun))
+        arrays.update(dict(("sky_{0}".format(i), a) for i, a in enumerate(sky)))
+        np.savez(tmp_file, **arrays)
+        try:
+            os.rename(tmp_file, cache_file)
+        except OSError:
+            os.remove(tmp_file)
+    return sun, sky
+
+
+def max_insolation(latitude, time_config, day_intrvl, hour_intrvl, sky_size=400, elevation=0.0,
+                   diffuse_prop=DIFFUSE_PROP, transmittivity=TRANSMITTIVITY, cache_dir=None):
+    """Upper bound of the insolation (WH/m2) of any cell at an elevation: the direct insolation of a surface facing
+    every sun position, plus the diffuse insolation of an unobstructed sky. Used to check that a storage type can
+    hold the results of a run before insolation is calculated."""
+    sun_zen, sun_az, sun_dur = solar_tables(latitude, time_config, day_intrvl, hour_intrvl, sky_size,
+                                            cache_dir=cache_dir)[0]
+    path_factor = math.exp(-0.000118 * elevation - 1.638e-9 * elevation ** 2) * math.log(transmittivity)
+    global_normal = float(np.sum(SOLAR_CONST * np.exp(path_factor / np.cos(sun_zen)) * sun_dur))
+    return global_normal / (1.0 - diffuse_prop)
+
+
+def surface_normal(elev, cell_size, z_factor=1.0):
+    """Calculates the components of the unit surface normal using Horn's method.
+
+    Returns:
+        Arrays of the east, north and up components of the unit surface normal.
+    """
+    z = np.pad(elev * z_factor, 1, mode="edge")
+    a, b, c = z[:-2, :-2], z[:-2, 1:-1], z[:-2, 2:]
+    d, f = z[1:-1, :-2], z[1:-1, 2:]
+    g, h, i = z[2:, :-2], z[2:, 1:-1], z[2:, 2:]
+    dz_dx = ((c + 2.0 * f + i) - (a + 2.0 * d + g)) / (8.0 * cell_size)
+    dz_dy = ((a + 2.0 * b + c) - (g + 2.0 * h + i)) / (8.0 * cell_size)
+    norm = np.sqrt(1.0 + dz_dx ** 2 + dz_dy ** 2)
+    return -dz_dx / norm, -dz_dy / norm, 1.0 / norm
+
+
+def march_offsets(azimuth, cell_size, search_distance):
+    """Lists the (row, column) offsets and distances sampled along a horizon search direction.
+
+    Cells are sampled one by one close to the origin, then at logarithmically increasing distances out to the
+    search distance.
+    """
+    max_steps = max(int(search_distance / cell_size), 1)
+    steps = np.arange(1, min(max_steps, NEAR_STEPS) + 1, dtype=float)
+    if max_steps > NEAR_STEPS:
+        far = np.logspace(math.log10(NEAR_STEPS), math.log10(max_steps), FAR_STEPS)
+        steps = np.concatenate([steps, far])
+    d_col = np.round(steps * math.sin(azimuth)).astype(int)
+    d_row = np.round(-steps * math.cos(azimuth)).astype(int)
+    offsets = []
+    for dr, dc in zip(d_row, d_col):
+        if (dr, dc) != (0, 0) and (dr, dc) not in offsets:
+            offsets.append((dr, dc))
+    return [(dr, dc, math.hypot(dr, dc) * cell_size) for dr, dc in offsets]
+
+
+def horizon_tangent(elev, azimuth, cell_size, search_distance, cells=None):
+    """Calculates the tangent of the horizon angle in one search direction.
+
+    Args:
+        cells: Optional tuple of row and column index arrays. If supplied, the horizon is only calculated for these
+            cells, although the whole surface is still searched for obstructions.
+
+    Returns:
+        An array with the shape of the surface (or one value per cell, if cells are supplied). Cells with no
+        obstruction inside the surface are assigned negative infinity.
+    """
+    nrows, ncols = elev.shape
+    if cells is not None:
+        rows, cols = cells
+        origin = elev[rows, cols]
+        horizon = np.empty(rows.shape, dtype=np.float32)
+        horizon.fill(-np.inf)
+        for dr, dc, dist in march_offsets(azimuth, cell_size, search_distance):
+            r, c = rows + dr, cols + dc
+            inside = np.nonzero((r >= 0) & (r < nrows) & (c >= 0) & (c < ncols))[0]
+            tan = (elev[r[inside], c[inside]] - origin[inside]) / dist
+            horizon[inside] = np.fmax(horizon[inside], tan)
+        return horizon
+
+    horizon = np.empty(elev.shape, dtype=np.float32)
+    horizon.fill(-np.inf)
+    for dr, dc, dist in march_offsets(azimuth, cell_size, search_distance):
+        r0, r1 = max(0, -dr), nrows - max(0, dr)
+        c0, c1 = max(0, -dc), ncols - max(0, dc)
+        if r0 >= r1 or c0 >= c1:
+            continue
+        tan = (elev[r0 + dr:r1 + dr, c0 + dc:c1 + dc] - elev[r0:r1, c0:c1]) / dist
+        np.fmax(horizon[r0:r1, c0:c1], tan, out=horizon[r0:r1, c0:c1])
+    return horizon
+
+
+def area_solar_radiation(elev,
+                         cell_size,
+                         latitude,
+                         time_config,
+                         day_intrvl,
+                         hour_intrvl,
+                         sky_size=400,
+                         search_distance=None,
+                         z_factor=1.0,
+                         calc_directions=CALC_DIRECTIONS,
+                         zenith_divs=ZENITH_DIVS,
+                         azimuth_divs=AZIMUTH_DIVS,
+                         diffuse_model="UNIFORM_SKY",
+                         diffuse_prop=DIFFUSE_PROP,
+                         transmittivity=TRANSMITTIVITY,
+                         mask=None,
+                         cache_dir=None):
+    """Calculates global (direct + diffuse) solar insolation for an elevation surface.
+
+    Args:
+        elev: 2D array of surface elevation values (meters). NoData cells should be NaN.
+        cell_size: Cell size of the surface (meters).
+        latitude: Latitude of the surface (decimal degrees).
+        time_config: Area Solar Radiation time configuration string.
+        day_intrvl: Interval through the time configuration (days) used to calculate sky sectors for the sun map.
+        hour_intrvl: Interval through the day (hours) used to calculate sky sectors for the sun map.
+        sky_size: Resolution of the sun map, in cells per side.
+        search_distance: Maximum horizon search distance (meters). Defaults to the full extent of the surface.
+        mask: Optional boolean array. If supplied, insolation is only calculated for cells where the mask is True
+            (i.e. the stream corridor), while the whole surface is still used to find shading obstructions.
+        cache_dir: Optional folder used to cache the sun map and sky map tables between runs.
+
+    Returns:
+        A float32 array of solar insolation (WH/m2), with NaN where the surface is NoData or outside of the mask.
+    """
+    elev = np.asarray(elev, dtype=np.float32)
+    if search_distance is None:
+        search_distance = max(elev.shape) * cell_size
+    norm_e, norm_n, norm_up = surface_normal(np.where(np.isnan(elev), 0.0, elev), cell_size, z_factor)
+    cells = None
+    if mask is not None:
+        cells = np.nonzero(mask)
+        norm_e, norm_n, norm_up = norm_e[cells], norm_n[cells], norm_up[cells]
+        elev_cells = elev[cells]
+    else:
+        elev_cells = elev
+    nodata = np.isnan(elev_cells)
+    elev_m = np.where(nodata, 0.0, elev_cells).astype(np.float32)
+
+    # elevation-adjusted optical path length factor (Area Solar Radiation equation for m(theta))
+    path_factor = np.exp(-0.000118 * elev_m - 1.638e-9 * elev_m ** 2) * math.log(transmittivity)
+
+    sun, sky = solar_tables(latitude, time_config, day_intrvl, hour_intrvl, sky_size, zenith_divs, azimuth_divs,
+                            diffuse_model, cache_dir)
+    sun_zen, sun_az, sun_dur = sun
+    sky_z0, sky_z1, sky_zen, sky_az, sky_weight = sky
+
+    dir_width = 2.0 * math.pi / calc_directions
+    sun_dir = np.mod(np.round(sun_az / dir_width).astype(int), calc_directions)
+    sky_dir_sector = ((np.arange(calc_directions) * dir_width) // (2.0 * math.pi / azimuth_divs)).astype(int)
+    dirs_per_sector = np.bincount(sky_dir_sector, minlength=azimuth_divs).astype(float)
+
+    direct = np.zeros(elev_m.shape, dtype=np.float32)
+    sky_view = np.zeros(elev_m.shape, dtype=np.float32)
+    for d in range(calc_directions):
+        azimuth = d * dir_width
+        horizon = horizon_tangent(elev, azimuth, cell_size, search_distance, cells)
+        horizon[nodata] = -np.inf
+
+        # direct insolation for sun positions in this search direction
+        for t in np.nonzero(sun_dir == d)[0]:
+            cos_zen = math.cos(sun_zen[t])
+            visible = horizon < cos_zen / max(math.sin(sun_zen[t]), 1e-12)
+            cos_inc = (cos_zen * norm_up + math.sin(sun_zen[t]) *
+                       (math.sin(sun_az[t]) * norm_e + math.cos(sun_az[t]) * norm_n))
+            beam = SOLAR_CONST * np.exp(path_factor / cos_zen) * sun_dur[t]
+            direct += np.where(visible, beam * np.maximum(cos_inc, 0.0), 0.0).astype(np.float32)
+
+        # diffuse sky view, weighted by the visible fraction of each sky sector in this search direction
+        horizon_alt = np.arctan(horizon)
+        az_sector = sky_dir_sector[d]
+        for s in np.nonzero(np.arange(sky_az.size) % azimuth_divs == az_sector)[0]:
+            alt_top = math.pi / 2.0 - sky_z0[s]
+            alt_bottom = math.pi / 2.0 - sky_z1[s]
+            gap = np.clip((alt_top - horizon_alt) / (alt_top - alt_bottom), 0.0, 1.0)
+            cos_inc = (math.cos(sky_zen[s]) * norm_up + math.sin(sky_zen[s]) *
+                       (math.sin(sky_az[s]) * norm_e + math.cos(sky_az[s]) * norm_n))
+            sky_view += (gap * np.maximum(cos_inc, 0.0) * (sky_weight[s] / dirs_per_sector[az_sector])).astype(
+                np.float32)
+
+    # global normal radiation, summed over all sun positions without obstruction
+    global_normal = np.zeros(elev_m.shape, dtype=np.float32)
+    for t in range(sun_zen.size):
+        global_normal += (SOLAR_CONST * np.exp(path_factor / math.cos(sun_zen[t])) * sun_dur[t]).astype(np.float32)
+    diffuse = global_normal * (diffuse_prop / (1.0 - diffuse_prop)) * sky_view
+
+    area_solar = direct + diffuse
+    area_solar[nodata] = np.nan
+    if cells is None:
+        return area_solar
+    result = np.empty(elev.shape, dtype=np.float32)
+    result.fill(np.nan)
+    result[cells] = area_solar
+    return result
@@ -300,4 +300,63 @@ class ProjectXML:
         pretty = '\n'.join([line for line in minidom.parseString(rough_string).toprettyxml(indent="\t").split('\n') if line.strip()])
         f = open(self.logFilePath, "wb")
         f.write(pretty)
-        f.close()
\ No newline at end of file
+        f.close()
+
+# parsed state of the project XML files and folders checked by the toolbox parameter validation, by path
+_projectStates = {}
+_folderStates = {}
+
+
+def getProjectState(rs_dir):
+    """Returns the project name, Solar realization names and realization IDs of the project XML file in a Riverscapes
+    project folder, or None if there is no project XML file. The toolbox validation calls this on every parameter
+    change, so the parsed state is cached by the modification time and size of the XML file, and an unchanged file is
+    only parsed once.
+
+    Returns:
+        A dictionary with the project "name", the list of "real_names" and the "real_ids" dictionary of realization
+        name to ID.
+    """
+    rs_xml = os.path.join(str(rs_dir), "project.rs.xml")
+    try:
+        stat = os.stat(rs_xml)
+    except OSError:
+        return None
+    stamp = (stat.st_mtime, stat.st_size)
+    cached = _projectStates.get(rs_xml)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    projectXML = ProjectXML("existing", rs_xml, "Solar")
+    names = projectXML.getProjectName(projectXML.project, "Name")
+    state = {"name": names[0] if names else '',
+             "real_names": projectXML.getRealNames(projectXML.project, "Solar"),
+             "real_ids": dict(projectXML.realIDdict)}
+    _projectStates[rs_xml] = (stamp, state)
+    return state
+
+
+def checkProjectFolder(rs_dir):
+    """Checks that a folder is a Riverscapes project, with ProjectInputs and Realizations folders and a project XML
+    file. The result is cached by the modification time of the folder, which changes when any of these are added or
+    removed.
+
+    Returns:
+        An error message, or None if the folder is a valid Riverscapes project.
+    """
+    rs_dir = str(rs_dir)
+    try:
+        stamp = os.stat(rs_dir).st_mtime
+    except OSError:
+        return "Valid Riverscape data folders are missing from this directory!"
+    cached = _folderStates.get(rs_dir)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    if not (os.path.exists(os.path.join(rs_dir, "ProjectInputs")) and
+            os.path.exists(os.path.join(rs_dir, "Realizations"))):
+        message = "Valid Riverscape data folders are missing from this directory!"
+    elif not os.path.isfile(os.path.join(rs_dir, "project.rs.xml")):
+        message = "This is not a valid Riverscapes project!"
+    else:
+        message = None
+    _folderStates[rs_dir] = (stamp, message)
+    return message
@@ -81,7 +81,7 @@ class MetadataWriter():
             for parameter in run.Parameters:
                 nodeParameter = ET.SubElement(nodeParameters, "Parameter")
                 ET.SubElement(nodeParameter, "Name").text = parameter.Name
-                ET.SubElement(nodeParameter, "Value").text = parameter.Value
+                ET.SubElement(nodeParameter, "Value").text = text_value(parameter.Value)
 
             nodeOutputs = ET.SubElement(nodeRun, "Outputs")
             for output in run.Outputs:
@@ -95,7 +95,7 @@ class MetadataWriter():
 
             nodeResults = ET.SubElement(nodeRun, "Results")
             for result in run.Results:
-                ET.SubElement(nodeResults, result.Name).text = result.Value
+                ET.SubElement(nodeResults, result.Name).text = text_value(result.Value)
 
         # nodeSummary = ET.SubElement(nodeProcessing,"Summary")
 
@@ -168,6 +168,13 @@ class result():
         self.Value = Value
 
 
+def text_value(value):
+    """Converts numeric and boolean parameter and result values to element text"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return str(value)
+    return value
+
+
 def indent(elem, level=0, more_sibs=False):
     """ Pretty Print XML Element
     Source: http://stackoverflow.com/questions/749796/pretty-printing-xml-in-python
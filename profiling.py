@@ -0,0 +1,196 @@
+# file name:	profiling.py
+# description:	Lightweight stage timing for the Solar Stream Tools. Each processing stage of a tool run is wrapped in
+#               a stage context manager (or the timed decorator), which records its wall time, CPU time, the peak
+#               resident memory of the process and the size of the datasets it wrote. Stage timings are added to the
+#               run metadata as results, and written as a JSON trace (Chrome trace event format, which can be opened
+#               in chrome://tracing or Perfetto) when the SOLARSTREAM_TRACE environment variable is set to a folder.
+# author:		South Fork Research, Inc.
+# dependencies: stage_cache.py
+
+import os
+import re
+import sys
+import json
+import time
+import functools
+import contextlib
+
+TRACE_ENV = "SOLARSTREAM_TRACE"
+_active = []  # profilers of the runs in progress, the innermost last
+
+
+def peak_rss():
+    """Peak resident memory of the current process in bytes, or None if it is not available"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (ImportError, AttributeError, OSError):
+        pass
+    return None
+
+
+def cpu_time():
+    """User and system CPU time of the current process and its finished child processes, in seconds"""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+def dataset_bytes(datasets):
+    """Total size of the files storing a list of datasets. Datasets in a geodatabase are not counted, because their
+    files are shared with the other datasets of the geodatabase."""
+    import stage_cache as sc
+    total = 0
+    for dataset in datasets:
+        if ".gdb" in str(dataset).lower():
+            continue
+        for file_path in sc.dataset_files(dataset):
+            if os.path.isfile(file_path):
+                total += os.path.getsize(file_path)
+    return total
+
+
+def tag_name(name):
+    """Converts a stage name to a valid XML element name, for run metadata results"""
+    tag = re.sub(r"[^A-Za-z0-9_.-]", "_", name.strip())
+    if not tag or not re.match(r"[A-Za-z_]", tag) or tag.lower().startswith("xml"):
+        tag = "_" + tag
+    return tag
+
+
+class Profiler(object):
+    """Records the stages of one tool run. A new profiler becomes the active profiler used by stage() and timed(),
+    until finish() is called.
+
+    Args:
+        name: Tool name, used to name the trace file
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.stages = []
+        _active.append(self)
+
+    @contextlib.contextmanager
+    def stage(self, name, outputs=()):
+        """Times a processing stage.
+
+        Args:
+            name: Stage name. Stages with the same name are recorded separately, and summed in the run results.
+            outputs: Datasets written by the stage, whose size is recorded as the bytes written
+        """
+        wall, cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            self.stages.append({"name": name,
+                                "start": wall - self.start,
+                                "wall_time": time.time() - wall,
+                                "cpu_time": cpu_time() - cpu,
+                                "peak_rss": peak_rss(),
+                                "bytes_written": dataset_bytes(outputs) if outputs else 0})
+
+    def summary(self):
+        """Totals of each stage name, in the order the stages first ran"""
+        totals = []
+        by_name = {}
+        for record in sorted(self.stages, key=lambda r: r["start"]):
+            if record["name"] not in by_name:
+                by_name[record["name"]] = dict(record)
+                totals.append(by_name[record["name"]])
+            else:
+                total = by_name[record["name"]]
+                for key in ["wall_time", "cpu_time", "bytes_written"]:
+                    total[key] += record[key]
+                if record["peak_rss"] is not None:
+                    total["peak_rss"] = max(total["peak_rss"] or 0, record["peak_rss"])
+        return totals
+
+    def add_results(self, run):
+        """Adds the stage totals to a metadata run (meta_sfr.run) as results"""
+        for total in self.summary():
+            tag = tag_name(total["name"])
+            run.addResult(tag + "_WallTime", "{0:.3f}".format(total["wall_time"]))
+            run.addResult(tag + "_CPUTime", "{0:.3f}".format(total["cpu_time"]))
+            if total["peak_rss"] is not None:
+                run.addResult(tag + "_PeakRSS_MB", "{0:.1f}".format(total["peak_rss"] / 1048576.0))
+            if total["bytes_written"]:
+                run.addResult(tag + "_BytesWritten", str(total["bytes_written"]))
+
+    def write_trace(self, trace_path):
+        """Writes the stages as a JSON trace, in Chrome trace event format"""
+        events = []
+        for record in self.stages:
+            events.append({"name": record["name"],
+                           "ph": "X",
+                           "ts": int(record["start"] * 1e6),
+                           "dur": int(record["wall_time"] * 1e6),
+                           "pid": os.getpid(),
+                           "tid": 0,
+                           "args": {"cpu_time": record["cpu_time"],
+                                    "peak_rss": record["peak_rss"],
+                                    "bytes_written": record["bytes_written"]}})
+        with open(trace_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, indent=1)
+        return trace_path
+
+    def finish(self, run=None):
+        """Ends the run: adds the results to the run metadata, and writes a trace file to the folder set by the
+        SOLARSTREAM_TRACE environment variable, if it is set"""
+        if self in _active:
+            _active.remove(self)
+        if run is not None:
+            self.add_results(run)
+        trace_dir = os.environ.get(TRACE_ENV)
+        if trace_dir:
+            if not os.path.isdir(trace_dir):
+                os.makedirs(trace_dir)
+            trace_name = "{0}_{1}_{2}.json".format(self.name, time.strftime("%Y%m%d%H%M%S"), os.getpid())
+            return self.write_trace(os.path.join(trace_dir, trace_name))
+        return None
+
+
+@contextlib.contextmanager
+def stage(name, outputs=()):
+    """Times a processing stage with the active profiler, or does nothing if no run is being profiled"""
+    if _active:
+        with _active[-1].stage(name, outputs):
+            yield
+    else:
+        yield
+
+
+def timed(name=None):
+    """Decorator that times every call of a function as a stage of the active profiler"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,388 @@
+# file name:	raster_io.py
+# description:	Block-windowed raster input and output for the NumPy processing stages. Scratch rasters are stored
+#               as ESRI BIL flat files (.bil, .hdr and .prj), which are read and written through NumPy memory maps, so
+#               a window of a flat file is a view of the file rather than a copy of the whole raster. Flat files can
+#               also be read directly by ArcGIS and GDAL. Other raster formats are read one window at a time through
+#               the geoprocessing backend, or exported to a flat file once when they are read many times.
+# author:		South Fork Research, Inc.
+# dependencies: numpy, backends
+
+import os
+import json
+import functools
+import numpy as np
+import backends
+
+BLOCK_ROWS = 512  # rows per block when iterating over a raster
+FLOAT_NODATA = -3.4028235e+38
+# NumPy data types supported by BIL flat files, with the header PIXELTYPE and NBITS values
+PIXEL_TYPES = {"uint8": ("UNSIGNEDINT", 8),
+               "int16": ("SIGNEDINT", 16),
+               "uint16": ("UNSIGNEDINT", 16),
+               "int32": ("SIGNEDINT", 32),
+               "uint32": ("UNSIGNEDINT", 32),
+               "float32": ("FLOAT", 32)}
+DTYPES = dict([(v, k) for k, v in PIXEL_TYPES.items()])
+# output raster storage types, with the NumPy data type of each. Integer types store cell values scaled to
+# (value - offset) / scale and rounded, with the largest integer as NoData.
+STORAGE_TYPES = {"FLOAT32": "float32",
+                 "UINT16": "uint16",
+                 "UINT32": "uint32"}
+SCALING_SUFFIX = ".scaling.json"  # sidecar file recording the scale and offset of a scaled integer raster
+# geoprocessing environment for tiled, compressed output rasters with overviews and statistics (ARCPY backend)
+TILED_OUTPUT_ENV = {"tileSize": "512 512",
+                    "compression": "LZW",
+                    "pyramid": "PYRAMIDS -1 BILINEAR DEFAULT",
+                    "rasterStatistics": "STATISTICS 1 1"}
+
+
+class RasterGrid(object):
+    """Georeferencing of a north-up raster grid.
+
+    Args:
+        xmin: X coordinate of the left edge of the grid
+        ymax: Y coordinate of the top edge of the grid
+        cell_size: Cell width and height
+        nrows: Number of rows
+        ncols: Number of columns
+        spatial_ref: Spatial reference, as an ESRI well-known text string
+    """
+
+    def __init__(self, xmin, ymax, cell_size, nrows, ncols, spatial_ref=""):
+        self.xmin = float(xmin)
+        self.ymax = float(ymax)
+        self.cell_size = float(cell_size)
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+        self.spatial_ref = spatial_ref
+
+    @property
+    def shape(self):
+        return self.nrows, self.ncols
+
+    def lower_left(self, window):
+        """Map coordinates of the lower left corner of a (row start, row end, column start, column end) window"""
+        return self.xmin + window[2] * self.cell_size, self.ymax - window[1] * self.cell_size
+
+    def same_as(self, other):
+        """True if both grids have the same cells"""
+        tol = self.cell_size * 1e-6
+        return (self.shape == other.shape and abs(self.cell_size - other.cell_size) < tol and
+                abs(self.xmin - other.xmin) < tol and abs(self.ymax - other.ymax) < tol)
+
+
+class FlatRaster(object):
+    """Read-only, memory-mapped BIL flat raster file.
+
+    Args:
+        bil_path: BIL flat raster file, with its .hdr header file
+    """
+
+    def __init__(self, bil_path):
+        self.path = str(bil_path)
+        self.grid, self.dtype, self.nodata = read_header(self.path)
+        self.data = np.memmap(self.path, dtype=self.dtype, mode="r", shape=self.grid.shape)
+
+    def window(self, window):
+        """Raw cell values of a (row start, row end, column start, column end) window, as a view of the file"""
+        return self.data[window[0]:window[1], window[2]:window[3]]
+
+    def read(self, window=None):
+        """Reads a window (or the whole raster) as float32, with NoData converted to NaN"""
+        if window is None:
+            window = (0, self.grid.nrows, 0, self.grid.ncols)
+        raw = self.window(window)
+        arr = raw.astype(np.float32)
+        if self.nodata is not None:
+            arr[raw == self.dtype.type(self.nodata)] = np.nan
+        return arr
+
+
+def is_flat(in_raster):
+    """True if a raster dataset is a BIL flat file with a header"""
+    path = str(in_raster)
+    return path.lower().endswith(".bil") and os.path.isfile(os.path.splitext(path)[0] + ".hdr")
+
+
+def read_header(bil_path):
+    """Reads the ESRI BIL header of a flat raster file.
+
+    Returns:
+        A tuple of the RasterGrid, NumPy data type and NoData value (None if the header has no NoData value).
+    """
+    stem = os.path.splitext(str(bil_path))[0]
+    header = {}
+    with open(stem + ".hdr", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                header[parts[0].upper()] = parts[1]
+    nbits = int(header.get("NBITS", 8))
+    pixel_type = header.get("PIXELTYPE", "FLOAT" if nbits == 32 else "UNSIGNEDINT").upper()
+    dtype = np.dtype(DTYPES[(pixel_type, nbits)])
+    dtype = dtype.newbyteorder("<" if header.get("BYTEORDER", "I").upper() == "I" else ">")
+    cell_size = float(header["XDIM"])
+    spatial_ref = ""
+    if os.path.isfile(stem + ".prj"):
+        with open(stem + ".prj", "r") as f:
+            spatial_ref = f.read()
+    grid = RasterGrid(float(header["ULXMAP"]) - cell_size / 2.0, float(header["ULYMAP"]) + cell_size / 2.0,
+                      cell_size, header["NROWS"], header["NCOLS"], spatial_ref)
+    nodata = None
+    if "NODATA" in header:
+        nodata = float(header["NODATA"]) if dtype.kind == "f" else int(float(header["NODATA"]))
+    return grid, dtype, nodata
+
+
+def open_flat(bil_path):
+    """Opens a BIL flat raster file as a read-only FlatRaster"""
+    return FlatRaster(bil_path)
+
+
+def grid_from_raster(in_raster):
+    """Builds the RasterGrid of a raster dataset"""
+    if is_flat(in_raster):
+        return read_header(in_raster)[0]
+    return backends.get().raster_grid(in_raster)
+
+
+def iter_windows(grid, block_rows=BLOCK_ROWS):
+    """Yields (row start, row end, column start, column end) windows of full-width row blocks"""
+    for r0 in range(0, grid.nrows, block_rows):
+        yield r0, min(r0 + block_rows, grid.nrows), 0, grid.ncols
+
+
+def read_window(in_raster, grid, window):
+    """Reads a window of a raster, aligned to a target grid.
+
+    Rasters with a different cell size or alignment than the target grid (i.e. a 30m canopy raster used with a 10m
+    DEM) are resampled to the target grid with nearest neighbor assignment, the same as the Spatial Analyst tools do
+    with the snap raster environment set.
+
+    BIL flat files are read through a memory map, and all other rasters through the geoprocessing backend.
+
+    Returns:
+        A float32 array for the window, with NaN for NoData and for cells outside of the raster.
+    """
+    if is_flat(in_raster):
+        src = open_flat(in_raster)
+        src_grid = src.grid
+        read_native = src.read
+    else:
+        src_grid = grid_from_raster(in_raster)
+        read_native = functools.partial(backends.get().read_raster, in_raster, src_grid)
+    if src_grid.same_as(grid):
+        return read_native(window)
+
+    rows = np.arange(window[0], window[1])
+    cols = np.arange(window[2], window[3])
+    src_rows = np.floor((src_grid.ymax - (grid.ymax - (rows + 0.5) * grid.cell_size)) / src_grid.cell_size)
+    src_cols = np.floor(((grid.xmin + (cols + 0.5) * grid.cell_size) - src_grid.xmin) / src_grid.cell_size)
+    src_rows = src_rows.astype(int)
+    src_cols = src_cols.astype(int)
+    out = np.empty((rows.size, cols.size), dtype=np.float32)
+    out.fill(np.nan)
+    row_in = (src_rows >= 0) & (src_rows < src_grid.nrows)
+    col_in = (src_cols >= 0) & (src_cols < src_grid.ncols)
+    if not row_in.any() or not col_in.any():
+        return out
+    src_window = (src_rows[row_in].min(), src_rows[row_in].max() + 1, src_cols[col_in].min(),
+                  src_cols[col_in].max() + 1)
+    src = read_native(src_window)
+    out[np.ix_(row_in, col_in)] = src[np.ix_(src_rows[row_in] - src_window[0], src_cols[col_in] - src_window[2])]
+    return out
+
+
+def write_header(bil_path, grid, dtype, nodata):
+    """Writes the ESRI BIL header (.hdr) and projection (.prj) files for a flat raster file"""
+    pixel_type, nbits = PIXEL_TYPES[np.dtype(dtype).name]
+    stem = os.path.splitext(bil_path)[0]
+    header = [("BYTEORDER", "I"),
+              ("LAYOUT", "BIL"),
+              ("NROWS", grid.nrows),
+              ("NCOLS", grid.ncols),
+              ("NBANDS", 1),
+              ("NBITS", nbits),
+              ("BANDROWBYTES", grid.ncols * nbits // 8),
+              ("TOTALROWBYTES", grid.ncols * nbits // 8),
+              ("PIXELTYPE", pixel_type),
+              ("ULXMAP", repr(grid.xmin + grid.cell_size / 2.0)),
+              ("ULYMAP", repr(grid.ymax - grid.cell_size / 2.0)),
+              ("XDIM", repr(grid.cell_size)),
+              ("YDIM", repr(grid.cell_size)),
+              ("NODATA", nodata)]
+    with open(stem + ".hdr", "w") as f:
+        for key, value in header:
+            f.write("{0:<15}{1}\n".format(key, value))
+    if grid.spatial_ref:
+        with open(stem + ".prj", "w") as f:
+            f.write(grid.spatial_ref)
+
+
+def create_flat(bil_path, grid, dtype="float32", nodata=FLOAT_NODATA, fill=None):
+    """Creates a BIL flat raster file and opens it for writing.
+
+    Args:
+        fill: Optional value written to every cell (i.e. the NoData value). New files are otherwise filled with 0.
+
+    Returns:
+        A writable NumPy memory map with the shape of the grid. Call flush() on it when finished writing.
+    """
+    folder = os.path.dirname(bil_path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    write_header(bil_path, grid, dtype, nodata)
+    flat = np.memmap(bil_path, dtype=np.dtype(dtype).newbyteorder("<"), mode="w+", shape=grid.shape)
+    if fill is not None:
+        for window in iter_windows(grid):
+            flat[window[0]:window[1]] = fill
+    return flat
+
+
+def update_flat(bil_path):
+    """Opens an existing BIL flat raster file for writing, i.e. for worker processes that each write one window"""
+    grid, dtype = read_header(bil_path)[:2]
+    return np.memmap(str(bil_path), dtype=dtype, mode="r+", shape=grid.shape)
+
+
+def write_block(flat, window, arr, nodata=FLOAT_NODATA):
+    """Writes a float array with NaN for NoData into a window of a writable flat raster"""
+    flat[window[0]:window[1], window[2]:window[3]] = np.where(np.isnan(arr), nodata, arr).astype(flat.dtype)
+
+
+def export_flat(in_raster, bil_path, grid=None, dtype="float32", nodata=FLOAT_NODATA, block_rows=BLOCK_ROWS):
+    """Exports a raster dataset to a BIL flat raster file block by block, aligned to a target grid. Used for rasters
+    that are read many times, such as by each tile of a tiled run.
+
+    Args:
+        in_raster: Input raster dataset
+        bil_path: Output BIL flat raster file
+        grid: Target grid. Defaults to the grid of the input raster.
+    """
+    if grid is None:
+        grid = grid_from_raster(in_raster)
+    flat = create_flat(bil_path, grid, dtype, nodata)
+    for window in iter_windows(grid, block_rows):
+        write_block(flat, window, read_window(in_raster, grid, window), nodata)
+    flat.flush()
+    del flat
+    return bil_path
+
+
+def as_flat(in_raster, bil_path, grid=None, dtype="float32", nodata=FLOAT_NODATA):
+    """Returns the raster dataset itself if it is already a flat file on the target grid, otherwise exports it to a
+    flat file"""
+    if is_flat(in_raster) and (grid is None or read_header(in_raster)[0].same_as(grid)):
+        return str(in_raster)
+    return export_flat(in_raster, bil_path, grid, dtype, nodata)
+
+
+def move_flat(bil_path, out_bil):
+    """Moves a complete BIL flat raster file, with its header and projection files, to its final path, i.e. from the
+    scratch folder of a run to a cache shared by several runs. The .bil file is moved last, so the output is never
+    seen without its header. If another run already moved an output to the same path, it is kept and the moved files
+    are deleted.
+
+    Returns:
+        The output BIL file path.
+    """
+    stem = os.path.splitext(str(bil_path))[0]
+    out_stem = os.path.splitext(str(out_bil))[0]
+    for ext in (".prj", ".hdr", ".bil"):
+        if not os.path.isfile(stem + ext):
+            continue
+        try:
+            if os.name == "nt" and os.path.isfile(out_stem + ext):
+                os.remove(out_stem + ext)
+            os.rename(stem + ext, out_stem + ext)
+        except OSError:
+            if not is_flat(out_bil):
+                raise
+            os.remove(stem + ext)
+    return str(out_bil)
+
+
+def save_flat(bil_path, out_raster):
+    """Copies a flat raster file to an output raster dataset, in the format given by the output name"""
+    backends.get().save_raster(bil_path, out_raster)
+    return
+
+
+def is_tiff(raster_path):
+    return os.path.splitext(str(raster_path))[1].lower() in (".tif", ".tiff")
+
+
+def tiled_output(enabled=True):
+    """Context for writing output rasters as internally tiled, LZW compressed rasters, with overview pyramids and
+    statistics calculated when the raster is saved. Later windowed reads and map viewers then only read the tiles and
+    overview levels that they need. The previous output settings are restored on exit.
+
+    Args:
+        enabled: If False, the output settings are left unchanged
+    """
+    return backends.get().tiled_output(enabled)
+
+
+def write_scaling(raster_path, storage_type, scale, offset):
+    """Records the storage type, scale and offset of a raster in a sidecar file next to it"""
+    with open(str(raster_path) + SCALING_SUFFIX, "w") as f:
+        json.dump({"storage_type": storage_type, "scale": scale, "offset": offset}, f)
+
+
+def remove_scaling(raster_path):
+    """Deletes the scaling sidecar file of a raster, i.e. when it is overwritten with unscaled values"""
+    if os.path.isfile(str(raster_path) + SCALING_SUFFIX):
+        os.remove(str(raster_path) + SCALING_SUFFIX)
+
+
+def read_scaling(raster_path):
+    """Scale and offset of a raster written with save_scaled, or (1.0, 0.0) for rasters storing their values
+    directly"""
+    scaling_path = str(raster_path) + SCALING_SUFFIX
+    if not os.path.isfile(scaling_path):
+        return 1.0, 0.0
+    with open(scaling_path, "r") as f:
+        scaling = json.load(f)
+    return float(scaling["scale"]), float(scaling["offset"])
+
+
+def scaled_range(storage_type, scale=1.0, offset=0.0):
+    """Smallest and largest values (i.e. WH/m2) that a scaled unsigned integer storage type can hold. The largest
+    integer of the type is reserved for NoData."""
+    return offset, offset + (np.iinfo(np.dtype(STORAGE_TYPES[storage_type])).max - 1) * scale
+
+
+def save_scaled(in_raster, out_raster, bil_path, storage_type="UINT16", scale=1.0, offset=0.0,
+                block_rows=BLOCK_ROWS):
+    """Saves a raster as scaled unsigned integers, storing round((value - offset) / scale) in each cell, so values
+    are kept to a precision of scale / 2. The scale and offset are recorded with write_scaling. Values outside of the
+    range of the storage type (see scaled_range) are clamped to it, with a warning, rather than discarding the run.
+
+    Args:
+        in_raster: Input floating point raster dataset
+        out_raster: Output raster dataset, which must be file-based (i.e. GeoTIFF) for the scaling sidecar file
+        bil_path: Scratch BIL flat file used to store the scaled values before they are copied to the output
+        storage_type: UINT16 or UINT32
+
+    Returns:
+        The number of cells that were clamped.
+    """
+    dtype = np.dtype(STORAGE_TYPES[storage_type])
+    nodata = np.iinfo(dtype).max
+    grid = grid_from_raster(in_raster)
+    flat = create_flat(bil_path, grid, dtype, nodata)
+    out_of_range = 0
+    for window in iter_windows(grid, block_rows):
+        codes = np.round((read_window(in_raster, grid, window) - offset) / scale)
+        out_of_range += int(((codes < 0) | (codes >= nodata)).sum())
+        write_block(flat, window, np.clip(codes, 0, nodata - 1), nodata)
+    flat.flush()
+    del flat
+    if out_of_range:
+        backends.warning("{0} cells are outside of the range of {1} with a scale of {2} and an offset of {3} ({4:g} to "
+                         "{5:g}), and were clamped to it. Use a larger scale or UINT32 storage.".format(
+                             out_of_range, storage_type, scale, offset, *scaled_range(storage_type, scale, offset)))
+    save_flat(bil_path, out_raster)
+    write_scaling(out_raster, storage_type, scale, offset)
+    return out_of_range
+
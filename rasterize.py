@@ -0,0 +1,122 @@
+# file name:	rasterize.py
+# description:	Burns polyline and polygon features directly onto a raster grid with NumPy, without adding fields to
+#               the input feature classes or running a conversion tool. Lines are traced cell by cell between
+#               vertices (Bresenham-style digital line), and polygons are filled by scanline using the cell center
+#               rule of the Polygon to Raster tool. Results are written to a uint8 BIL flat file, with a value of 1 for
+#               burned cells and 0 for all other cells.
+# author:		South Fork Research, Inc.
+# dependencies: numpy, raster_io.py, backends
+
+import numpy as np
+import raster_io as rio
+import backends
+
+
+def read_rings(in_fc, spatial_ref=None):
+    """Reads the vertices of each feature, split into parts (polylines) or rings (polygons).
+
+    Args:
+        in_fc: Input feature class or layer
+        spatial_ref: Optional spatial reference (well-known text) that the features are projected to as they are read
+
+    Returns:
+        A list with one list of (n, 2) vertex coordinate arrays per feature.
+    """
+    features = []
+    for row in backends.get().read_features(in_fc, ["SHAPE@"], spatial_ref):
+        features.append(row[0] or [])
+    return features
+
+
+def line_cells(vertices, grid):
+    """Rows and columns of the cells crossed by a polyline. Each line segment is traced with one cell per step along
+    its major axis, which is the same set of cells as Bresenham's algorithm.
+
+    Args:
+        vertices: (n, 2) array of line vertex coordinates
+        grid: RasterGrid to burn the line onto
+
+    Returns:
+        A tuple of row and column index arrays, clipped to the grid.
+    """
+    rows = (grid.ymax - vertices[:, 1]) / grid.cell_size
+    cols = (vertices[:, 0] - grid.xmin) / grid.cell_size
+    if len(vertices) == 1:
+        r, c = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+    else:
+        r0, c0 = np.floor(rows[:-1]), np.floor(cols[:-1])
+        dr, dc = np.floor(rows[1:]) - r0, np.floor(cols[1:]) - c0
+        nsteps = np.maximum(np.abs(dr), np.abs(dc)).astype(np.int64) + 1
+        seg = np.repeat(np.arange(len(r0)), nsteps)
+        step = np.arange(nsteps.sum()) - np.repeat(np.cumsum(nsteps) - nsteps, nsteps)
+        frac = step / np.maximum(nsteps[seg] - 1, 1).astype(float)
+        r = np.floor(r0[seg] + dr[seg] * frac + 0.5).astype(np.int64)
+        c = np.floor(c0[seg] + dc[seg] * frac + 0.5).astype(np.int64)
+    inside = (r >= 0) & (r < grid.nrows) & (c >= 0) & (c < grid.ncols)
+    return r[inside], c[inside]
+
+
+def polygon_spans(rings, grid):
+    """Row spans of the cells whose centers fall inside a polygon, using the even-odd rule so that interior rings
+    are holes.
+
+    Args:
+        rings: List of (n, 2) ring vertex coordinate arrays of one polygon feature
+        grid: RasterGrid to burn the polygon onto
+
+    Yields:
+        (row, column start, column end) tuples, with exclusive column ends.
+    """
+    edges = []
+    for ring in rings:
+        if len(ring) < 3:
+            continue
+        if (ring[0] != ring[-1]).any():
+            ring = np.vstack([ring, ring[:1]])
+        edges.append(np.column_stack([ring[:-1], ring[1:]]))
+    if not edges:
+        return
+    edges = np.vstack(edges)
+    x0, y0, x1, y1 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+    ymin, ymax = min(y0.min(), y1.min()), max(y0.max(), y1.max())
+    row_start = max(int(np.floor((grid.ymax - ymax) / grid.cell_size)), 0)
+    row_end = min(int(np.ceil((grid.ymax - ymin) / grid.cell_size)), grid.nrows)
+    for row in range(row_start, row_end):
+        yc = grid.ymax - (row + 0.5) * grid.cell_size
+        # edges crossing the row center, counting each vertex once
+        crossing = (y0 <= yc) != (y1 <= yc)
+        if not crossing.any():
+            continue
+        xs = x0[crossing] + (yc - y0[crossing]) * (x1[crossing] - x0[crossing]) / (y1[crossing] - y0[crossing])
+        xs = np.sort(xs)
+        # cells with centers between each pair of crossings
+        c0 = np.ceil((xs[0::2] - grid.xmin) / grid.cell_size - 0.5).astype(np.int64)
+        c1 = np.ceil((xs[1::2] - grid.xmin) / grid.cell_size - 0.5).astype(np.int64)
+        for a, b in zip(np.clip(c0, 0, grid.ncols), np.clip(c1, 0, grid.ncols)):
+            if b > a:
+                yield row, a, b
+
+
+def burn(in_fc, grid, out_bil, feature_type="POLYLINE"):
+    """Rasterizes the features of a polyline or polygon feature class onto a grid. Features are projected to the
+    spatial reference of the grid as they are read.
+
+    Args:
+        in_fc: Input polyline or polygon feature class or layer
+        grid: RasterGrid of the output raster
+        out_bil: Output uint8 BIL flat file, with a value of 1 for cells covered by a feature and 0 elsewhere
+        feature_type: POLYLINE to burn the cells crossed by each line, or POLYGON to burn the cells with centers
+            inside each polygon
+    """
+    out = rio.create_flat(out_bil, grid, "uint8", 255)
+    for rings in read_rings(in_fc, grid.spatial_ref):
+        if feature_type == "POLYGON":
+            for row, c0, c1 in polygon_spans(rings, grid):
+                out[row, c0:c1] = 1
+        else:
+            for vertices in rings:
+                rows, cols = line_cells(vertices, grid)
+                out[rows, cols] = 1
+    out.flush()
+    del out
+    return out_bil
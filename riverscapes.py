@@ -1,12 +1,15 @@
 import os
+import json
 import shutil
-import arcpy
-
-arcpy.env.overwriteOutput = True
+import threading
+from multiprocessing.pool import ThreadPool
+import stage_cache as sc
+import backends
 
 # constants
 RS_SUBDIRS = ["ProjectInputs", "Realizations"] # directories in the Riverscape Project root
 RS_OUTDIRS = ["Inputs", "SolarRasterOutput", "SolarVectorOutput"] # directories storing Riverscape realization inputs/outputs
+RS_HASH_INDEX = "rs_file_hashes.json" # content hashes of the files copied to the project
 
 HUCID_DICT = {"Big-Navarro-Garcia":"18010108",
               "Clearwater":"17060306",
@@ -68,20 +71,147 @@ def writeRealDir(rs_root, real_id):
         os.makedirs(os.path.join(rs_root, RS_SUBDIRS[1], real_id, outdir))
 
 
-def copyRSFiles(from_file, out_file):
-    from_desc = arcpy.Describe(from_file)
-    if from_desc.dataType == "DbaseTable":
-        arcpy.MakeTableView_management(from_file, "from_file_view")
-        arcpy.CopyRows_management("from_file_view", out_file)
-        arcpy.Delete_management("from_file_view")
-    elif from_desc.dataType == "FeatureClass" or from_desc.dataType == "ShapeFile":
-        arcpy.MakeFeatureLayer_management(from_file, "from_file_lyr")
-        arcpy.CopyFeatures_management("from_file_lyr", out_file)
-        arcpy.Delete_management("from_file_lyr")
-    elif from_desc.dataType == "RasterDataset":
-        arcpy.MakeRasterLayer_management(from_file, "from_ras_lyr")
-        arcpy.CopyRaster_management("from_ras_lyr", out_file)
-        arcpy.Delete_management("from_ras_lyr")
+class RSFileIndex(object):
+    """Index of the content hashes of the files in a Riverscapes project, saved as rs_file_hashes.json in the project
+    root. Hashes are remembered by file size and modification time, so unchanged files are only read once, and files
+    that are already in the project are found by their hash without searching the project folders.
+
+    Args:
+        rs_root: Riverscapes project root folder
+    """
+
+    def __init__(self, rs_root):
+        self.rs_root = rs_root
+        self.index_path = os.path.join(rs_root, RS_HASH_INDEX)
+        self.hashes = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    self.hashes = json.load(f)
+            except ValueError:
+                self.hashes = {}
+
+    def hash(self, file_path):
+        """SHA1 hash of the contents of a file, read from the index if the file is unchanged"""
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        with self.lock:
+            known = self.hashes.get(file_path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            return known[2]
+        digest = sc.file_hash(file_path)
+        with self.lock:
+            self.hashes[file_path] = [stat.st_size, stat.st_mtime, digest]
+        return digest
+
+    def record(self, file_path, digest):
+        """Records the known content hash of a file that was just written, without reading it"""
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        with self.lock:
+            self.hashes[file_path] = [stat.st_size, stat.st_mtime, digest]
+
+    def find(self, digest):
+        """Returns an unchanged project file with a content hash, or None"""
+        with self.lock:
+            known = [(path, v) for path, v in self.hashes.items() if v[2] == digest and path.startswith(
+                os.path.abspath(self.rs_root))]
+        for path, (size, mtime, d) in known:
+            if os.path.isfile(path) and os.path.getsize(path) == size and os.path.getmtime(path) == mtime:
+                return path
+        return None
+
+    def save(self):
+        with self.lock:
+            with open(self.index_path, "w") as f:
+                json.dump(self.hashes, f, indent=1)
+
+
+def datasetFiles(dataset):
+    """Lists the files storing a file-based dataset, including its sidecar files (i.e. dem.tfw, dem.tif.aux.xml,
+    dem.tif.ovr and stream.shp.xml)"""
+    folder = os.path.dirname(dataset) or "."
+    base = os.path.basename(dataset)
+    extras = [os.path.join(folder, f) for f in os.listdir(folder) if f.startswith(base + ".")]
+    return sorted(set(sc.dataset_files(dataset) + extras))
+
+
+def isRawCopy(from_file, out_file):
+    """Checks if a dataset can be copied file by file: the source is a file-based dataset (i.e. GeoTIFF or
+    shapefile), and the output is a file with the same extension outside of a geodatabase"""
+    return (os.path.isfile(from_file) and ".gdb" not in out_file.lower() and
+            os.path.splitext(from_file)[1].lower() == os.path.splitext(out_file)[1].lower())
+
+
+def copyRawFiles(from_file, out_file, file_index=None, hard_link=False):
+    """Copies the files of a file-based dataset, renaming them to the output dataset name. Files that are already at
+    the output path with the same contents are skipped. With hard_link, files with the same contents as another file
+    in the project are hard-linked to it instead of copied, where the file system supports it. Hard-linked files share
+    their contents, so editing one (i.e. in ArcMap) also edits the others."""
+    from_stem = os.path.splitext(from_file)[0]
+    out_stem = os.path.splitext(out_file)[0]
+    if not os.path.isdir(os.path.dirname(out_file)):
+        os.makedirs(os.path.dirname(out_file))
+    for from_path in datasetFiles(from_file):
+        out_path = out_stem + from_path[len(from_stem):]
+        if file_index is None:
+            shutil.copyfile(from_path, out_path)
+            continue
+        digest = file_index.hash(from_path)
+        if os.path.isfile(out_path) and file_index.hash(out_path) == digest:
+            continue
+        if os.path.isfile(out_path):
+            os.remove(out_path)
+        existing = file_index.find(digest) if hard_link else None
+        if existing and hasattr(os, "link"):
+            try:
+                os.link(existing, out_path)
+            except OSError:
+                shutil.copyfile(from_path, out_path)
+        else:
+            shutil.copyfile(from_path, out_path)
+        file_index.record(out_path, digest)
+    return out_file
+
+
+def copyRSFiles(from_file, out_file, file_index=None, hard_link=False):
+    """Copies a dataset to a Riverscapes project folder. File-based datasets are copied file by file (see
+    copyRawFiles), and all other datasets (i.e. geodatabase feature classes and tables) are copied by the
+    geoprocessing backend."""
+    if isRawCopy(from_file, out_file):
+        return copyRawFiles(from_file, out_file, file_index, hard_link)
+    return backends.get().copy_dataset(from_file, out_file)
+
+
+def copyRSFileList(copy_list, rs_root, threads=4, hard_link=None):
+    """Copies a list of datasets to a Riverscapes project. File-based datasets are copied by a pool of threads, with
+    files that are already in the project skipped (see copyRawFiles). Datasets that need the geoprocessing backend
+    are copied one at a time.
+
+    Args:
+        copy_list: List of (source dataset, output dataset) tuples
+        rs_root: Riverscapes project root folder
+        threads: Number of file-based datasets copied at the same time
+        hard_link: If True, hard-links files identical to a file already in the project instead of copying them. If
+            None, hard-linking is enabled by setting the SOLARSTREAM_HARD_LINK environment variable to 1.
+    """
+    if hard_link is None:
+        hard_link = os.environ.get("SOLARSTREAM_HARD_LINK") == "1"
+    file_index = RSFileIndex(rs_root)
+    raw = [(f, o) for f, o in copy_list if isRawCopy(str(f), str(o))]
+    if raw:
+        pool = ThreadPool(max(min(threads, len(raw)), 1))
+        try:
+            pool.map(lambda pair: copyRawFiles(str(pair[0]), str(pair[1]), file_index, hard_link), raw)
+        finally:
+            pool.close()
+            pool.join()
+    for from_file, out_file in copy_list:
+        if (from_file, out_file) not in raw:
+            copyRSFiles(str(from_file), str(out_file))
+    file_index.save()
+    return
 
 
 def getRSDirAbs(root, subdir_index='', outdir_index='', real_id=''):
@@ -0,0 +1,398 @@
+# file name:	segments.py
+# description:	Divides the stream area into stream segment zones without geoprocessing. Stream network centerlines
+#               are densified with NumPy, and each stream area cell on the raster grid is assigned the segment of the
+#               nearest densified vertex, which is the raster form of the Thiessen (Voronoi) tessellation of the
+#               vertices tagged with their segment ID. The result is a segment zone raster. Connected subnetworks
+#               (i.e. separate basins) can be divided in parallel, and a single connected network is divided in
+#               parallel strips.
+# author:		South Fork Research, Inc.
+# dependencies: numpy, raster_io.py, tiling.py, profiling.py, util.py, zonal.py, backends, scipy (optional)
+
+import hashlib
+import multiprocessing
+import numpy as np
+import raster_io as rio
+import tiling
+import profiling
+import util as u
+import zonal
+import backends
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+ZONE_NODATA = -1
+# strips of cells per worker process when a single connected network is divided in parallel, to balance the load
+STRIPS_PER_PROCESS = 4
+
+
+def densify(vertices, spacing):
+    """Inserts vertices along a line so that no two consecutive vertices are further apart than the spacing.
+
+    Args:
+        vertices: (n, 2) array of line vertex coordinates
+        spacing: Maximum distance between vertices
+
+    Returns:
+        An (m, 2) array of the densified line vertices, including the original vertices.
+    """
+    if len(vertices) < 2:
+        return vertices
+    start = vertices[:-1]
+    step = vertices[1:] - start
+    nsteps = np.maximum(np.ceil(np.hypot(step[:, 0], step[:, 1]) / spacing), 1).astype(np.int64)
+    seg = np.repeat(np.arange(len(start)), nsteps)
+    frac = (np.arange(nsteps.sum()) - np.repeat(np.cumsum(nsteps) - nsteps, nsteps)) / nsteps[seg].astype(float)
+    return np.vstack([start[seg] + step[seg] * frac[:, np.newaxis], vertices[-1:]])
+
+
+def segment_vertices(in_stream, spacing, id_field="OID@"):
+    """Reads and densifies the centerlines of a stream network.
+
+    Returns:
+        A tuple of an (n, 2) array of vertex coordinates, an array of the segment ID of each vertex, and a list of
+        (segment ID, start point, end point) tuples for each line part.
+    """
+    xy = []
+    ids = []
+    ends = []
+    for seg_id, parts in backends.get().read_features(in_stream, [id_field, "SHAPE@"]):
+        if parts is None:
+            continue
+        for vertices in parts:
+            if len(vertices) == 0:
+                continue
+            ends.append((seg_id, tuple(vertices[0]), tuple(vertices[-1])))
+            vertices = densify(vertices, spacing)
+            xy.append(vertices)
+            ids.append(np.full(len(vertices), seg_id, dtype=np.int64))
+    if not xy:
+        return np.zeros((0, 2)), np.zeros(0, dtype=np.int64), ends
+    return np.vstack(xy), np.concatenate(ids), ends
+
+
+def subnetworks(ends, tolerance=0.1):
+    """Groups stream segments into connected subnetworks, joining segments that share an end point.
+
+    Args:
+        ends: List of (segment ID, start point, end point) tuples
+        tolerance: Snapping distance for matching end points
+
+    Returns:
+        A dictionary of segment ID to subnetwork label.
+    """
+    parent = {}
+
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    node_seg = {}
+    for seg_id, start, end in ends:
+        parent.setdefault(seg_id, seg_id)
+        for pt in (start, end):
+            key = u.coord_key(pt[0], pt[1], tolerance)
+            if key in node_seg:
+                root_a, root_b = find(seg_id), find(node_seg[key])
+                if root_a != root_b:
+                    parent[root_a] = root_b
+            else:
+                node_seg[key] = seg_id
+    roots = {}
+    return dict([(seg_id, roots.setdefault(find(seg_id), len(roots))) for seg_id in parent])
+
+
+class NearestIndex(object):
+    """Nearest neighbor search over a set of points. Uses scipy's cKDTree when scipy is installed, and otherwise a
+    square bucket grid that is searched in expanding rings.
+
+    Args:
+        xy: (n, 2) array of point coordinates
+        bucket_size: Bucket width for the bucket grid search
+    """
+
+    def __init__(self, xy, bucket_size):
+        self.xy = xy
+        self.bucket_size = float(bucket_size)
+        if cKDTree is not None:
+            self.tree = cKDTree(xy)
+            return
+        self.tree = None
+        keys = np.floor(xy / self.bucket_size).astype(np.int64)
+        order = np.lexsort((keys[:, 1], keys[:, 0]))
+        self.order = order
+        keys = keys[order]
+        self.buckets = {}
+        if len(keys):
+            breaks = np.flatnonzero((np.diff(keys, axis=0) != 0).any(axis=1)) + 1
+            starts = np.concatenate([[0], breaks])
+            ends = np.concatenate([breaks, [len(keys)]])
+            for s, e in zip(starts, ends):
+                self.buckets[(int(keys[s, 0]), int(keys[s, 1]))] = (s, e)
+            self.key_min = keys.min(axis=0)
+            self.key_max = keys.max(axis=0)
+
+    def query(self, qxy):
+        """Returns the distance to and index of the nearest point for each query coordinate"""
+        if self.tree is not None:
+            return self.tree.query(qxy)
+        distance = np.zeros(len(qxy), dtype=np.float64)
+        result = np.zeros(len(qxy), dtype=np.int64)
+        qkeys = np.floor(qxy / self.bucket_size).astype(np.int64)
+        order = np.lexsort((qkeys[:, 1], qkeys[:, 0]))
+        sorted_keys = qkeys[order]
+        breaks = np.flatnonzero((np.diff(sorted_keys, axis=0) != 0).any(axis=1)) + 1
+        for group in np.split(order, breaks):
+            if len(group):
+                bx, by = qkeys[group[0]]
+                distance[group], result[group] = self._query_bucket(qxy[group], int(bx), int(by))
+        return distance, result
+
+    def _query_bucket(self, qxy, bx, by):
+        """Finds the nearest points to query coordinates within the same bucket. Points outside of a ring of r buckets
+        around the query bucket are at least r bucket widths away, so the search stops at the first ring that contains
+        every nearest point found so far."""
+        # ring that covers every bucket
+        last_ring = max(abs(bx - self.key_min[0]), abs(bx - self.key_max[0]),
+                        abs(by - self.key_min[1]), abs(by - self.key_max[1]))
+        ring = 0
+        while True:
+            candidates = []
+            for kx in range(bx - ring, bx + ring + 1):
+                for ky in range(by - ring, by + ring + 1):
+                    span = self.buckets.get((kx, ky))
+                    if span:
+                        candidates.append(self.order[span[0]:span[1]])
+            if candidates:
+                candidates = np.concatenate(candidates)
+                diff = qxy[:, np.newaxis, :] - self.xy[candidates][np.newaxis, :, :]
+                dist = (diff ** 2).sum(axis=2)
+                best = dist.argmin(axis=1)
+                best_dist = np.sqrt(dist[np.arange(len(qxy)), best])
+                if best_dist.max() <= ring * self.bucket_size or ring >= last_ring:
+                    return best_dist, candidates[best]
+            ring += 1
+
+
+def _nearest_job(job):
+    """Worker function that finds the nearest segment of one subnetwork for a set of cell centers"""
+    xy, ids, cxy, bucket_size = job
+    distance, nearest = NearestIndex(xy, bucket_size).query(cxy)
+    return distance, ids[nearest]
+
+
+def _subnetwork_jobs(xy, ids, cxy, labels, margin):
+    """Splits a nearest segment search by connected subnetwork, with the cells within a margin of each subnetwork
+    extent"""
+    vertex_labels = np.array([labels[i] for i in ids], dtype=np.int64) if len(ids) else np.zeros(0, dtype=np.int64)
+    for label in np.unique(vertex_labels):
+        sub_xy = xy[vertex_labels == label]
+        lo = sub_xy.min(axis=0) - margin
+        hi = sub_xy.max(axis=0) + margin
+        cells = np.flatnonzero((cxy[:, 0] >= lo[0]) & (cxy[:, 0] <= hi[0]) &
+                               (cxy[:, 1] >= lo[1]) & (cxy[:, 1] <= hi[1]))
+        if len(cells):
+            yield vertex_labels == label, cells
+
+
+def _strip_jobs(xy, cxy, count, margin):
+    """Splits a nearest segment search into strips of cells across the longer side of the network, each with the
+    vertices within a margin (halo) of the strip extent"""
+    axis = 0 if np.ptp(cxy[:, 0]) >= np.ptp(cxy[:, 1]) else 1
+    for cells in np.array_split(np.argsort(cxy[:, axis], kind="mergesort"), count):
+        if not len(cells):
+            continue
+        lo = cxy[cells].min(axis=0) - margin
+        hi = cxy[cells].max(axis=0) + margin
+        vertices = (xy[:, 0] >= lo[0]) & (xy[:, 0] <= hi[0]) & (xy[:, 1] >= lo[1]) & (xy[:, 1] <= hi[1])
+        if vertices.any():
+            yield vertices, np.sort(cells)
+
+
+def nearest_segment(xy, ids, cxy, bucket_size, labels=None, processes=1):
+    """Finds the segment ID of the nearest densified vertex for each cell center.
+
+    With more than one process, each connected subnetwork is searched by a separate worker, using only the cells
+    within a margin of the subnetwork extent. A single connected network is instead split into strips of cells, and
+    each strip is searched against the vertices within the margin of it. The results are stitched together by keeping
+    the nearest segment. Cells that are further than the margin from every vertex searched are searched against the
+    whole network, so the result is the same as that of a single process.
+
+    Args:
+        xy: (n, 2) array of densified vertex coordinates
+        ids: Segment ID of each vertex
+        cxy: (m, 2) array of cell center coordinates
+        bucket_size: Bucket width for the nearest neighbor search, which also sets the subnetwork and strip margin
+        labels: Optional dictionary of segment ID to subnetwork label
+        processes: Number of worker processes. 0 uses all CPUs.
+    """
+    if processes == 1:
+        return ids[NearestIndex(xy, bucket_size).query(cxy)[1]]
+
+    margin = bucket_size * 4
+    if labels is not None and len(set(labels.values())) > 1:
+        splits = _subnetwork_jobs(xy, ids, cxy, labels, margin)
+    else:
+        workers = processes if processes > 0 else multiprocessing.cpu_count()
+        splits = _strip_jobs(xy, cxy, workers * STRIPS_PER_PROCESS, margin)
+    jobs = []
+    job_cells = []
+    for vertices, cells in splits:
+        jobs.append((xy[vertices], ids[vertices], cxy[cells], bucket_size))
+        job_cells.append(cells)
+
+    best_dist = np.empty(len(cxy))
+    best_dist.fill(np.inf)
+    best_id = np.empty(len(cxy), dtype=np.int64)
+    best_id.fill(ZONE_NODATA)
+    tiling.set_worker_executable()
+    pool = multiprocessing.Pool(processes if processes > 0 else None)
+    try:
+        for cells, (distance, seg_ids) in zip(job_cells, pool.imap(_nearest_job, jobs)):
+            closer = distance < best_dist[cells]
+            best_dist[cells[closer]] = distance[closer]
+            best_id[cells[closer]] = seg_ids[closer]
+    finally:
+        pool.close()
+        pool.join()
+
+    # a cell outside of a subnetwork or strip margin is more than the margin from every vertex that was not searched
+    far = best_dist > margin
+    if far.any():
+        best_id[far] = ids[NearestIndex(xy, bucket_size).query(cxy[far])[1]]
+    return best_id
+
+
+def segment_zones(in_stream, in_area, grid, out_zones, spacing=10.0, processes=1, block_rows=rio.BLOCK_ROWS):
+    """Assigns each stream area cell the ID of the nearest stream segment, and writes the segment zone raster.
+
+    Args:
+        in_stream: Stream network feature class, with one feature per segment
+        in_area: Raster dataset(s) of the stream area, with a value of 1 for stream area cells (i.e. the rasterized
+            stream network and stream area polygons)
+        grid: RasterGrid of the output zone raster
+        out_zones: Output segment zone BIL file, with the segment OID of each stream area cell
+        spacing: Distance between densified centerline vertices
+        processes: Number of worker processes used to divide connected subnetworks (or strips of a single connected
+            network) in parallel. 1 divides the whole network in this process, and 0 uses all CPUs.
+    """
+    backends.message("Dividing stream area by segments...")
+    if not isinstance(in_area, (list, tuple)):
+        in_area = [in_area]
+    with profiling.stage("segment_vertices"):
+        xy, ids, ends = segment_vertices(in_stream, spacing)
+        labels = subnetworks(ends) if processes != 1 else None
+
+    # collect the stream area cells
+    with profiling.stage("stream_area_cells"):
+        cell_rows = []
+        cell_cols = []
+        for window in rio.iter_windows(grid, block_rows):
+            area = np.zeros((window[1] - window[0], grid.ncols), dtype=bool)
+            for in_ras in in_area:
+                area |= rio.read_window(in_ras, grid, window) == 1
+            rows, cols = np.nonzero(area)
+            cell_rows.append(rows + window[0])
+            cell_cols.append(cols)
+        rows = np.concatenate(cell_rows)
+        cols = np.concatenate(cell_cols)
+
+    with profiling.stage("nearest_segment", [out_zones]):
+        zones = rio.create_flat(out_zones, grid, "int32", ZONE_NODATA, fill=ZONE_NODATA)
+        if len(xy) and len(rows):
+            cxy = np.column_stack([grid.xmin + (cols + 0.5) * grid.cell_size,
+                                   grid.ymax - (rows + 0.5) * grid.cell_size])
+            zones[rows, cols] = nearest_segment(xy, ids, cxy, max(spacing, grid.cell_size) * 8, labels, processes)
+        zones.flush()
+        del zones
+    return out_zones
+
+
+def segment_hashes(in_stream, key_field="LineOID"):
+    """Hashes the geometry of each stream segment, for finding the segments that changed between runs.
+
+    Returns:
+        A dictionary of segment key (i.e. LineOID, as a string) to a [OID, geometry hash] list.
+    """
+    hashes = {}
+    for key, oid, wkb in backends.get().read_features(in_stream, [key_field, "OID@", "WKB@"]):
+        digest = hashlib.sha1(wkb).hexdigest() if wkb is not None else ""
+        hashes[str(key)] = [oid, digest]
+    return hashes
+
+
+def update_zones(old_index, old_hashes, new_hashes, in_stream, in_area, spacing=10.0, block_rows=rio.BLOCK_ROWS):
+    """Updates a segment zone index after some stream segments were added, removed or edited. Only the stream area
+    cells within a margin of the changed segments (their old zone cells and their new centerlines) are divided again,
+    and all other cells keep their zone from the old index.
+
+    Args:
+        old_index: ZoneIndex of the previous stream network
+        old_hashes: Segment hashes of the previous stream network, from segment_hashes()
+        new_hashes: Segment hashes of the current stream network
+        in_stream: Current stream network feature class
+        in_area: Raster dataset(s) of the current stream area, with a value of 1 for stream area cells
+
+    Returns:
+        A tuple of the updated ZoneIndex and the set of zone IDs (current OIDs) whose cells were divided again.
+    """
+    grid = old_index.grid
+    if not isinstance(in_area, (list, tuple)):
+        in_area = [in_area]
+    unchanged_keys = [key for key in new_hashes if key in old_hashes and old_hashes[key][1] == new_hashes[key][1]]
+    changed_oids = set([new_hashes[key][0] for key in new_hashes]) - \
+        set([new_hashes[key][0] for key in unchanged_keys])
+    oid_map = dict([(old_hashes[key][0], new_hashes[key][0]) for key in unchanged_keys])
+
+    # old cells, with the zones of unchanged segments mapped to their current OIDs
+    rows, cols, old_zones = old_index.cells()
+    zones = np.array([oid_map.get(z, ZONE_NODATA) for z in old_zones.tolist()], dtype=np.int64)
+    unchanged = zones != ZONE_NODATA
+
+    with profiling.stage("segment_vertices"):
+        xy, ids = segment_vertices(in_stream, spacing)[:2]
+    changed_xy = np.vstack([xy[np.isin(ids, np.array(sorted(changed_oids), dtype=np.int64))],
+                            np.column_stack([grid.xmin + (cols[~unchanged] + 0.5) * grid.cell_size,
+                                             grid.ymax - (rows[~unchanged] + 0.5) * grid.cell_size])])
+    if not len(changed_xy) or not len(xy):
+        return zonal.ZoneIndex.from_cells(grid, rows[unchanged], cols[unchanged], zones[unchanged]), set()
+
+    # window of cells to divide again
+    bucket_size = max(spacing, grid.cell_size) * 8
+    margin = bucket_size * 4
+    lo = changed_xy.min(axis=0) - margin
+    hi = changed_xy.max(axis=0) + margin
+    r0 = max(int(np.floor((grid.ymax - hi[1]) / grid.cell_size)), 0)
+    r1 = min(int(np.ceil((grid.ymax - lo[1]) / grid.cell_size)), grid.nrows)
+    c0 = max(int(np.floor((lo[0] - grid.xmin) / grid.cell_size)), 0)
+    c1 = min(int(np.ceil((hi[0] - grid.xmin) / grid.cell_size)), grid.ncols)
+    keep = unchanged & ~((rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1))
+
+    region_rows = [np.zeros(0, dtype=np.int64)]
+    region_cols = [np.zeros(0, dtype=np.int64)]
+    for b0 in range(r0, r1, block_rows):
+        window = (b0, min(b0 + block_rows, r1), c0, c1)
+        area = np.zeros((window[1] - window[0], c1 - c0), dtype=bool)
+        for in_ras in in_area:
+            area |= rio.read_window(in_ras, grid, window) == 1
+        brows, bcols = np.nonzero(area)
+        region_rows.append(brows + window[0])
+        region_cols.append(bcols + c0)
+    region_rows = np.concatenate(region_rows)
+    region_cols = np.concatenate(region_cols)
+    region_zones = np.zeros(0, dtype=np.int64)
+    if len(region_rows):
+        cxy = np.column_stack([grid.xmin + (region_cols + 0.5) * grid.cell_size,
+                               grid.ymax - (region_rows + 0.5) * grid.cell_size])
+        with profiling.stage("nearest_segment"):
+            region_zones = ids[NearestIndex(xy, bucket_size).query(cxy)[1]]
+
+    index = zonal.ZoneIndex.from_cells(grid, np.concatenate([rows[keep], region_rows]),
+                                       np.concatenate([cols[keep], region_cols]),
+                                       np.concatenate([zones[keep], region_zones]))
+    affected = changed_oids | set(np.unique(region_zones).tolist()) | set(np.unique(zones[unchanged & ~keep]).tolist())
+    return index, affected
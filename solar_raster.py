@@ -2,15 +2,22 @@
 # description:	This tool calculates solar insolation for a user-supplied raster. The tool automates the process of adding
 #               a raster representing vegetation height to a topographic DEM raster, then using this raster to generate a
 #               solar insolation raster dataset for a user-defined time period and interval.  The Generate Solar Insolation
-#               Surface tool relies heavily on ESRI's Area Solar Radiation tool.
+#               Surface tool relies heavily on ESRI's Area Solar Radiation tool, or on the NumPy solar backend when run
+#               without ArcGIS.
 # author:		Jesse Langdon
-# dependencies: ESRI arcpy module, Spatial Analyst extension, util.py
+# dependencies: backends (the ArcGIS solar backend needs the ARCPY backend and the Spatial Analyst extension), util.py
 
 
-import arcpy
 import os
+import math
 import time
-from arcpy.sa import *
+import backends
+import insolation as ins
+import tiling
+import stage_cache as sc
+import surface as sf
+import raster_io as rio
+import profiling
 import util as u
 import metadata.meta_rs as meta_rs
 import metadata.meta_sfr as meta_sfr
@@ -18,9 +25,11 @@ import riverscapes as rs
 
 version = "0.5.9"
 
-# set environmental variables
-arcpy.CheckOutExtension("Spatial")
-arcpy.env.overwriteOutput = True
+# solar modeling backends
+SOLAR_BACKENDS = ["ARCGIS", "NUMPY"]
+# largest grid (cells) that the NumPy solar backend calculates in a single pass. Larger untiled grids are tiled, so the
+# surface and the per-cell working arrays are never held in memory for the whole grid.
+NUMPY_MAX_CELLS = 4000 * 4000
 
 
 def metadata(solarXML,
@@ -33,7 +42,11 @@ def metadata(solarXML,
              hour_intv,
              result,
              real_name,
-             real_id):
+             real_id,
+             solar_backend="ARCGIS",
+             storage_type="FLOAT32",
+             storage_scale=1.0,
+             storage_offset=0.0):
     """Builds and writes an XML file according to the Riverscapes Project specifications
 
         Args:
@@ -56,6 +69,11 @@ def metadata(solarXML,
     solarXML.addParameter("Time configuration", time_config, solarXML.project, "Solar", real_id)
     solarXML.addParameter("Day interval", day_intv, solarXML.project, "Solar", real_id)
     solarXML.addParameter("Hour interval", hour_intv, solarXML.project, "Solar", real_id)
+    solarXML.addParameter("Solar backend", solar_backend, solarXML.project, "Solar", real_id)
+    # stored solar insolation = (WH/m2 - offset) / scale
+    solarXML.addParameter("Storage type", storage_type, solarXML.project, "Solar", real_id)
+    solarXML.addParameter("Storage scale", storage_scale, solarXML.project, "Solar", real_id)
+    solarXML.addParameter("Storage offset", storage_offset, solarXML.project, "Solar", real_id)
     # Add Realization input tags
     solarXML.addRealizationInputRef(solarXML.project, "Raster", "Solar", real_id, "DEM")
     solarXML.addRealizationInputData(solarXML.project, "Raster", "Solar", real_id, "Vegetation height", in_canopy,
@@ -70,6 +88,72 @@ def metadata(solarXML,
     solarXML.write()
 
 
+def vegtopo_surface(in_dem, in_canopy, in_stream, in_strm_area, scratch, out_surface, out_mask, debug_dir=None):
+    """Converts the stream network and stream area polygons to raster format, then builds the vegetation and
+    topography surface (bare earth DEM plus vegetation height, with vegetation removed from stream cells) and the
+    stream mask in a single pass.
+
+        Args:
+            scratch: RunScratch namespace of the run, for the stream network and stream area rasters
+            out_surface: Output vegetation and topography surface BIL file
+            out_mask: Output stream mask BIL file, with a value of 1 for stream cells and 0 for all other cells
+            debug_dir: Optional folder that the intermediate stream mask and canopy rasters are also written to
+    """
+    # convert stream and stream area polygon to two-class raster dataset
+    strm_ras, poly_ras = u.raster_poly(in_dem, in_stream, in_strm_area, scratch)
+
+    sf.fuse_surface(in_dem, in_canopy, strm_ras, poly_ras, out_surface, out_mask, debug_dir)
+    return
+
+
+def corridor_mask(in_mask, corridor_buffer, cellSize, out_corridor):
+    """Expands the stream mask by the corridor buffer distance, with a value of 1 within the corridor and NoData
+    elsewhere.
+
+        Args:
+            in_mask: Stream mask raster dataset, with a value of 1 for stream cells
+            corridor_buffer: Corridor buffer distance (meters)
+            out_corridor: Output stream corridor mask BIL file
+    """
+    backends.message("Building stream corridor mask...")
+    buffer_cells = int(math.ceil(corridor_buffer / cellSize))
+    sf.expand_mask(in_mask, out_corridor, max(buffer_cells, 0))
+    return
+
+
+def numpy_solar(in_surface, out_raster, scratch_dir, latitude, sky_size, time_config, day_intrvl, hour_intrvl,
+                in_mask=None, search_distance=tiling.DEFAULT_SEARCH_DISTANCE):
+    """Calculates solar insolation using the NumPy engine in insolation.py instead of the Area Solar Radiation tool.
+
+        Args:
+            in_surface: Elevation surface (bare earth DEM plus vegetation height) raster dataset
+            out_raster: Output solar insolation raster dataset
+            scratch_dir: Folder used to store the insolation flat file before it is copied to the output raster
+            in_mask: Optional stream corridor mask raster dataset. Insolation is only calculated where the mask is 1.
+            search_distance: Maximum horizon search distance (meters), the same as for tiled runs
+    """
+    grid = rio.grid_from_raster(in_surface)
+    full = (0, grid.nrows, 0, grid.ncols)
+    if rio.is_flat(in_surface):
+        elev = rio.open_flat(in_surface).read()
+    else:
+        elev = rio.read_window(in_surface, grid, full)
+    mask = None
+    if in_mask:
+        mask = rio.read_window(in_mask, grid, full) == 1
+    area_solar = ins.area_solar_radiation(elev, grid.cell_size, latitude, time_config, day_intrvl,
+                                          hour_intrvl, sky_size, search_distance=search_distance, mask=mask,
+                                          cache_dir=ins.default_cache_dir())
+    del elev, mask
+    solar_flat = os.path.join(scratch_dir, "solar_numpy.bil")
+    out_flat = rio.create_flat(solar_flat, grid, "float32", rio.FLOAT_NODATA)
+    rio.write_block(out_flat, full, area_solar)
+    out_flat.flush()
+    del out_flat
+    rio.save_flat(solar_flat, out_raster)
+    return
+
+
 def main(in_dem,
          in_canopy,
          in_stream,
@@ -82,21 +166,49 @@ def main(in_dem,
          rs_bool,
          rs_dir='',
          proj_name='',
-         real_name=''):
+         real_name='',
+         solar_backend="ARCGIS",
+         tile_size=0,
+         search_distance=tiling.DEFAULT_SEARCH_DISTANCE,
+         processes=0,
+         corridor_buffer='',
+         keep_intermediates=False,
+         tile_latitude=False,
+         tiled_tiff=False,
+         storage_type="FLOAT32",
+         storage_scale=1.0,
+         storage_offset=0.0,
+         real_id=''):
 
     # set environmental variables
-    arcpy.env.outputCoordinateSystem = in_dem
-    arcpy.env.snapRaster = in_dem
-    arcpy.env.mask = in_dem
-    desc = arcpy.Describe(in_dem)
-    cellSize = desc.meanCellHeight
-    arcpy.env.cellSize = cellSize
-    arcpy.env.workspace = workspace_temp
-    arcpy.env.scratchWorkspace = workspace_temp
-    in_ras = arcpy.sa.Raster(in_dem)
-    in_ras_extent = in_ras.extent
-    arcpy.env.extent = in_ras_extent
+    gp = backends.get()
+    gp.set_environment(in_dem, workspace_temp)
+    dem_grid = rio.grid_from_raster(in_dem)
+    cellSize = dem_grid.cell_size
+    if solar_backend == "ARCGIS" and not gp.solar_tools:
+        gp.warning("The ArcGIS solar backend needs arcpy, which the {0} geoprocessing backend doesn't use. "
+                   "Using the NumPy solar backend.".format(gp.name))
+        solar_backend = "NUMPY"
     out_dir = os.path.dirname(out_raster)
+    tile_size = int(tile_size) if tile_size else 0
+    search_distance = float(search_distance) if search_distance else tiling.DEFAULT_SEARCH_DISTANCE
+    processes = int(processes) if processes else 0
+    if solar_backend == "NUMPY" and tile_size <= 0 and dem_grid.nrows * dem_grid.ncols > NUMPY_MAX_CELLS:
+        gp.warning("The DEM has {0} cells, which is too large to calculate with the NumPy solar backend in a single "
+                   "pass. Using tiles of {1} cells per side.".format(dem_grid.nrows * dem_grid.ncols,
+                                                                     tiling.DEFAULT_TILE_SIZE))
+        tile_size = tiling.DEFAULT_TILE_SIZE
+    corridor_buffer = float(corridor_buffer) if corridor_buffer not in ('', None, '#') else None
+    tile_latitude = tile_latitude in (True, "true")
+    tiled_tiff = tiled_tiff in (True, "true")
+    storage_type = storage_type if storage_type in rio.STORAGE_TYPES else "FLOAT32"
+    storage_scale = float(storage_scale) if storage_scale not in ('', None, '#') else 1.0
+    storage_offset = float(storage_offset) if storage_offset not in ('', None, '#') else 0.0
+    if storage_type != "FLOAT32" and ".gdb" in out_raster.lower():
+        gp.warning("Scaled integer storage needs a file-based output raster (i.e. GeoTIFF). Storing as FLOAT32.")
+        storage_type = "FLOAT32"
+    if storage_type != "FLOAT32" and storage_scale <= 0:
+        raise ValueError("The storage scale must be greater than 0.")
 
     in_dem_name = os.path.basename(in_dem)
     in_canopy_name = os.path.basename(in_canopy)
@@ -117,63 +229,129 @@ def main(in_dem,
     mWriter.currentRun.addParameter("Time configuration", time_config)
     mWriter.currentRun.addParameter("Day interval", day_intrvl)
     mWriter.currentRun.addParameter("Hour interval", hour_intrvl)
+    mWriter.currentRun.addParameter("Solar backend", solar_backend)
+    mWriter.currentRun.addParameter("Tile size", tile_size)
+    mWriter.currentRun.addParameter("Horizon search distance", search_distance)
+    mWriter.currentRun.addParameter("Worker processes", processes)
+    mWriter.currentRun.addParameter("Stream corridor buffer", corridor_buffer)
+    mWriter.currentRun.addParameter("Per-tile latitude", tile_latitude)
+    mWriter.currentRun.addParameter("Tiled GeoTIFF output", tiled_tiff)
+    mWriter.currentRun.addParameter("Storage type", storage_type)
+    mWriter.currentRun.addParameter("Storage scale", storage_scale)
+    mWriter.currentRun.addParameter("Storage offset", storage_offset)
     mWriter.currentRun.addOutput("Output solar raster dataset", out_raster)
     mWriter.currentRun.addOutput("Metadata XML file", out_xml)
 
     # initiate Riverscapes project XML object
     if rs_bool == "true":
-        rs_xml = "{0}\\{1}".format(rs_dir, "project.rs.xml")
+        rs_xml = os.path.join(rs_dir, "project.rs.xml")
         projectXML = meta_rs.ProjectXML("existing", rs_xml, "Solar", proj_name)
 
     # solar parameters
     sky_size = 400
 
-    # find latitude of the stream network centroid
-    wgs84_prj = r"Coordinate Systems\Geographic Coordinate Systems\World\WGS 1984.prj"
-    prjFile = os.path.join(arcpy.GetInstallInfo()["InstallDir"], wgs84_prj)
-    temp_spRef = arcpy.SpatialReference(prjFile)
-    with (arcpy.da.SearchCursor(in_stream, ["SHAPE@Y"], "#", temp_spRef)) as cursor:
-        for row in cursor:
-            latitude = row[0]
+    # time each processing stage for the run metadata
+    prof = profiling.Profiler("solar_raster")
 
-    # convert stream and stream area polygon to two-class raster dataset
-    tmp_stream_line = arcpy.FeatureClassToFeatureClass_conversion(in_stream, workspace_temp, "tmp_stream_line")
-    tmp_stream_poly = arcpy.FeatureClassToFeatureClass_conversion(in_strm_area, workspace_temp, "tmp_strm_poly")
-    arcpy.MakeFeatureLayer_management(tmp_stream_line, "in_strm_line_lyr")
-    arcpy.MakeFeatureLayer_management(tmp_stream_poly, "in_strm_poly_lyr")
-    poly_strm_area, strm_ras, poly_ras = u.raster_poly(in_dem, "in_strm_line_lyr", "in_strm_poly_lyr",
-                                                       workspace_temp)
-    arcpy.CalculateStatistics_management(strm_ras)
-    arcpy.CalculateStatistics_management(poly_ras)
-    strm_ras_lyr = "strm_ras_lyr"
-    poly_ras_lyr = "poly_ras_lyr"
-    arcpy.MakeRasterLayer_management(strm_ras, strm_ras_lyr)
-    arcpy.MakeRasterLayer_management(poly_ras, poly_ras_lyr)
-
-    # prepare elevation data for solar radiation modeling
-    arcpy.AddMessage("Calculating solar radiation...")
-    rcls_strm_line = Reclassify(strm_ras, "VALUE", RemapValue([[1, 1], ["NODATA", 0]]))
-    rcls_strm_line.save(workspace_temp + r"\rcls_strm_line")
-    rcls_strm_poly = Reclassify(poly_ras, "VALUE", RemapValue([[1, 1], ["NODATA", 0]]))
-    rcls_strm_poly.save(workspace_temp + r"\rcls_strm_poly")
-    plus_rcls = Plus(rcls_strm_line, rcls_strm_poly)
-    plus_rcls.save(workspace_temp + r"\plus_rcls")
-    strm_mask = Reclassify(plus_rcls, "VALUE", RemapValue([[0, 0], [1,1], [2,1]]))
-    strm_mask.save(workspace_temp + r"\strm_mask")
-    remove_strm = Con(strm_mask, 0, in_canopy, "VALUE = 1")
-    remove_strm.save(workspace_temp + r"\remove_strm")
-    elev_vegtopo = Plus(remove_strm, in_dem)
-    elev_vegtopo.save(workspace_temp + r"\elev_vegtopo")
-
-    # calculate mean solar radiation per bankfull buffer
-    area_solar = AreaSolarRadiation(elev_vegtopo, latitude, sky_size, time_config, day_intrvl, hour_intrvl)
-    area_solar.save(out_raster)
-    arcpy.AddMessage("Tool output saved to " + out_raster)
+    # find latitude of the stream network extent center
+    with prof.stage("latitude"):
+        latitude = u.get_latitude(in_stream)
+    mWriter.currentRun.addResult("Latitude", str(latitude))
+
+    # check the range of scaled integer storage before insolation is calculated
+    if storage_type != "FLOAT32":
+        range_min, range_max = rio.scaled_range(storage_type, storage_scale, storage_offset)
+        if range_min > 0:
+            gp.warning("Insolation values below the storage offset ({0:g} WH/m2) can't be stored as {1}, and will be "
+                       "stored as the offset.".format(range_min, storage_type))
+        estimate = ins.max_insolation(latitude, time_config, day_intrvl, hour_intrvl, sky_size,
+                                      cache_dir=ins.default_cache_dir())
+        if estimate > range_max:
+            gp.warning("Insolation values may reach {0:,.0f} WH/m2, but {1} with a scale of {2:g} and an offset of "
+                       "{3:g} only holds values up to {4:,.0f} WH/m2. Larger values will be clamped. Use a scale of "
+                       "at least {5:g} or UINT32 storage.".format(estimate, storage_type, storage_scale,
+                                                                  storage_offset, range_max,
+                                                                  math.ceil((estimate - storage_offset) /
+                                                                            (range_max - storage_offset) *
+                                                                            storage_scale)))
+
+    # prepare elevation data for solar radiation modeling, reusing cached stages if their inputs are unchanged
+    scratch_folder = u.get_scratch_folder(workspace_temp)
+    scratch = u.RunScratch(workspace_temp)
+    cache = sc.StageCache(scratch_folder)
+    surface_key = cache.key("elev_vegtopo", [in_dem, in_canopy, in_stream, in_strm_area])
+    elev_vegtopo = cache.lookup("elev_vegtopo", surface_key)
+    strm_mask = cache.lookup("strm_mask", surface_key)
+    if elev_vegtopo and strm_mask:
+        gp.message("Reusing cached vegetation and topography surface " + elev_vegtopo)
+    else:
+        gp.message("Building vegetation and topography surface...")
+        # cached stages are built in the scratch folder of the run, then moved to the shared cache once complete,
+        # so runs that miss the cache at the same time don't write to the same files
+        run_surface = scratch.file("veg_{0}.bil".format(surface_key[:8]))
+        run_mask = scratch.file("msk_{0}.bil".format(surface_key[:8]))
+        debug_dir = None
+        if keep_intermediates:
+            debug_dir = os.path.join(scratch_folder, "debug_veg_{0}".format(surface_key[:8]))
+        with prof.stage("vegtopo_surface", [run_surface, run_mask]):
+            vegtopo_surface(in_dem, in_canopy, in_stream, in_strm_area, scratch, run_surface, run_mask, debug_dir)
+        elev_vegtopo = rio.move_flat(run_surface, os.path.join(scratch_folder, os.path.basename(run_surface)))
+        strm_mask = rio.move_flat(run_mask, os.path.join(scratch_folder, os.path.basename(run_mask)))
+        cache.store("elev_vegtopo", surface_key, elev_vegtopo)
+        cache.store("strm_mask", surface_key, strm_mask)
+
+    # restrict the solar calculation to the stream corridor, if a corridor buffer distance is supplied
+    corridor = None
+    if corridor_buffer is not None:
+        corridor_key = cache.key("corridor", [surface_key], [corridor_buffer])
+        corridor = cache.lookup("corridor", corridor_key)
+        if not corridor:
+            run_corridor = scratch.file("cor_{0}.bil".format(corridor_key[:8]))
+            with prof.stage("corridor_mask", [run_corridor]):
+                corridor_mask(strm_mask, corridor_buffer, cellSize, run_corridor)
+            corridor = rio.move_flat(run_corridor, os.path.join(scratch_folder, os.path.basename(run_corridor)))
+            cache.store("corridor", corridor_key, corridor)
+
+    # calculate mean solar radiation per bankfull buffer. The output raster is optionally written as a tiled,
+    # compressed GeoTIFF with overviews and statistics.
+    gp.message("Calculating solar radiation...")
+    if tiled_tiff and not rio.is_tiff(out_raster):
+        gp.warning("Tiled output is only written for GeoTIFF (.tif) output rasters.")
+    tiled_tiff = tiled_tiff and rio.is_tiff(out_raster)
+    # scaled integer rasters are calculated as floating point in the scratch workspace first. Only the final output
+    # raster is tiled, not the scratch raster.
+    calc_raster = out_raster if storage_type == "FLOAT32" else scratch.file("solar_float.tif")
+    with rio.tiled_output(tiled_tiff and calc_raster == out_raster), prof.stage("solar_radiation", [calc_raster]):
+        # the Spatial Analyst license is only held while the ESRI solar tools run. Tiled runs check it out in each
+        # worker process.
+        with gp.licensed("Spatial", solar_backend == "ARCGIS" and tile_size <= 0):
+            if tile_size > 0:
+                tiling.tiled_solar(elev_vegtopo, calc_raster, scratch_folder,
+                                   latitude, sky_size, time_config, day_intrvl, hour_intrvl, solar_backend, tile_size,
+                                   search_distance, processes, corridor, tile_latitude)
+            elif solar_backend == "NUMPY":
+                numpy_solar(elev_vegtopo, calc_raster, scratch.folder, latitude, sky_size, time_config, day_intrvl,
+                            hour_intrvl, corridor, search_distance)
+            elif corridor:
+                gp.points_solar_radiation(elev_vegtopo, corridor, calc_raster, scratch, latitude, sky_size,
+                                          time_config, day_intrvl, hour_intrvl)
+            else:
+                gp.area_solar_radiation(elev_vegtopo, calc_raster, latitude, sky_size, time_config, day_intrvl,
+                                        hour_intrvl)
+    if storage_type != "FLOAT32":
+        gp.message("Saving solar insolation as {0} with a scale of {1} and an offset of {2}...".format(
+            storage_type, storage_scale, storage_offset))
+        with rio.tiled_output(tiled_tiff), prof.stage("save_scaled", [out_raster]):
+            rio.save_scaled(calc_raster, out_raster, scratch.file("solar_scaled.bil"), storage_type,
+                            storage_scale, storage_offset)
+    else:
+        rio.remove_scaling(out_raster)
+    gp.message("Tool output saved to " + out_raster)
 
     # Riverscapes project processing
     if rs_bool == "true":
-        arcpy.AddMessage("Exporting as a Riverscapes project...")
-        real_id = rs.getRealID(time_stamp)
+        gp.message("Exporting as a Riverscapes project...")
+        real_id = real_id or rs.getRealID(time_stamp)
         # copy input/output data to Riverscapes project directories
         abs_dem_path = os.path.join(rs.getRSDirAbs(rs_dir, 0), in_dem_name)
         abs_canopy_path = os.path.join(rs.getRSDirAbs(rs_dir, 1, 0, real_id), in_canopy_name)
@@ -181,11 +359,12 @@ def main(in_dem,
         abs_strm_area_path = os.path.join(rs.getRSDirAbs(rs_dir, 1, 0, real_id), in_strm_area_name)
         abs_solar_path = os.path.join(rs.getRSDirAbs(rs_dir, 1, 1, real_id), out_raster_name)
         rs.writeRealDir(rs_dir, real_id)
-        rs.copyRSFiles(in_dem, abs_dem_path)
-        rs.copyRSFiles(in_canopy, abs_canopy_path)
-        rs.copyRSFiles(in_stream, abs_stream_path)
-        rs.copyRSFiles(in_strm_area, abs_strm_area_path)
-        rs.copyRSFiles(out_raster, abs_solar_path)
+        with prof.stage("riverscapes_copy"):
+            rs.copyRSFileList([(in_dem, abs_dem_path),
+                               (in_canopy, abs_canopy_path),
+                               (in_stream, abs_stream_path),
+                               (in_strm_area, abs_strm_area_path),
+                               (out_raster, abs_solar_path)], rs_dir)
         # write project XML file. Note the use of the 'relative path version' of get directories function
         rel_dem_path = os.path.join(rs.getRSDirRel(0), in_dem_name)
         rel_canopy_path = os.path.join(rs.getRSDirRel(1, 0, real_id), in_canopy_name)
@@ -202,18 +381,21 @@ def main(in_dem,
                  hour_intrvl,
                  rel_solar_path,
                  real_name,
-                 real_id)
+                 real_id,
+                 solar_backend,
+                 storage_type,
+                 storage_scale,
+                 storage_offset)
 
-    # clean up in_memory files
-    u.clear_inmem()
+    # clean up the scratch datasets and in_memory files of this run
+    scratch.cleanup()
 
-    # finalize and write generic metadata file
+    # finalize and write generic metadata file, with the stage timings
+    prof.finish(mWriter.currentRun)
     strToolStatus = "Success"
     mWriter.finalizeRun(strToolStatus)
     mWriter.writeMetadataFile(out_xml)
 
-    arcpy.CheckInExtension("Spatial")
-
     return
 
 # if __name__ == "__main__":
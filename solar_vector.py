@@ -5,26 +5,38 @@
 #               a Stream Network is a model of mean solar radiation hitting each stream segment by creating a coarse.
 #               approximation of shading based on topography and vegetation.
 # author:		Jesse Langdon
-# dependencies: ESRI arcpy module, Spatial Analyst extension, util.py
+# dependencies: backends, util.py, zonal.py, segments.py, stage_cache.py, profiling.py
 
 
-import arcpy, os
+import os
 import sys
 import time
-from arcpy.sa import *
+import json
+import numpy as np
+import backends
 import util as u
+import zonal
+import segments
+import raster_io as rio
+import profiling
+import stage_cache as sc
 import metadata.meta_sfr as meta_sfr
 import metadata.meta_rs as meta_rs
 import riverscapes as rs
 
 version = "0.5.9"
+# attribute field type of each area_solar storage type. Integer types store round((value - offset) / scale).
+FIELD_TYPES = {"FLOAT64": "DOUBLE",
+               "FLOAT32": "FLOAT",
+               "INT16": "SHORT",
+               "INT32": "LONG"}
+# storage type names of earlier versions. SHORT and LONG fields are signed.
+FIELD_ALIASES = {"UINT16": "INT16", "UINT32": "INT32"}
+FIELD_RANGE = {"SHORT": (-32768, 32767), "LONG": (-2147483648, 2147483647)}
 
-# set environmental variables
-arcpy.CheckOutExtension("Spatial")
-arcpy.env.overwriteOutput = True
 
-
-def metadata(solarXML, in_raster, in_stream, in_strm_area, out_fc, real_id):
+def metadata(solarXML, in_raster, in_stream, in_strm_area, out_fc, real_id, storage_type="FLOAT64", storage_scale=1.0,
+             storage_offset=0.0):
     """ Builds and writes an XML file according to the Riverscapes Project specifications
 
         Args:
@@ -39,6 +51,10 @@ def metadata(solarXML, in_raster, in_stream, in_strm_area, out_fc, real_id):
     solarXML.addRealizationInputRef(solarXML.project, "Raster", "Solar", real_id, "SOL_RAS")
     solarXML.addMeta("solar_vector Start Time", timeStart, solarXML.project, "Solar", real_id)
     solarXML.addMeta("solar_vector Stop Time", timeStop, solarXML.project, "Solar", real_id)
+    # stored area_solar = (WH/m2 - offset) / scale
+    solarXML.addParameter("area_solar storage type", storage_type, solarXML.project, "Solar", real_id)
+    solarXML.addParameter("area_solar storage scale", storage_scale, solarXML.project, "Solar", real_id)
+    solarXML.addParameter("area_solar storage offset", storage_offset, solarXML.project, "Solar", real_id)
 
     # add Analysis output tags
     solarXML.addOutput("Vector",
@@ -53,26 +69,48 @@ def metadata(solarXML, in_raster, in_stream, in_strm_area, out_fc, real_id):
     return
 
 
-def main(in_raster, in_stream, in_strm_indx, in_strm_area, out_fc, workspace_temp, rs_bool, rs_dir, rs_proj, rs_real_name):
+def load_state(state_path):
+    """Reads the saved segment state of a previous run, or returns None if there is none"""
+    if not state_path or not os.path.isfile(state_path):
+        return None
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def save_state(cache, scratch, state_key, state_path, index_path, raster_hash, seg_hashes, seg_values):
+    """Saves the zone index, segment geometry hashes and solar values of this run, for later incremental runs. The
+    state is written in the scratch folder of the run, and then moved to its shared path."""
+    with open(scratch.file("segs.json"), "w") as f:
+        json.dump({"index": index_path, "raster": raster_hash, "segments": seg_hashes, "values": seg_values}, f)
+    scratch.publish("segs.json", state_path)
+    cache.store("segment_state", state_key, state_path)
+    return
+
+
+def main(in_raster, in_stream, in_strm_indx, in_strm_area, out_fc, workspace_temp, rs_bool, rs_dir, rs_proj, rs_real_name,
+         processes=1,
+         incremental=False,
+         storage_type="FLOAT64",
+         storage_scale=1.0,
+         storage_offset=0.0):
     # set environmental variables
-    arcpy.env.outputCoordinateSystem = in_raster
-    arcpy.env.snapRaster = in_raster
-    arcpy.env.mask = in_raster
-    desc = arcpy.Describe(in_raster)
-    cellSize = desc.meanCellHeight
-    arcpy.env.cellSize = cellSize
-    arcpy.env.workspace = workspace_temp
-    arcpy.env.scratchWorkspace = workspace_temp
-
-    in_ras = arcpy.sa.Raster(in_raster)
-    in_ras_extent = in_ras.extent
-    arcpy.env.extent = in_ras_extent
+    gp = backends.get()
+    gp.set_environment(in_raster, workspace_temp)
 
     in_raster_name = os.path.basename(in_raster)
     in_stream_name = os.path.basename(in_stream)
     in_strm_area_name = os.path.basename(in_strm_area)
     out_dir = os.path.dirname(out_fc)
     out_fc_name = os.path.basename(out_fc)
+    processes = int(processes) if processes not in ('', None, '#') else 1
+    incremental = incremental in (True, "true")
+    if storage_type in FIELD_ALIASES:
+        gp.warning("Storage type {0} is stored in a signed field, and is now named {1}.".format(
+            storage_type, FIELD_ALIASES[storage_type]))
+        storage_type = FIELD_ALIASES[storage_type]
+    storage_type = storage_type if storage_type in FIELD_TYPES else "FLOAT64"
+    storage_scale = float(storage_scale) if storage_scale not in ('', None, '#') else 1.0
+    storage_offset = float(storage_offset) if storage_offset not in ('', None, '#') else 0.0
 
     # start writing metadata
     time_stamp = time.strftime("%Y%m%d%H%M")
@@ -83,6 +121,11 @@ def main(in_raster, in_stream, in_strm_indx, in_strm_area, out_fc, workspace_tem
     mWriter.currentRun.addParameter("Stream network feature class", in_stream)
     mWriter.currentRun.addParameter("Stream unique ID field", in_strm_indx)
     mWriter.currentRun.addParameter("Stream area polygon feature class", in_strm_area)
+    mWriter.currentRun.addParameter("Worker processes", processes)
+    mWriter.currentRun.addParameter("Incremental update", incremental)
+    mWriter.currentRun.addParameter("Storage type", storage_type)
+    mWriter.currentRun.addParameter("Storage scale", storage_scale)
+    mWriter.currentRun.addParameter("Storage offset", storage_offset)
     mWriter.currentRun.addOutput("Output polyline feature class with solar values", out_fc)
     mWriter.currentRun.addOutput("Metadata XML file", out_xml)
 
@@ -90,73 +133,145 @@ def main(in_raster, in_stream, in_strm_indx, in_strm_area, out_fc, workspace_tem
 
         # initiate Riverscapes project XML object and start processing timestamp
         if rs_bool == "true":
-            rs_xml = "{0}\\{1}".format(rs_dir, "project.rs.xml")
+            rs_xml = os.path.join(rs_dir, "project.rs.xml")
             projectXML = meta_rs.ProjectXML("existing", rs_xml)
 
-        # convert stream and stream area polygon to two-class raster dataset
-        arcpy.AddMessage("Processing stream segments...")
-        tmp_stream_line = arcpy.FeatureClassToFeatureClass_conversion(in_stream, workspace_temp, "tmp_stream_line")
-        tmp_stream_poly = arcpy.FeatureClassToFeatureClass_conversion(in_strm_area, workspace_temp, "tmp_strm_poly")
-        arcpy.MakeFeatureLayer_management(tmp_stream_line, "in_strm_line_lyr")
-        arcpy.MakeFeatureLayer_management(tmp_stream_poly, "in_strm_poly_lyr")
-        poly_strm_area, strm_ras, poly_ras = u.raster_poly(in_raster, "in_strm_line_lyr", "in_strm_poly_lyr", workspace_temp)
-        arcpy.CalculateStatistics_management(strm_ras)
-        arcpy.CalculateStatistics_management(poly_ras)
-        strm_ras_lyr = "strm_ras_lyr"
-        poly_ras_lyr = "poly_ras_lyr"
-        arcpy.MakeRasterLayer_management(strm_ras, strm_ras_lyr)
-        arcpy.MakeRasterLayer_management(poly_ras, poly_ras_lyr)
-
-        # buffer stream segments
-        seg_poly = u.divide_polygon(in_stream, poly_strm_area, workspace_temp)
-        arcpy.env.extent = in_ras_extent # reset because the divide_polygon function sets it to the stream area polygon extent
-
-        # get OID field name of segmented stream network
-        in_stream_oid = arcpy.Describe(tmp_stream_line).OIDFieldName
-
-        # calculate solar values per stream segment
-        arcpy.AddMessage("Summarizing solar values per stream segment...")
-        zstat_result = workspace_temp + "\\zstat_result"
-        ZonalStatisticsAsTable(seg_poly, "JOIN_FID", in_raster, zstat_result, "DATA", "MAXIMUM")
-        arcpy.AddField_management("in_strm_line_lyr", "area_solar", "DOUBLE")
-        arcpy.JoinField_management("in_strm_line_lyr", in_stream_oid, zstat_result, "JOIN_FID", ["MAX"])
-        arcpy.CalculateField_management("in_strm_line_lyr","area_solar","!MAX!", "PYTHON_9.3")
-        arcpy.DeleteField_management("in_strm_line_lyr", ["MAX"])
-        arcpy.CopyFeatures_management("in_strm_line_lyr", out_fc)
-        arcpy.AddMessage("Tool output saved to " + out_fc)
-
-        # finalize and write metadata file
-        strToolStatus = "Success"
-        mWriter.finalizeRun(strToolStatus)
-        mWriter.writeMetadataFile(out_xml)
+        # time each processing stage for the run metadata
+        prof = profiling.Profiler("solar_vector")
+
+        gp.message("Processing stream segments...")
+        scratch = u.RunScratch(workspace_temp)
+        tmp_stream_line = scratch.path("tmp_stream_line")
+        with prof.stage("copy_stream"):
+            gp.copy_features(in_stream, tmp_stream_line)
+        strm_line_lyr = gp.make_layer(tmp_stream_line, scratch.name("in_strm_line_lyr"))
+
+        # reuse the segment zone index if the stream network, stream area and raster grid are unchanged
+        scratch_folder = u.get_scratch_folder(workspace_temp)
+        cache = sc.StageCache(scratch_folder)
+        grid = rio.grid_from_raster(in_raster)
+        grid_params = [grid.xmin, grid.ymax, grid.cell_size, grid.nrows, grid.ncols]
+        index_key = cache.key("zone_index", [in_stream, in_strm_area], grid_params)
+        index_path = cache.lookup("zone_index", index_key)
+        with prof.stage("segment_hashes"):
+            new_hashes = segments.segment_hashes(strm_line_lyr)
+        # the previous run with this stream network, used for incremental runs. The state is keyed by the same inputs
+        # as the zone index, except that the stream network is identified by its path rather than its contents, so
+        # that a run finds the state of the previous run after segments of the network are edited.
+        state_key = cache.key("segment_state", [in_strm_area], [str(in_stream)] + grid_params)
+        state = load_state(cache.lookup("segment_state", state_key))
+        affected = None
+        if index_path:
+            gp.message("Reusing cached stream segment zone index " + index_path)
+            zone_index = zonal.ZoneIndex.load(index_path)
+            if state and state["segments"] == new_hashes:
+                affected = set()
+        else:
+            # convert stream and stream area polygon to two-class raster dataset
+            strm_ras, poly_ras = u.raster_poly(in_raster, strm_line_lyr, in_strm_area, scratch)
+
+            # divide the stream area cells by stream segment, only around the changed segments if incremental
+            if incremental and state and os.path.isfile(state["index"]):
+                gp.message("Dividing stream area around changed segments...")
+                with prof.stage("update_zones"):
+                    zone_index, affected = segments.update_zones(zonal.ZoneIndex.load(state["index"]),
+                                                                 state["segments"], new_hashes, strm_line_lyr,
+                                                                 [strm_ras, poly_ras])
+            else:
+                seg_zones = scratch.file("seg_zones.bil")
+                with prof.stage("segment_zones", [seg_zones]):
+                    segments.segment_zones(strm_line_lyr, [strm_ras, poly_ras], grid, seg_zones,
+                                           processes=processes)
+                    zone_index = zonal.ZoneIndex.from_raster(seg_zones, grid)
+            zone_index.save(scratch.file("zones.npz"))
+            index_path = scratch.publish("zones.npz", os.path.join(scratch_folder,
+                                                                   "zones_{0}.npz".format(index_key[:8])))
+            cache.store("zone_index", index_key, index_path)
+
+        # calculate solar values per stream segment. Incremental runs against the same raster only summarize the
+        # segments whose cells changed, and reuse the previous values of all other segments.
+        gp.message("Summarizing solar values per stream segment...")
+        raster_hash = cache.fingerprint(in_raster)
+        seg_values = {}
+        if incremental and affected is not None and state["raster"] == raster_hash:
+            gp.message("Updating solar values for {0} stream segments...".format(len(affected)))
+            seg_values = dict([(key, value) for key, value in state["values"].items()
+                               if key in new_hashes and new_hashes[key][0] not in affected])
+            summary_index = zone_index.subset(affected)
+        else:
+            summary_index = zone_index
+        # rasters saved as scaled integers are converted back to WH/m2
+        raster_scale, raster_offset = rio.read_scaling(in_raster)
+        with prof.stage("zonal_stats"):
+            zstat_max = summary_index.zonal_stats(in_raster)["MAX"] * raster_scale + raster_offset
+        for key, (oid, digest) in new_hashes.items():
+            if key not in seg_values:
+                seg_values[key] = None
+                if oid < len(zstat_max) and not np.isnan(zstat_max[oid]):
+                    seg_values[key] = float(zstat_max[oid])
+        solar_max = np.empty(max([v[0] for v in new_hashes.values()] + [0]) + 1)
+        solar_max.fill(np.nan)
+        for key, value in seg_values.items():
+            if value is not None:
+                solar_max[new_hashes[key][0]] = value
+        field_type = FIELD_TYPES[storage_type]
+        if field_type in FIELD_RANGE:
+            solar_max = np.round((solar_max - storage_offset) / storage_scale)
+            valid = solar_max[~np.isnan(solar_max)]
+            if field_type == "SHORT" and valid.size and (valid.min() < FIELD_RANGE["SHORT"][0] or
+                                                         valid.max() > FIELD_RANGE["SHORT"][1]):
+                gp.warning("Scaled solar values are outside of the range of a SHORT field, and are stored in a LONG "
+                           "field.")
+                field_type = "LONG"
+            low, high = FIELD_RANGE[field_type]
+            out_of_range = int(((valid < low) | (valid > high)).sum())
+            if out_of_range:
+                gp.warning("{0} scaled solar values are outside of the range of a {1} field, and were clamped to "
+                           "it. Use a larger storage scale.".format(out_of_range, field_type))
+                solar_max = np.clip(solar_max, low, high)
+        with prof.stage("write_field"):
+            gp.add_field(strm_line_lyr, "area_solar", field_type)
+            zonal.write_field(strm_line_lyr, "OID@", solar_max, "area_solar",
+                              int if field_type in FIELD_RANGE else float)
+        save_state(cache, scratch, state_key, os.path.join(scratch_folder, "segs_{0}.json".format(state_key[:8])),
+                   index_path, raster_hash, new_hashes, seg_values)
+        with prof.stage("copy_output", [out_fc]):
+            gp.copy_features(strm_line_lyr, out_fc)
+        gp.message("Tool output saved to " + out_fc)
 
         # export data files to Riverscapes project.
         if rs_bool == "true":
-            arcpy.AddMessage("Exporting to Riverscapes project...")
+            gp.message("Exporting to Riverscapes project...")
             real_id = projectXML.realIDdict[rs_real_name]
             # copy input/output data to Riverscapes project directories
             abs_ras_path = os.path.join(rs.getRSDirAbs(rs_dir, 1, 0, real_id), in_raster_name)
             abs_strm_path = os.path.join(rs.getRSDirAbs(rs_dir, 1, 0, real_id), in_stream_name)
             abs_strm_area_path = os.path.join(rs.getRSDirAbs(rs_dir, 1, 0, real_id), in_strm_area_name)
             abs_out_path = os.path.join(rs.getRSDirAbs(rs_dir, 1, 2, real_id), out_fc_name)
-            rs.copyRSFiles(in_raster, abs_ras_path)
-            rs.copyRSFiles(in_stream, abs_strm_path)
-            rs.copyRSFiles(in_strm_area, abs_strm_area_path)
-            rs.copyRSFiles(out_fc, abs_out_path)
+            with prof.stage("riverscapes_copy"):
+                rs.copyRSFileList([(in_raster, abs_ras_path),
+                                   (in_stream, abs_strm_path),
+                                   (in_strm_area, abs_strm_area_path),
+                                   (out_fc, abs_out_path)], rs_dir)
             # write project XML file. Note the use of the 'relative path version' of get directories function
             rel_ras_path = os.path.join(rs.getRSDirRel(1, 0, real_id), in_raster_name)
             rel_strm_path = os.path.join(rs.getRSDirRel(1, 0, real_id), in_stream_name)
             rel_strm_area_path = os.path.join(rs.getRSDirRel(1, 0, real_id), in_strm_area_name)
             rel_out_path = os.path.join(rs.getRSDirRel(1, 2, real_id), out_fc_name)
-            metadata(projectXML, rel_ras_path, rel_strm_path, rel_strm_area_path, rel_out_path, real_id)
+            metadata(projectXML, rel_ras_path, rel_strm_path, rel_strm_area_path, rel_out_path, real_id, storage_type,
+                     storage_scale, storage_offset)
 
-        # clean up in_memory files
-        u.clear_inmem()
+        # clean up the scratch datasets and in_memory files of this run
+        scratch.cleanup()
+
+        # finalize and write metadata file, with the stage timings
+        prof.finish(mWriter.currentRun)
+        strToolStatus = "Success"
+        mWriter.finalizeRun(strToolStatus)
+        mWriter.writeMetadataFile(out_xml)
 
     else:
-        arcpy.AddError("The LineOID attribute field is missing from " + in_stream + ". Cancelling process!")
+        gp.error("The LineOID attribute field is missing from " + in_stream + ". Cancelling process!")
         sys.exit(0)
 
-    arcpy.CheckInExtension("Spatial")
-
     return
\ No newline at end of file
@@ -0,0 +1,207 @@
+# file name:	stage_cache.py
+# description:	Content-addressed cache of intermediate datasets written to the scratch workspace. Each processing
+#               stage is keyed by a hash of the contents of its input datasets and its parameters, so that a stage is
+#               only recomputed when one of its inputs changes. The cache manifest is stored as a JSON file in the
+#               scratch folder, and is shared by every run that uses the same scratch workspace. Datasets stored in a
+#               file geodatabase are hashed by their own rows or cells, read through the geoprocessing backend, rather
+#               than by the files of the geodatabase, which are shared with its other datasets and lock files.
+# author:		South Fork Research, Inc.
+# dependencies: backends, numpy, raster_io.py
+
+import os
+import json
+import hashlib
+import numpy as np
+import backends
+import raster_io as rio
+
+MANIFEST_NAME = "solar_stage_cache.json"
+CHUNK_SIZE = 1024 * 1024
+# sidecar file extensions that are part of a dataset, by the extension of the dataset file (i.e. the other files of a
+# shapefile, and the world and header files of a raster), so a raster and a shapefile with the same name are separate
+SIDECAR_EXTS = {".shp": [".shx", ".dbf", ".prj", ".cpg", ".sbn", ".sbx"],
+                ".tif": [".tfw", ".tifw"],
+                ".tiff": [".tfw", ".tiffw"],
+                ".img": [".ige", ".rrd"],
+                ".bil": [".hdr", ".prj", ".blw", ".stx", ".clr"],
+                ".bip": [".hdr", ".prj", ".bpw", ".stx", ".clr"],
+                ".bsq": [".hdr", ".prj", ".bqw", ".stx", ".clr"]}
+# file extensions of the schema and edit locks that ArcGIS writes to geodatabase and grid folders while they are open
+LOCK_EXTS = (".lock", ".lck")
+
+
+def file_hash(file_path):
+    """SHA1 hash of the contents of a file"""
+    sha = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        chunk = f.read(CHUNK_SIZE)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(CHUNK_SIZE)
+    return sha.hexdigest()
+
+
+def dataset_files(dataset):
+    """Lists the files on disk that store a dataset. Datasets stored in a geodatabase or ESRI grid are represented by
+    every file in the geodatabase or grid folder."""
+    path = backends.get().catalog_path(dataset)
+    if os.path.isfile(path):
+        stem, ext = os.path.splitext(path)
+        sidecars = SIDECAR_EXTS.get(ext.lower(), [])
+        folder = os.path.dirname(path) or "."
+        files = [os.path.join(folder, f) for f in os.listdir(folder)
+                 if os.path.splitext(os.path.join(folder, f))[0] == stem and
+                 os.path.splitext(f)[1].lower() in sidecars]
+        return sorted(set(files + [path]))
+    if ".gdb" in path.lower():
+        path = path[:path.lower().index(".gdb") + 4]
+    if os.path.isdir(path):
+        return sorted([os.path.join(path, f) for f in os.listdir(path)
+                       if os.path.isfile(os.path.join(path, f)) and not f.lower().endswith(LOCK_EXTS)])
+    return []
+
+
+def geodatabase_path(dataset):
+    """Path of the file geodatabase that stores a dataset, or None if the dataset is not in a geodatabase"""
+    path = backends.get().catalog_path(dataset)
+    lower = path.lower()
+    if ".gdb" not in lower or lower.endswith(".gdb"):
+        return None
+    return path[:lower.index(".gdb") + 4]
+
+
+def geodatabase_stamp(gdb_path):
+    """Count, total size and latest modification time of the files of a geodatabase, without its lock files. Files
+    deleted while the folder is listed are skipped."""
+    count, size, mtime = 0, 0, 0.0
+    for file_path in dataset_files(gdb_path):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        count += 1
+        size += stat.st_size
+        mtime = max(mtime, stat.st_mtime)
+    return [count, size, mtime]
+
+
+def content_hash(dataset):
+    """SHA1 hash of the contents of a raster (its grid and cell values) or feature class (its field names and rows,
+    with the geometry as well-known binary), read through the geoprocessing backend"""
+    gp = backends.get()
+    sha = hashlib.sha1()
+    if gp.is_raster(dataset):
+        grid = gp.raster_grid(dataset)
+        sha.update(repr((grid.xmin, grid.ymax, grid.cell_size, grid.nrows, grid.ncols)).encode("utf-8"))
+        sha.update(str(grid.spatial_ref).encode("utf-8"))
+        for window in rio.iter_windows(grid):
+            sha.update(np.ascontiguousarray(gp.read_raster(dataset, grid, window)).tobytes())
+        return sha.hexdigest()
+    fields = [field for field in gp.field_names(dataset) if field.lower() not in ("shape", "oid", "objectid")]
+    sha.update(repr(fields).encode("utf-8"))
+    for row in gp.read_features(dataset, ["WKB@"] + fields):
+        sha.update(row[0] or b"")
+        sha.update(repr(row[1:]).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class StageCache(object):
+    """Tracks intermediate datasets by the content hash of their inputs and parameters.
+
+    Args:
+        cache_dir: Folder storing the cache manifest (i.e. the scratch folder)
+    """
+
+    def __init__(self, cache_dir):
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        self.manifest = {"fingerprints": {}, "stages": {}}
+        if os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r") as f:
+                    self.manifest = json.load(f)
+            except ValueError:
+                backends.warning("Stage cache manifest is unreadable, and will be rebuilt.")
+
+    def fingerprint(self, dataset):
+        """Hashes the contents of a dataset. File hashes are remembered by size and modification time, so unchanged
+        files are only read once. Geodatabase datasets are hashed by content_hash(), which is remembered until a file
+        of the geodatabase changes. The hash doesn't depend on the path of the dataset, except for datasets without
+        files (i.e. in_memory datasets and the cache keys of upstream stages), which are hashed by name."""
+        sha = hashlib.sha1()
+        gdb_path = geodatabase_path(dataset)
+        if gdb_path is not None:
+            path = backends.get().catalog_path(dataset)
+            stamp = geodatabase_stamp(gdb_path)
+            known = self.manifest["fingerprints"].get(path)
+            if known and known[:3] == stamp:
+                digest = known[3]
+            else:
+                digest = content_hash(dataset)
+                self.manifest["fingerprints"][path] = stamp + [digest]
+            sha.update(digest.encode("utf-8"))
+            return sha.hexdigest()
+        files = dataset_files(dataset)
+        if not files:
+            sha.update(str(dataset).encode("utf-8"))
+        # files are identified by their name relative to the dataset (i.e. .tif and .tfw), not by their path
+        stem = os.path.splitext(backends.get().catalog_path(dataset))[0]
+        for file_path in files:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            known = self.manifest["fingerprints"].get(file_path)
+            if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+                digest = known[2]
+            else:
+                digest = file_hash(file_path)
+                self.manifest["fingerprints"][file_path] = [stat.st_size, stat.st_mtime, digest]
+            part = file_path[len(stem):] if file_path.startswith(stem) else os.path.basename(file_path)
+            sha.update(part.encode("utf-8"))
+            sha.update(digest.encode("utf-8"))
+        return sha.hexdigest()
+
+    def key(self, stage, datasets=(), params=()):
+        """Builds the cache key for a stage from its input datasets and parameters. Input datasets can include the
+        cache keys of upstream stages."""
+        sha = hashlib.sha1(stage.encode("utf-8"))
+        for dataset in datasets:
+            sha.update(self.fingerprint(dataset).encode("utf-8"))
+        for param in params:
+            sha.update(str(param).encode("utf-8"))
+        return sha.hexdigest()
+
+    def lookup(self, stage, key):
+        """Returns the cached dataset for a stage key, or None if it has not been computed or no longer exists"""
+        dataset = self.manifest["stages"].get(stage, {}).get(key)
+        if dataset and backends.get().exists(dataset):
+            return dataset
+        return None
+
+    def store(self, stage, key, dataset):
+        """Records the dataset computed for a stage key, and saves the manifest"""
+        self.manifest["stages"].setdefault(stage, {})[key] = dataset
+        self.save()
+
+    def save(self):
+        """Saves the manifest, merged with any entries saved by other runs sharing the scratch folder since this
+        manifest was read. The manifest is written to a file unique to this process and then renamed, so it is never
+        left partially written."""
+        if os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r") as f:
+                    saved = json.load(f)
+                for file_path, known in saved.get("fingerprints", {}).items():
+                    self.manifest["fingerprints"].setdefault(file_path, known)
+                for stage, entries in saved.get("stages", {}).items():
+                    merged = dict(entries)
+                    merged.update(self.manifest["stages"].get(stage, {}))
+                    self.manifest["stages"][stage] = merged
+            except ValueError:
+                pass
+        tmp_path = "{0}.{1}".format(self.manifest_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        if os.path.isfile(self.manifest_path):
+            os.remove(self.manifest_path)
+        os.rename(tmp_path, self.manifest_path)
@@ -0,0 +1,106 @@
+# file name:	surface.py
+# description:	Builds the vegetation and topography surface used for solar modeling in a single block-windowed pass.
+#               The DEM, canopy height, stream line and stream area rasters are each read once per block, the stream
+#               mask and the canopy-free stream cells are calculated in memory, and only the final surface (and the
+#               stream mask, if requested) are written to disk. The stream mask can then be expanded into the stream
+#               corridor mask, which restricts the solar calculation to cells near the stream.
+# author:		South Fork Research, Inc.
+# dependencies: numpy, raster_io.py
+
+import os
+import numpy as np
+import raster_io as rio
+
+
+def vegtopo_block(dem, canopy, strm_line, strm_poly):
+    """Calculates one block of the vegetation and topography surface.
+
+    Args:
+        dem: Bare earth elevation values, with NaN for NoData
+        canopy: Vegetation height values, with NaN for NoData
+        strm_line: Rasterized stream network, with a value of 1 for stream cells
+        strm_poly: Rasterized stream area polygons, with a value of 1 for stream cells
+
+    Returns:
+        A tuple of the surface (DEM plus vegetation height, with vegetation removed from stream cells) and the
+        stream mask (1 for stream cells, 0 for all other cells).
+    """
+    strm_mask = (strm_line == 1) | (strm_poly == 1)
+    veg = np.where(strm_mask, np.float32(0), canopy)
+    return dem + veg, strm_mask.astype(np.uint8)
+
+
+def fuse_surface(in_dem, in_canopy, strm_ras, poly_ras, out_surface, out_mask=None, debug_dir=None,
+                 block_rows=rio.BLOCK_ROWS):
+    """Builds the vegetation and topography surface raster in a single pass over the inputs.
+
+    Args:
+        in_dem: Bare earth DEM raster dataset, which defines the output grid
+        in_canopy: Vegetation height raster dataset
+        strm_ras: Rasterized stream network raster dataset
+        poly_ras: Rasterized stream area polygon raster dataset
+        out_surface: Output surface BIL file
+        out_mask: Optional output stream mask BIL file
+        debug_dir: Optional folder to keep the intermediate stream mask and canopy-free rasters, for debugging
+    """
+    grid = rio.grid_from_raster(in_dem)
+    surface = rio.create_flat(out_surface, grid, "float32", rio.FLOAT_NODATA)
+    mask = rio.create_flat(out_mask, grid, "uint8", 255) if out_mask else None
+    if debug_dir:
+        debug_mask = rio.create_flat(os.path.join(debug_dir, "strm_mask.bil"), grid, "uint8", 255)
+        debug_veg = rio.create_flat(os.path.join(debug_dir, "remove_strm.bil"), grid, "float32", rio.FLOAT_NODATA)
+    for window in rio.iter_windows(grid, block_rows):
+        r0, r1 = window[0], window[1]
+        dem = rio.read_window(in_dem, grid, window)
+        canopy = rio.read_window(in_canopy, grid, window)
+        elev, strm_mask = vegtopo_block(dem, canopy, rio.read_window(strm_ras, grid, window),
+                                        rio.read_window(poly_ras, grid, window))
+        surface[r0:r1] = np.where(np.isnan(elev), np.float32(rio.FLOAT_NODATA), elev)
+        if mask is not None:
+            mask[r0:r1] = np.where(np.isnan(dem), np.uint8(255), strm_mask)
+        if debug_dir:
+            debug_mask[r0:r1] = strm_mask
+            veg = np.where(strm_mask == 1, np.float32(0), canopy)
+            debug_veg[r0:r1] = np.where(np.isnan(veg), np.float32(rio.FLOAT_NODATA), veg)
+    surface.flush()
+    if mask is not None:
+        mask.flush()
+    if debug_dir:
+        debug_mask.flush()
+        debug_veg.flush()
+    return
+
+
+def expand_mask(in_mask, out_mask, buffer_cells, block_rows=rio.BLOCK_ROWS):
+    """Expands a stream mask by a number of cells in every direction, the same as the Expand tool with a square
+    neighborhood. The expansion is separable, so each block is expanded along its columns and then along its rows.
+
+    Args:
+        in_mask: Stream mask raster dataset, with a value of 1 for stream cells
+        out_mask: Output stream corridor mask BIL file, with a value of 1 within the corridor and NoData elsewhere
+        buffer_cells: Number of cells to expand the stream cells by
+
+    Returns:
+        The number of corridor cells.
+    """
+    grid = rio.grid_from_raster(in_mask)
+    out = rio.create_flat(out_mask, grid, "uint8", 255)
+    count = 0
+    for window in rio.iter_windows(grid, block_rows):
+        # read the block with a halo of buffer_cells rows, so that stream cells in the next block are expanded too
+        r0, r1 = max(window[0] - buffer_cells, 0), min(window[1] + buffer_cells, grid.nrows)
+        block = rio.read_window(in_mask, grid, (r0, r1, 0, grid.ncols)) == 1
+        wide = block.copy()
+        for shift in range(1, buffer_cells + 1):
+            wide[:, shift:] |= block[:, :-shift]
+            wide[:, :-shift] |= block[:, shift:]
+        tall = wide.copy()
+        for shift in range(1, buffer_cells + 1):
+            tall[shift:] |= wide[:-shift]
+            tall[:-shift] |= wide[shift:]
+        corridor = tall[window[0] - r0:window[1] - r0]
+        out[window[0]:window[1]] = np.where(corridor, np.uint8(1), np.uint8(255))
+        count += int(np.count_nonzero(corridor))
+    out.flush()
+    del out
+    return count
@@ -0,0 +1,23 @@
+# file name:	conftest.py
+# description:	pytest configuration of the Solar Stream unit tests. The repository root is put on the Python path, and
+#               tests that read features run with the ARCPY geoprocessing backend, using the arcpy stand-in of the
+#               benchmarks when arcpy can't be imported, so the tests run on a machine without ArcGIS.
+# author:		South Fork Research, Inc.
+# dependencies: pytest, numpy
+
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+BENCH_DIR = os.path.join(ROOT_DIR, "benchmarks")
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+try:
+    import arcpy
+except ImportError:
+    sys.path.insert(0, os.path.join(BENCH_DIR, "standin"))
+    import arcpy
+import backends
+
+backends.use("ARCPY")
@@ -0,0 +1,79 @@
+import numpy as np
+import insolation as ins
+import validate_solar as vs
+
+TIME_CONFIG = "MultiDays 2016 182 243"
+LATITUDE = 45.0
+
+
+def solar(elev, cell_size=10.0, **kwargs):
+    return ins.area_solar_radiation(elev, cell_size, LATITUDE, TIME_CONFIG, 7, 2, **kwargs)
+
+
+def test_flat_plane_matches_reference():
+    elev = np.full((9, 9), 1000.0, dtype=np.float32)
+    result = solar(elev)
+    direct, diffuse = vs.reference(LATITUDE, 0.0, 0.0, 1000.0, TIME_CONFIG)
+    assert np.allclose(result, result[4, 4])
+    assert abs(result[4, 4] - (direct + diffuse)) / (direct + diffuse) < 0.01
+
+
+def test_south_slope_receives_more_than_north_slope():
+    south = solar(vs.plane(20.0, 180.0))[4, 4]
+    north = solar(vs.plane(20.0, 0.0))[4, 4]
+    flat = solar(vs.plane(0.0, 0.0))[4, 4]
+    assert south > flat > north
+
+
+def test_masked_cells():
+    elev = vs.plane(10.0, 135.0, size=15)
+    mask = np.zeros(elev.shape, dtype=bool)
+    mask[3:6, 4:11] = True
+    full = solar(elev)
+    masked = solar(elev, mask=mask)
+    assert np.all(np.isnan(masked[~mask]))
+    assert np.allclose(masked[mask], full[mask], rtol=1e-5)
+
+
+def test_nodata_cells():
+    elev = np.full((9, 9), 100.0, dtype=np.float32)
+    elev[2, 3] = np.nan
+    result = solar(elev)
+    assert np.isnan(result[2, 3])
+    assert np.count_nonzero(np.isnan(result)) == 1
+
+
+def test_step_shades_cells_to_the_north():
+    # flat valley floor with a 200m high step along its southern edge
+    elev = np.zeros((40, 20), dtype=np.float32)
+    elev[30:] = 200.0
+    result = solar(elev)
+    flat = solar(np.zeros((40, 20), dtype=np.float32))[10, 10]
+    below_step = result[29, 10]
+    far_from_step = result[2, 10]
+    assert below_step < 0.6 * flat
+    assert below_step < far_from_step <= flat * 1.0001
+
+
+def test_search_distance_limits_shading():
+    elev = np.zeros((40, 20), dtype=np.float32)
+    elev[30:] = 200.0
+    unlimited = solar(elev)[10, 10]
+    limited = solar(elev, search_distance=50.0)[10, 10]
+    flat = solar(np.zeros((40, 20), dtype=np.float32))[10, 10]
+    assert unlimited < limited
+    assert np.isclose(limited, flat, rtol=1e-5)
+
+
+def test_sun_positions_are_above_the_horizon():
+    zenith, azimuth, duration = ins.sun_positions(LATITUDE, TIME_CONFIG, 7, 2)
+    assert zenith.size > 0
+    assert np.all(zenith < np.pi / 2.0)
+    assert np.all((azimuth >= 0) & (azimuth < 2.0 * np.pi))
+    # 62 days of sun, with no more than 24 hours per day
+    assert 0 < duration.sum() <= 62 * 24
+
+
+def test_uniform_sky_weights_sum_to_one():
+    weight = ins.sky_sectors()[4]
+    assert np.isclose(weight.sum(), 1.0)
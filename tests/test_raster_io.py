@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import raster_io as rio
+import synthetic
+
+
+def write_values(bil_path, values, cell_size=10.0):
+    grid = synthetic.make_grid(values.shape[0], cell_size)
+    flat = rio.create_flat(bil_path, grid)
+    rio.write_block(flat, (0, grid.nrows, 0, grid.ncols), values)
+    flat.flush()
+    del flat
+    return grid
+
+
+def test_flat_round_trip(tmp_path):
+    values = np.arange(36, dtype=np.float32).reshape(6, 6)
+    values[2, 3] = np.nan
+    bil = str(tmp_path / "values.bil")
+    grid = write_values(bil, values)
+    assert rio.is_flat(bil)
+    assert rio.grid_from_raster(bil).same_as(grid)
+    result = rio.read_window(bil, grid, (1, 4, 2, 6))
+    assert np.array_equal(np.isnan(result), np.isnan(values[1:4, 2:6]))
+    assert np.allclose(result[~np.isnan(result)], values[1:4, 2:6][~np.isnan(values[1:4, 2:6])])
+
+
+def test_scaled_round_trip(tmp_path):
+    values = np.random.RandomState(0).uniform(100.0, 30000.0, (20, 20)).astype(np.float32)
+    values[3, 4] = np.nan
+    in_bil = str(tmp_path / "solar.bil")
+    out_bil = str(tmp_path / "scaled.bil")
+    grid = write_values(in_bil, values)
+    clamped = rio.save_scaled(in_bil, out_bil, str(tmp_path / "tmp.bil"), "UINT16", 0.5, 100.0)
+    assert clamped == 0
+    scale, offset = rio.read_scaling(out_bil)
+    assert (scale, offset) == (0.5, 100.0)
+    result = rio.read_window(out_bil, grid, (0, grid.nrows, 0, grid.ncols)) * scale + offset
+    assert np.isnan(result[3, 4])
+    valid = ~np.isnan(values)
+    assert np.abs(result[valid] - values[valid]).max() <= scale / 2.0 + 1e-3
+
+
+def test_scaled_values_out_of_range_are_clamped(tmp_path):
+    values = np.array([[50.0, 1000.0], [60000.0, 70000.0]], dtype=np.float32)
+    in_bil = str(tmp_path / "solar.bil")
+    out_bil = str(tmp_path / "scaled.bil")
+    grid = write_values(in_bil, values)
+    low, high = rio.scaled_range("UINT16", 1.0, 100.0)
+    assert (low, high) == (100.0, 65634.0)
+    clamped = rio.save_scaled(in_bil, out_bil, str(tmp_path / "tmp.bil"), "UINT16", 1.0, 100.0)
+    assert clamped == 2
+    result = rio.read_window(out_bil, grid, (0, 2, 0, 2)) + 100.0
+    assert np.allclose(result, [[low, 1000.0], [60000.0, high]])
+
+
+def test_remove_scaling(tmp_path):
+    bil = str(tmp_path / "solar.bil")
+    write_values(bil, np.ones((2, 2), dtype=np.float32))
+    rio.write_scaling(bil, "UINT32", 2.0, 0.0)
+    assert os.path.isfile(bil + rio.SCALING_SUFFIX)
+    rio.remove_scaling(bil)
+    assert rio.read_scaling(bil) == (1.0, 0.0)
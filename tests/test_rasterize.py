@@ -0,0 +1,89 @@
+import numpy as np
+import raster_io as rio
+import rasterize as rz
+import synthetic
+
+SIZE = 30
+CELL_SIZE = 10.0
+
+
+def cell_centers(grid):
+    rows, cols = np.mgrid[0:grid.nrows, 0:grid.ncols]
+    return grid.xmin + (cols + 0.5) * grid.cell_size, grid.ymax - (rows + 0.5) * grid.cell_size
+
+
+def inside(x, y, ring):
+    """Even-odd point in polygon test of every cell center against a ring"""
+    result = np.zeros(x.shape, dtype=bool)
+    for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+        if y0 == y1:
+            continue
+        crosses = (y0 > y) != (y1 > y)
+        xc = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        result ^= crosses & (x < xc)
+    return result
+
+
+def spans_to_array(spans, grid):
+    out = np.zeros(grid.shape, dtype=bool)
+    for row, c0, c1 in spans:
+        out[row, c0:c1] = True
+    return out
+
+
+def test_polygon_spans_use_cell_centers():
+    grid = synthetic.make_grid(SIZE, CELL_SIZE)
+    x0, y0 = grid.xmin, grid.ymax
+    triangle = np.array([(x0 + 23.0, y0 - 17.0), (x0 + 251.0, y0 - 64.0), (x0 + 97.0, y0 - 283.0),
+                         (x0 + 23.0, y0 - 17.0)])
+    hole = np.array([(x0 + 90.0, y0 - 80.0), (x0 + 140.0, y0 - 80.0), (x0 + 140.0, y0 - 130.0),
+                     (x0 + 90.0, y0 - 130.0), (x0 + 90.0, y0 - 80.0)])
+    x, y = cell_centers(grid)
+    burned = spans_to_array(rz.polygon_spans([triangle, hole], grid), grid)
+    expected = inside(x, y, triangle) & ~inside(x, y, hole)
+    assert expected.sum() > 100
+    assert np.array_equal(burned, expected)
+
+
+def test_polygon_spans_are_clipped_to_the_grid():
+    grid = synthetic.make_grid(SIZE, CELL_SIZE)
+    square = np.array([(grid.xmin - 50.0, grid.ymax + 50.0), (grid.xmin + 52.0, grid.ymax + 50.0),
+                       (grid.xmin + 52.0, grid.ymax - 52.0), (grid.xmin - 50.0, grid.ymax - 52.0),
+                       (grid.xmin - 50.0, grid.ymax + 50.0)])
+    burned = spans_to_array(rz.polygon_spans([square], grid), grid)
+    assert burned[:5, :5].all()
+    assert burned.sum() == 25
+
+
+def test_line_cells_are_connected():
+    grid = synthetic.make_grid(SIZE, CELL_SIZE)
+    vertices = np.array([(grid.xmin + 5.0, grid.ymax - 5.0), (grid.xmin + 283.0, grid.ymax - 101.0),
+                         (grid.xmin + 150.0, grid.ymax - 295.0)])
+    rows, cols = rz.line_cells(vertices, grid)
+    assert (rows[0], cols[0]) == (0, 0)
+    assert (rows[-1], cols[-1]) == (29, 15)
+    steps = np.maximum(np.abs(np.diff(rows)), np.abs(np.diff(cols)))
+    assert steps.max() <= 1
+    # a segment crosses one cell per step along its major axis
+    assert len(set(zip(rows.tolist(), cols.tolist()))) == 28 + 1 + 19
+
+
+def test_burn_features(tmp_path):
+    grid = synthetic.make_grid(SIZE, CELL_SIZE)
+    x0, y0 = grid.xmin, grid.ymax
+    line = np.array([(x0 + 15.0, y0 - 15.0), (x0 + 15.0, y0 - 255.0)])
+    polygon = synthetic.bankfull_polygon(np.array([(x0 + 150.0, y0 - 50.0), (x0 + 150.0, y0 - 250.0)]), 60.0)
+    stream = synthetic.write_features(str(tmp_path / "stream.shp"), "POLYLINE", [line], [("LineOID", "LONG")],
+                                      [(1,)], grid.spatial_ref)
+    area = synthetic.write_features(str(tmp_path / "area.shp"), "POLYGON", [polygon], [("LineOID", "LONG")],
+                                    [(1,)], grid.spatial_ref)
+
+    strm_ras = rio.open_flat(rz.burn(stream, grid, str(tmp_path / "strm.bil"), "POLYLINE")).read()
+    expected = np.zeros(grid.shape)
+    expected[1:26, 1] = 1
+    assert np.array_equal(strm_ras, expected)
+
+    poly_ras = rio.open_flat(rz.burn(area, grid, str(tmp_path / "poly.bil"), "POLYGON")).read()
+    x, y = cell_centers(grid)
+    assert np.array_equal(poly_ras == 1, inside(x, y, polygon))
+    assert set(np.unique(poly_ras).tolist()) == set([0.0, 1.0])
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pytest
+import raster_io as rio
+import rasterize as rz
+import segments
+import zonal
+import synthetic
+
+SIZE = 120
+CELL_SIZE = 10.0
+BASIN_CELLS = 60
+
+
+def write_network(out_dir, grid, streams):
+    """Writes a stream network and its bankfull polygons, and burns both onto the grid"""
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    stream = synthetic.write_features(os.path.join(out_dir, "streams.shp"), "POLYLINE",
+                                      [vertices for oid, order, vertices in streams], [("LineOID", "LONG")],
+                                      [(oid,) for oid, order, vertices in streams], grid.spatial_ref)
+    bankfull = synthetic.write_features(os.path.join(out_dir, "bankfull.shp"), "POLYGON",
+                                        [synthetic.bankfull_polygon(vertices,
+                                                                    synthetic.bankfull_width(order, BASIN_CELLS,
+                                                                                             CELL_SIZE))
+                                         for oid, order, vertices in streams],
+                                        [("LineOID", "LONG")], [(oid,) for oid, order, vertices in streams],
+                                        grid.spatial_ref)
+    area = [rz.burn(stream, grid, os.path.join(out_dir, "strm_ras.bil"), "POLYLINE"),
+            rz.burn(bankfull, grid, os.path.join(out_dir, "poly_ras.bil"), "POLYGON")]
+    return stream, area
+
+
+def full_index(stream, area, grid, out_dir, processes=1):
+    zones = segments.segment_zones(stream, area, grid, os.path.join(out_dir, "zones.bil"), processes=processes)
+    return zonal.ZoneIndex.from_raster(zones, grid)
+
+
+def same_cells(a, b):
+    return all([np.array_equal(x, y) for x, y in zip(a.cells(), b.cells())])
+
+
+@pytest.fixture
+def network(tmp_path):
+    grid = synthetic.make_grid(SIZE, CELL_SIZE)
+    streams = synthetic.stream_network(grid, seed=5, basin_cells=BASIN_CELLS)
+    stream, area = write_network(str(tmp_path / "before"), grid, streams)
+    return grid, streams, stream, area, full_index(stream, area, grid, str(tmp_path / "before"))
+
+
+def test_zones_cover_the_stream_area(network):
+    grid, streams, stream, area, index = network
+    rows, cols, zones = index.cells()
+    burned = np.zeros(grid.shape, dtype=bool)
+    for bil in area:
+        burned |= rio.open_flat(bil).read() == 1
+    assert len(rows) == burned.sum()
+    assert burned[rows, cols].all()
+    oids = [oid for oid, digest in segments.segment_hashes(stream).values()]
+    assert set(zones.tolist()) <= set(oids)
+
+
+def test_parallel_zones_match_a_single_process(network, tmp_path):
+    grid, streams, stream, area, index = network
+    assert same_cells(full_index(stream, area, grid, str(tmp_path), processes=2), index)
+
+
+def test_parallel_zones_of_a_single_network_match_a_single_process(tmp_path):
+    grid = synthetic.make_grid(SIZE, CELL_SIZE)
+    streams = synthetic.stream_network(grid, seed=7, basin_cells=SIZE)
+    stream, area = write_network(str(tmp_path), grid, streams)
+    assert same_cells(full_index(stream, area, grid, str(tmp_path), processes=3),
+                      full_index(stream, area, grid, str(tmp_path)))
+
+
+def test_update_zones_without_changes(network):
+    grid, streams, stream, area, index = network
+    hashes = segments.segment_hashes(stream)
+    updated, affected = segments.update_zones(index, hashes, hashes, stream, area)
+    assert affected == set()
+    assert same_cells(updated, index)
+
+
+def test_update_zones_matches_a_full_rebuild(network, tmp_path):
+    grid, streams, stream, area, index = network
+    old_hashes = segments.segment_hashes(stream)
+
+    # move one segment, keeping the OIDs and LineOIDs of every segment
+    edited = list(streams)
+    oid, order, vertices = edited[len(edited) // 2]
+    edited[len(edited) // 2] = (oid, order, vertices + np.array([25.0, -15.0]))
+    new_stream, new_area = write_network(str(tmp_path / "after"), grid, edited)
+    new_hashes = segments.segment_hashes(new_stream)
+    changed = [key for key in new_hashes if new_hashes[key][1] != old_hashes[key][1]]
+    assert changed == [str(oid)]
+
+    updated, affected = segments.update_zones(index, old_hashes, new_hashes, new_stream, new_area)
+    rebuilt = full_index(new_stream, new_area, grid, str(tmp_path / "after"))
+    assert same_cells(updated, rebuilt)
+    assert new_hashes[str(oid)][0] in affected
+    assert len(affected) < len(streams)
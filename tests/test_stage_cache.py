@@ -0,0 +1,92 @@
+import os
+import shutil
+import raster_io as rio
+import stage_cache as sc
+import synthetic
+
+
+def write_flat(bil_path, value):
+    grid = synthetic.make_grid(8, 10.0)
+    flat = rio.create_flat(bil_path, grid, fill=value)
+    flat.flush()
+    del flat
+    return bil_path
+
+
+def copy_flat(bil_path, out_bil):
+    stem, out_stem = os.path.splitext(bil_path)[0], os.path.splitext(out_bil)[0]
+    for ext in (".bil", ".hdr", ".prj"):
+        if os.path.isfile(stem + ext):
+            shutil.copyfile(stem + ext, out_stem + ext)
+    return out_bil
+
+
+def test_lookup_hits_after_store(tmp_path):
+    dem = write_flat(str(tmp_path / "dem.bil"), 1.0)
+    output = write_flat(str(tmp_path / "surface.bil"), 2.0)
+    cache = sc.StageCache(str(tmp_path))
+    key = cache.key("surface", [dem], [10.0])
+    assert cache.lookup("surface", key) is None
+    cache.store("surface", key, output)
+    assert cache.lookup("surface", key) == output
+
+    # the manifest is shared with later runs
+    later = sc.StageCache(str(tmp_path))
+    assert later.key("surface", [dem], [10.0]) == key
+    assert later.lookup("surface", key) == output
+
+
+def test_key_misses_when_inputs_change(tmp_path):
+    dem = write_flat(str(tmp_path / "dem.bil"), 1.0)
+    cache = sc.StageCache(str(tmp_path))
+    key = cache.key("surface", [dem], [10.0])
+    assert cache.key("surface", [dem], [20.0]) != key
+    assert cache.key("mask", [dem], [10.0]) != key
+
+    flat = rio.update_flat(dem)
+    flat[3, 4] = 5.0
+    flat.flush()
+    del flat
+    # the file keeps its size, and may keep its modification time on file systems with a coarse time resolution, so
+    # its remembered hash is cleared
+    cache.manifest["fingerprints"].clear()
+    assert cache.key("surface", [dem], [10.0]) != key
+
+
+def test_key_does_not_depend_on_the_dataset_path(tmp_path):
+    dem = write_flat(str(tmp_path / "a" / "dem.bil"), 1.0)
+    copy = copy_flat(dem, str(tmp_path / "b.bil"))
+    cache = sc.StageCache(str(tmp_path))
+    assert cache.key("surface", [dem]) == cache.key("surface", [copy])
+
+
+def test_lookup_misses_when_the_output_is_deleted(tmp_path):
+    dem = write_flat(str(tmp_path / "dem.bil"), 1.0)
+    output = write_flat(str(tmp_path / "surface.bil"), 2.0)
+    cache = sc.StageCache(str(tmp_path))
+    key = cache.key("surface", [dem])
+    cache.store("surface", key, output)
+    for ext in (".bil", ".hdr", ".prj"):
+        if os.path.isfile(str(tmp_path / "surface") + ext):
+            os.remove(str(tmp_path / "surface") + ext)
+    assert cache.lookup("surface", key) is None
+
+
+def test_dataset_files_keep_rasters_and_shapefiles_apart(tmp_path):
+    for name in ["dem.tif", "dem.tfw", "dem.shp", "dem.shx", "dem.dbf", "dem.prj", "other.tfw"]:
+        with open(str(tmp_path / name), "w") as f:
+            f.write(name)
+    tif_files = [os.path.basename(f) for f in sc.dataset_files(str(tmp_path / "dem.tif"))]
+    shp_files = [os.path.basename(f) for f in sc.dataset_files(str(tmp_path / "dem.shp"))]
+    assert tif_files == ["dem.tfw", "dem.tif"]
+    assert shp_files == ["dem.dbf", "dem.prj", "dem.shp", "dem.shx"]
+
+
+def test_manifest_saves_merge_other_runs(tmp_path):
+    first = sc.StageCache(str(tmp_path))
+    second = sc.StageCache(str(tmp_path))
+    first.store("surface", "a", "surface_a.bil")
+    second.store("mask", "b", "mask_b.bil")
+    merged = sc.StageCache(str(tmp_path)).manifest["stages"]
+    assert merged == {"surface": {"a": "surface_a.bil"}, "mask": {"b": "mask_b.bil"}}
+    assert not [f for f in os.listdir(str(tmp_path)) if f.startswith(sc.MANIFEST_NAME + ".")]
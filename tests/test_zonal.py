@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import raster_io as rio
+import zonal
+import synthetic
+
+SIZE = 40
+
+
+@pytest.fixture
+def rasters(tmp_path):
+    """Zone and value rasters with NoData cells in both, and zone IDs with gaps"""
+    rng = np.random.RandomState(3)
+    grid = synthetic.make_grid(SIZE, 10.0)
+    zone_ids = rng.randint(0, 12, grid.shape) * 2
+    zone_ids[rng.uniform(size=grid.shape) < 0.3] = -1
+    values = rng.uniform(0.0, 1000.0, grid.shape).astype(np.float32)
+    values[rng.uniform(size=grid.shape) < 0.1] = np.nan
+
+    in_zones = str(tmp_path / "zones.bil")
+    flat = rio.create_flat(in_zones, grid, "int32", -1)
+    flat[:] = zone_ids
+    flat.flush()
+    del flat
+    in_values = str(tmp_path / "values.bil")
+    flat = rio.create_flat(in_values, grid)
+    rio.write_block(flat, (0, SIZE, 0, SIZE), values)
+    flat.flush()
+    del flat
+    return grid, zone_ids, values, in_zones, in_values
+
+
+def brute_force(zone_ids, values, zone, percentile=None):
+    cells = values[(zone_ids == zone) & ~np.isnan(values)].astype(np.float64)
+    if percentile is not None:
+        cells = np.sort(cells)
+        return cells[max(int(np.ceil(percentile / 100.0 * len(cells))) - 1, 0)]
+    return {"COUNT": len(cells), "SUM": cells.sum(), "MEAN": cells.mean(), "MAX": cells.max(), "MIN": cells.min()}
+
+
+def check_stats(stats, zone_ids, values):
+    for zone in range(len(stats["COUNT"])):
+        if not ((zone_ids == zone) & ~np.isnan(values)).any():
+            assert stats["COUNT"][zone] == 0
+            assert np.isnan(stats["MAX"][zone])
+            continue
+        expected = brute_force(zone_ids, values, zone)
+        for name, value in expected.items():
+            assert stats[name][zone] == pytest.approx(value, rel=1e-6)
+        assert stats["P50"][zone] == pytest.approx(brute_force(zone_ids, values, zone, 50), rel=1e-6)
+
+
+def test_zonal_stats_match_brute_force(rasters):
+    grid, zone_ids, values, in_zones, in_values = rasters
+    stats = zonal.zonal_stats(in_zones, in_values, percentiles=[50], block_rows=7)
+    assert len(stats["COUNT"]) == zone_ids.max() + 1
+    check_stats(stats, zone_ids, values)
+
+
+def test_zone_index_matches_brute_force(rasters):
+    grid, zone_ids, values, in_zones, in_values = rasters
+    index = zonal.ZoneIndex.from_raster(in_zones, grid, block_rows=7)
+    check_stats(index.zonal_stats(in_values, percentiles=[50], block_rows=9), zone_ids, values)
+
+
+def test_zone_index_cells_and_subset(rasters, tmp_path):
+    grid, zone_ids, values, in_zones, in_values = rasters
+    index = zonal.ZoneIndex.from_raster(in_zones, grid)
+    rows, cols, zones = index.cells()
+    assert np.array_equal(zone_ids[rows, cols], zones)
+    assert len(rows) == (zone_ids >= 0).sum()
+
+    rebuilt = zonal.ZoneIndex.from_cells(grid, rows[::-1], cols[::-1], zones[::-1])
+    assert all([np.array_equal(a, b) for a, b in zip(rebuilt.cells(), index.cells())])
+
+    loaded = zonal.ZoneIndex.load(index.save(str(tmp_path / "zones.npz")))
+    assert loaded.grid.same_as(grid)
+    assert all([np.array_equal(a, b) for a, b in zip(loaded.cells(), index.cells())])
+
+    subset = index.subset([4, 10])
+    assert set(subset.zones.tolist()) == set([4, 10])
+    stats = subset.zonal_stats(in_values)
+    assert stats["MAX"][4] == pytest.approx(brute_force(zone_ids, values, 4)["MAX"])
+    assert np.isnan(stats["MAX"][2])
+
+
+def test_zone_index_rejects_other_grids(rasters, tmp_path):
+    grid, zone_ids, values, in_zones, in_values = rasters
+    other = str(tmp_path / "other.bil")
+    flat = rio.create_flat(other, synthetic.make_grid(SIZE + 1, 10.0))
+    flat.flush()
+    del flat
+    with pytest.raises(ValueError):
+        zonal.ZoneIndex.from_raster(in_zones, grid).zonal_stats(other)
@@ -0,0 +1,221 @@
+# file name:	tiling.py
+# description:	Splits the solar insolation calculation into tiles that are processed in parallel by a pool of worker
+#               processes. Each tile is read with a halo of cells around it, sized from the maximum horizon search
+#               distance, so that shading from terrain outside of the tile is accounted for. Only the core of each
+#               tile is written, either directly into a shared memory-mapped output flat file (NumPy backend) or as a
+#               tile raster that is mosaicked into the output raster (ArcGIS backend). Completed tiles are tracked in
+#               the tile directory until the output is saved, so an interrupted run can be resumed.
+# author:		South Fork Research, Inc.
+# dependencies: numpy, insolation.py, raster_io.py, backends (the ArcGIS solar backend needs the ARCPY backend and
+#               the Spatial Analyst extension)
+
+import os
+import sys
+import math
+import shutil
+import hashlib
+import multiprocessing
+import numpy as np
+import insolation as ins
+import raster_io as rio
+import backends
+import util as u
+
+DEFAULT_TILE_SIZE = 2000  # cells per side of the tile core
+DEFAULT_SEARCH_DISTANCE = 5000.0  # meters
+
+
+def halo_cells(search_distance, cell_size):
+    """Number of cells needed around a tile to cover the horizon search distance"""
+    return int(math.ceil(float(search_distance) / cell_size))
+
+
+def tile_windows(nrows, ncols, tile_size, halo):
+    """Splits a grid into tiles.
+
+    Returns:
+        A list of (core window, read window) tuples, where each window is a (row start, row end, column start,
+        column end) tuple with exclusive end indices. The read window is the core window plus the halo, clipped to
+        the grid.
+    """
+    windows = []
+    for r0 in range(0, nrows, tile_size):
+        for c0 in range(0, ncols, tile_size):
+            core = (r0, min(r0 + tile_size, nrows), c0, min(c0 + tile_size, ncols))
+            read = (max(core[0] - halo, 0), min(core[1] + halo, nrows),
+                    max(core[2] - halo, 0), min(core[3] + halo, ncols))
+            windows.append((core, read))
+    return windows
+
+
+def window_extent(grid, window):
+    """Converts a grid window to map coordinates (xmin, ymin, xmax, ymax)"""
+    r0, r1, c0, c1 = window
+    return (grid.xmin + c0 * grid.cell_size, grid.ymax - r1 * grid.cell_size,
+            grid.xmin + c1 * grid.cell_size, grid.ymax - r0 * grid.cell_size)
+
+
+def tile_key(*args):
+    """Hashes the tile parameters, so that tiles from a run with different settings are never reused"""
+    return hashlib.sha1("|".join([str(a) for a in args]).encode("utf-8")).hexdigest()[:12]
+
+
+def set_worker_executable():
+    """Points multiprocessing at the Python interpreter when running in-process in ArcMap on Windows, where
+    sys.executable is ArcMap itself"""
+    if os.name == "nt" and not os.path.basename(sys.executable).lower().startswith("python"):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+
+
+def solar_tile(job):
+    """Worker function that calculates solar insolation for a single tile and saves the tile core.
+
+    With the NumPy backend, the surface and corridor mask windows are read from memory-mapped flat files, and the tile
+    core is written directly into the shared output flat file. With the ArcGIS backend, each tile core is saved as a
+    separate raster for mosaicking.
+
+    Args:
+        job: Tuple of the tile index, core window, read window and a dictionary of tile parameters.
+
+    Returns:
+        File path of the saved tile raster (or of the shared output flat file), or None if the tile does not overlap
+        the stream corridor mask.
+    """
+    index, core, read, prm = job
+    if prm["solar_backend"] == "NUMPY":
+        tile_path = prm["out_flat"]
+    else:
+        tile_path = os.path.join(prm["tile_dir"], "tile_{0}.tif".format(index))
+    done_file = os.path.join(prm["tile_dir"], "tile_{0}.done".format(index))
+    if os.path.isfile(done_file):
+        with open(done_file) as f:
+            skipped = f.read() == "skipped"
+        return tile_path if os.path.isfile(tile_path) and not skipped else None
+
+    grid = rio.grid_from_raster(prm["in_surface"])
+    core_xy = window_extent(grid, core)
+    read_xy = window_extent(grid, read)
+    latitude = prm["latitude"]
+    if prm["tile_latitude"]:
+        latitude = u.latitude_at((core_xy[0] + core_xy[2]) / 2.0, (core_xy[1] + core_xy[3]) / 2.0,
+                                 grid.spatial_ref)
+
+    # only calculate corridor cells within the tile core, and skip tiles outside of the corridor
+    mask = None
+    if prm["in_mask"]:
+        mask = np.zeros((read[1] - read[0], read[3] - read[2]), dtype=bool)
+        mask[core[0] - read[0]:core[1] - read[0], core[2] - read[2]:core[3] - read[2]] = True
+        mask &= rio.read_window(prm["in_mask"], grid, read) == 1
+        if not mask.any():
+            with open(done_file, "w") as f:
+                f.write("skipped")
+            return None
+
+    if prm["solar_backend"] == "NUMPY":
+        elev = rio.read_window(prm["in_surface"], grid, read)
+        area_solar = ins.area_solar_radiation(elev, grid.cell_size, latitude, prm["time_config"], prm["day_intrvl"],
+                                              prm["hour_intrvl"], prm["sky_size"],
+                                              search_distance=prm["search_distance"], mask=mask,
+                                              cache_dir=prm["cache_dir"])
+        area_solar = area_solar[core[0] - read[0]:core[1] - read[0], core[2] - read[2]:core[3] - read[2]]
+        out_flat = rio.update_flat(tile_path)
+        rio.write_block(out_flat, core, area_solar)
+        out_flat.flush()
+        del out_flat
+    else:
+        backends.get().solar_tile(prm["in_surface"], tile_path, read_xy, core_xy, latitude, prm["sky_size"],
+                                  prm["time_config"], prm["day_intrvl"], prm["hour_intrvl"])
+
+    open(done_file, "w").close()
+    return tile_path
+
+
+def tiled_solar(in_surface,
+                out_raster,
+                scratch_dir,
+                latitude,
+                sky_size,
+                time_config,
+                day_intrvl,
+                hour_intrvl,
+                solar_backend="NUMPY",
+                tile_size=DEFAULT_TILE_SIZE,
+                search_distance=DEFAULT_SEARCH_DISTANCE,
+                processes=0,
+                in_mask=None,
+                tile_latitude=False):
+    """Calculates solar insolation tile by tile in a process pool, then mosaics the tile cores into the output raster.
+
+    Args:
+        in_surface: Elevation surface (bare earth DEM plus vegetation height) raster dataset
+        out_raster: Output solar insolation raster dataset
+        scratch_dir: Folder used to store the tile rasters
+        solar_backend: Solar modeling backend used by each worker (ARCGIS or NUMPY)
+        tile_size: Number of cells per side of the tile core
+        search_distance: Maximum horizon search distance (meters), which sets the width of the tile halo
+        processes: Number of worker processes. Defaults to the number of CPUs.
+        in_mask: Optional stream corridor mask raster dataset (value of 1 within the corridor). Tiles that do not
+            overlap the corridor are skipped, and the NumPy backend only calculates corridor cells.
+        tile_latitude: If True, each tile is modeled at the latitude of its center instead of the run latitude.
+    """
+    grid = rio.grid_from_raster(in_surface)
+    halo = halo_cells(search_distance, grid.cell_size)
+    windows = tile_windows(grid.nrows, grid.ncols, tile_size, halo)
+    tile_dir = os.path.join(scratch_dir, "solar_tiles_{0}".format(
+        tile_key(in_surface, latitude, sky_size, time_config, day_intrvl, hour_intrvl, solar_backend, tile_size,
+                 search_distance, in_mask, tile_latitude)))
+    if not os.path.isdir(tile_dir):
+        os.makedirs(tile_dir)
+
+    # rasters read by every tile are exported once to flat files, which the workers read through memory maps
+    if in_mask:
+        in_mask = rio.as_flat(in_mask, os.path.join(tile_dir, "mask.bil"), grid, "uint8", 255)
+    out_flat = os.path.join(tile_dir, "solar.bil")
+    if solar_backend == "NUMPY":
+        in_surface = rio.as_flat(in_surface, os.path.join(tile_dir, "surface.bil"), grid)
+        if not os.path.isfile(out_flat):
+            flat = rio.create_flat(out_flat, grid, "float32", rio.FLOAT_NODATA, fill=rio.FLOAT_NODATA)
+            flat.flush()
+            del flat
+    prm = {"in_surface": str(in_surface),
+           "tile_dir": tile_dir,
+           "out_flat": out_flat,
+           "latitude": latitude,
+           "sky_size": sky_size,
+           "time_config": time_config,
+           "day_intrvl": day_intrvl,
+           "hour_intrvl": hour_intrvl,
+           "solar_backend": solar_backend,
+           "search_distance": float(search_distance),
+           "in_mask": in_mask,
+           "tile_latitude": tile_latitude,
+           "cache_dir": ins.default_cache_dir()}
+    jobs = [(i, core, read, prm) for i, (core, read) in enumerate(windows)]
+
+    backends.message("Calculating solar radiation for {0} tiles...".format(len(jobs)))
+    set_worker_executable()
+    pool = multiprocessing.Pool(processes if processes > 0 else None)
+    try:
+        tile_paths = []
+        for i, tile_path in enumerate(pool.imap_unordered(solar_tile, jobs)):
+            if tile_path:
+                tile_paths.append(tile_path)
+            backends.message("Finished tile {0} of {1}".format(i + 1, len(jobs)))
+    finally:
+        pool.close()
+        pool.join()
+
+    if solar_backend != "NUMPY" and not tile_paths:
+        # every tile was skipped by the corridor mask, so there is nothing to mosaic
+        backends.warning("No tiles overlap the stream corridor. The solar raster has no data.")
+        flat = rio.create_flat(out_flat, grid, "float32", rio.FLOAT_NODATA, fill=rio.FLOAT_NODATA)
+        flat.flush()
+        del flat
+    if solar_backend == "NUMPY" or not tile_paths:
+        backends.message("Saving solar raster...")
+        rio.save_flat(out_flat, out_raster)
+    else:
+        backends.message("Mosaicking solar tiles...")
+        backends.get().mosaic(sorted(tile_paths), out_raster, in_surface, grid.cell_size)
+    shutil.rmtree(tile_dir, ignore_errors=True)
+    return
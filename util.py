@@ -1,25 +1,135 @@
 # file name:	solar_util.py
 # description:	This file includes functions that serve as data-processing utilities, primarily for the solar_predict.py
 # author:		Jesse Langdon
-# dependencies: ESRI arcpy module, Spatial Analyst extension
+# dependencies: raster_io.py, rasterize.py, profiling.py, backends
 
 
-import arcpy
+import os
+import uuid
+import atexit
+import shutil
+import raster_io as rio
+import rasterize as rz
+import profiling
+import backends
 
 
-def clear_inmem():
-    arcpy.env.workspace = r"IN_MEMORY"
-    arcpy.AddMessage("Deleting in_memory data...")
+def clear_inmem(run_id=None):
+    """Deletes feature classes and tables from the in_memory workspace.
 
-    list_fc = arcpy.ListFeatureClasses()
-    list_tbl = arcpy.ListTables()
+    Args:
+        run_id: If supplied, only datasets named with this run ID (see RunScratch) are deleted, so that other runs
+            in the same process keep their in_memory data.
+    """
+    backends.get().clear_memory(run_id)
+
+
+def get_scratch_folder(workspace_temp):
+    """Returns a file system folder for scratch files that can't be stored in a geodatabase, which is the folder
+    containing the scratch workspace if it is a file geodatabase."""
+    if workspace_temp.lower().endswith(".gdb"):
+        return os.path.dirname(workspace_temp)
+    return workspace_temp
+
+
+# scratch namespaces of the runs that have not been cleaned up, which are cleaned up when the Python process exits
+_live_scratches = set()
+
+
+def _cleanup_scratches():
+    for scratch in list(_live_scratches):
+        scratch.cleanup()
 
-    ### for each FeatClass in the list of fcs's, delete it.
-    for f in list_fc:
-        arcpy.Delete_management(f)
-        ### for each TableClass in the list of tab's, delete it.
-    for t in list_tbl:
-        arcpy.Delete_management(t)
+
+atexit.register(_cleanup_scratches)
+
+
+class RunScratch(object):
+    """Scratch namespace of a single tool run. Every dataset, layer and file name used by the run is suffixed with a
+    run ID that is unique to the run, and scratch files are written to a folder of their own, so that several runs
+    can share a scratch workspace, or execute in the same process, without overwriting each other's data. Everything
+    in the namespace is deleted by cleanup(), which is also called when the Python process exits in case the run
+    fails.
+
+    Args:
+        workspace_temp: Scratch workspace (file geodatabase or folder) shared by all runs
+    """
+
+    def __init__(self, workspace_temp):
+        self.workspace = workspace_temp
+        self.run_id = uuid.uuid4().hex[:8]
+        self.folder = os.path.join(get_scratch_folder(workspace_temp), "run_" + self.run_id)
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.datasets = []
+        self.closed = False
+        _live_scratches.add(self)
+
+    def name(self, base):
+        """Dataset or layer name unique to this run. Layers named with this method are deleted by cleanup()."""
+        name = "{0}_{1}".format(base, self.run_id)
+        if name not in self.datasets:
+            self.datasets.append(name)
+        return name
+
+    def path(self, base):
+        """Path of a dataset unique to this run in the scratch workspace"""
+        path = backends.get().dataset_path(self.workspace, "{0}_{1}".format(base, self.run_id))
+        if path not in self.datasets:
+            self.datasets.append(path)
+        return path
+
+    def file(self, file_name):
+        """Path of a file in the scratch folder of this run"""
+        return os.path.join(self.folder, file_name)
+
+    def publish(self, file_name, out_path):
+        """Moves a complete file from the scratch folder of this run to a folder shared by several runs (i.e. the
+        scratch folder), replacing an earlier copy, so other runs never read it partially written. If another run
+        publishes the same path at the same time, its copy is kept."""
+        try:
+            if os.name == "nt" and os.path.isfile(out_path):
+                os.remove(out_path)
+            os.rename(self.file(file_name), out_path)
+        except OSError:
+            if not os.path.isfile(out_path):
+                raise
+            os.remove(self.file(file_name))
+        return out_path
+
+    def cleanup(self):
+        """Deletes the datasets, layers, in_memory data and scratch folder of this run"""
+        if self.closed:
+            return
+        self.closed = True
+        _live_scratches.discard(self)
+        gp = backends.get()
+        for dataset in reversed(self.datasets):
+            try:
+                if gp.exists(dataset):
+                    gp.delete(dataset)
+            except Exception:
+                gp.warning("Unable to delete scratch dataset " + dataset)
+        clear_inmem(self.run_id)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def latitude_at(x, y, spatial_ref):
+    """Projects a point to WGS 1984 and returns its latitude, in decimal degrees.
+
+    Args:
+        x: X coordinate of the point
+        y: Y coordinate of the point
+        spatial_ref: Spatial reference of the point coordinates, as a well-known text string
+    """
+    return backends.get().latitude(x, y, spatial_ref)
+
+
+def get_latitude(in_fc):
+    """Returns the latitude of the center of a feature class extent, in decimal degrees. Only the extent center is
+    projected, rather than every feature of the feature class."""
+    extent, spatial_ref = backends.get().extent(in_fc)
+    return latitude_at((extent[0] + extent[2]) / 2.0, (extent[1] + extent[3]) / 2.0, spatial_ref)
 
 
 def checkLineOID(in_fc):
@@ -33,182 +143,34 @@ def checkLineOID(in_fc):
         A boolean true or false value.
     """
     fieldName = "LineOID"
-    fields = arcpy.ListFields(in_fc, fieldName)
-    for field in fields:
-        if field.name == fieldName:
-            return True
-        else:
-            return False
-
-
-# This is a modified version of the changeStartingVertex function pulled from:
-# https://bitbucket.org/KellyWhitehead/geomorphic-network-and-analysis-toolbox
-def changeStartingVertex(fcInputPoints,
-                         fcInputPolygons):
-
-    ## Create Geometry Object for Processing input points.
-    g = arcpy.Geometry()
-    geomPoints = arcpy.CopyFeatures_management(fcInputPoints, g)
-
-    listPointCoords = []
-    for point in geomPoints:
-        listPointCoords.append([point.centroid.X, point.centroid.Y])
-
-    with arcpy.da.UpdateCursor(fcInputPolygons, ["OID@", "SHAPE@"]) as ucPolygons:
-        for featPolygon in ucPolygons:
-            vertexList = []
-            i = 0
-            iStart = 0
-            for polygonVertex in featPolygon[1].getPart(0):  # shape,firstpart
-                if polygonVertex:
-                    vertexList.append([polygonVertex.X, polygonVertex.Y])
-                    if [polygonVertex.X, polygonVertex.Y] in listPointCoords:
-                        iStart = i
-                    else:
-                        pass
-                i = i + 1
-            if iStart == 0:
-                newVertexList = vertexList
-            else:
-                # arcpy.AddMessage("Changing Vertex List for: " + str(featPolygon[0]))
-                newVertexList = vertexList[iStart:i] + vertexList[0:iStart]
-                for v in newVertexList:
-                    arcpy.AddMessage(str(v[0]) + "," + str(v[1]))
-                # listVertexPointObjects = []
-                newShapeArray = arcpy.Array()
-                for newVertex in newVertexList:
-                    # arcpy.AddMessage("Changing Vertex: " + str(newVertex[0]) + ',' + str(newVertex[1]))
-                    newShapeArray.add(arcpy.Point(newVertex[0], newVertex[1]))
-                    # listVertexPointObjects.append(arcpy.Point(newVertex[0],newVertex[1]))
-                # newShapeArray = arcpy.Array(listVertexPointObjects)
-                newPolygonArray = arcpy.Polygon(newShapeArray)
-
-                ucPolygons.updateRow([featPolygon[0], newPolygonArray])
-
-    return
-
-
-# This is a modified version of the DividePolygonBySegment module from:
-# https://bitbucket.org/KellyWhitehead/geomorphic-network-and-analysis-toolbox
-def divide_polygon(fcInputCenterline, fcInputPolygon, workspaceTemp,
-                   dblPointDensity=10.0, dblJunctionBuffer=120.00):
-    arcpy.AddMessage("Dividing stream area by segments...")
-
-    arcpy.env.OutputMFlag = "Disabled"
-    arcpy.env.OutputZFlag = "Disabled"
-
-    ## Copy centerline to temporary workspace
-    fcCenterline = workspaceTemp + r"\GNAT_DPS_Centerline"
-    arcpy.CopyFeatures_management(fcInputCenterline, fcCenterline)
-
-    ## Build Thiessan polygons
-    arcpy.env.extent = fcInputPolygon  # Set extent to build Thiessan polygons over line network.
-    arcpy.Densify_edit(fcCenterline, "DISTANCE", str(dblPointDensity) + " METERS")
-
-    fcTribJunctionPoints = workspaceTemp + r"\GNAT_DPS_TribJunctionPoints"
-    arcpy.Intersect_analysis(fcCenterline, fcTribJunctionPoints, output_type="POINT")
-
-    fcThiessanPoints = workspaceTemp + r"\GNAT_DPS_ThiessanPoints"
-    arcpy.FeatureVerticesToPoints_management(fcCenterline, fcThiessanPoints, "ALL")
-
-    lyrThiessanPoints = "lyrThiessanPoints"
-    arcpy.MakeFeatureLayer_management(fcThiessanPoints, lyrThiessanPoints)
-    arcpy.SelectLayerByLocation_management(lyrThiessanPoints, "INTERSECT", fcTribJunctionPoints,
-                                           str(dblJunctionBuffer) + " METERS", "NEW_SELECTION")
-
-    fcThiessanPoly = workspaceTemp + r"\GNAT_DPS_ThiessanPoly"
-    arcpy.CreateThiessenPolygons_analysis(lyrThiessanPoints, fcThiessanPoly, "ONLY_FID")
-
-    fcThiessanPolyClip = workspaceTemp + r"\GNAT_DPS_TheissanPolyClip"
-    arcpy.Clip_analysis(fcThiessanPoly, fcInputPolygon, fcThiessanPolyClip)
-
-    # Code to split the junction Thiessan polygons
-    lyrTribThiessanPolys = "lyrTribThiessanPolys"
-    arcpy.MakeFeatureLayer_management(fcThiessanPolyClip, lyrTribThiessanPolys)
-    arcpy.SelectLayerByLocation_management(lyrTribThiessanPolys, "INTERSECT", fcTribJunctionPoints,
-                                           selection_type="NEW_SELECTION")
-
-    fcSplitPoints = workspaceTemp + r"\GNAT_DPS_SplitPoints"
-    arcpy.Intersect_analysis([lyrTribThiessanPolys, fcCenterline], fcSplitPoints, output_type="POINT")
-
-    changeStartingVertex(fcTribJunctionPoints, lyrTribThiessanPolys)
-
-    fcThiessanTribPolyEdges = workspaceTemp + r"\GNAT_DPS_ThiessanTribPolyEdges"
-    arcpy.FeatureToLine_management(lyrTribThiessanPolys, fcThiessanTribPolyEdges)
-
-    fcSplitLines = workspaceTemp + r"\GNAT_DPS_SplitLines"
-    arcpy.SplitLineAtPoint_management(fcThiessanTribPolyEdges, fcSplitPoints, fcSplitLines, "0.1 METERS")
-
-    fcMidPoints = workspaceTemp + r"\GNAT_DPS_MidPoints"
-    arcpy.FeatureVerticesToPoints_management(fcSplitLines, fcMidPoints, "MID")
-    arcpy.Near_analysis(fcMidPoints, fcTribJunctionPoints, location="LOCATION")
-    arcpy.AddXY_management(fcMidPoints)
-
-    fcTribToMidLines = workspaceTemp + r"\GNAT_DPS_TribToMidLines"
-    arcpy.XYToLine_management(fcMidPoints, fcTribToMidLines, "POINT_X", "POINT_Y", "NEAR_X", "NEAR_Y")
-
-    ### Select Polys by Centerline ###
-    fcThiessanEdges = workspaceTemp + r"\GNAT_DPS_ThiessanEdges"
-    arcpy.FeatureToLine_management(fcThiessanPolyClip, fcThiessanEdges)
-
-    fcAllEdges = workspaceTemp + r"\GNAT_DPS_AllEdges"
-    arcpy.Merge_management([fcTribToMidLines, fcThiessanEdges, fcCenterline],
-                           fcAllEdges)  # include fcCenterline if needed
-
-    fcAllEdgesPolygons = workspaceTemp + r"\GNAT_DPS_AllEdgesPolygons"
-    arcpy.FeatureToPolygon_management(fcAllEdges, fcAllEdgesPolygons)
-
-    fcAllEdgesPolygonsClip = workspaceTemp + r"\GNAT_DPS_AllEdgesPolygonsClip"
-    arcpy.Clip_analysis(fcAllEdgesPolygons, fcInputPolygon, fcAllEdgesPolygonsClip)
-
-    fcPolygonsJoinCenterline = workspaceTemp + r"\GNAT_DPS_PolygonsJoinCenterline"
-    arcpy.SpatialJoin_analysis(fcAllEdgesPolygonsClip,
-                               fcCenterline,
-                               fcPolygonsJoinCenterline,
-                               "JOIN_ONE_TO_MANY",
-                               "KEEP_ALL",
-                               match_option="SHARE_A_LINE_SEGMENT_WITH")
-
-    fcPolygonsDissolved = workspaceTemp + r"\GNAT_DPS_PolygonsDissolved"
-    arcpy.Dissolve_management(fcPolygonsJoinCenterline,
-                              fcPolygonsDissolved,
-                              "JOIN_FID",
-                              multi_part="SINGLE_PART")
-
-    lyrPolygonsDissolved = "lyrPolygonsDissolved"
-    arcpy.MakeFeatureLayer_management(fcPolygonsDissolved, lyrPolygonsDissolved)
-    arcpy.SelectLayerByAttribute_management(lyrPolygonsDissolved, "NEW_SELECTION", """ "JOIN_FID" = -1 """)
-
-    fcSegmentedPolygons = workspaceTemp + r"\GNAT_DPS_PolygonsSegmented"
-    arcpy.Eliminate_management(lyrPolygonsDissolved, fcSegmentedPolygons, "LENGTH")
-
-    return fcSegmentedPolygons
-
-
-def raster_poly(in_raster, in_strm, in_strm_area, workspace_temp):
-    # convert streams and stream area polygons to a single polygon with rasterized boundaries
-    desc = arcpy.Describe(in_raster)
-    cellSize = desc.meanCellHeight
-    arcpy.AddField_management(in_strm, "VAL", "SHORT")
-    arcpy.AddField_management(in_strm_area, "VAL", "SHORT")
-    arcpy.CalculateField_management(in_strm, "VAL", "1", "PYTHON_9.3")
-    arcpy.CalculateField_management(in_strm_area, "VAL", "1", "PYTHON_9.3")
-    arcpy.AddMessage("Converting stream polyline and area vectors to raster format...")
-    strm_ras = workspace_temp + r"\strm_ras"
-    arcpy.PolylineToRaster_conversion(in_strm, "VAL", strm_ras, "", "", cellSize)
-    poly_ras = workspace_temp + r"\poly_ras"
-    arcpy.PolygonToRaster_conversion(in_strm_area, "VAL", poly_ras, "CELL_CENTER", "", cellSize)
-    # Create stream area polygon for summarizing solar values later
-    strm_poly = workspace_temp + r"\strm_poly"
-    arcpy.RasterToPolygon_conversion(strm_ras, strm_poly, "NO_SIMPLIFY")
-    area_poly = workspace_temp + r"\area_poly"
-    arcpy.RasterToPolygon_conversion(poly_ras, area_poly, "NO_SIMPLIFY")
-    merge_poly = workspace_temp + r"\merge_poly"
-    arcpy.Merge_management(strm_poly + ";" + area_poly, merge_poly)
-    dslv_poly = workspace_temp + r"\dslv_poly"
-    arcpy.Dissolve_management(merge_poly, dslv_poly)
-    # Create stream area raster for reconditioning canopy raster data
-    arcpy.AddField_management(dslv_poly, "VAL", "SHORT")
-    arcpy.CalculateField_management(dslv_poly, "VAL", "1", "PYTHON_9.3")
-
-    return dslv_poly, strm_ras, poly_ras
\ No newline at end of file
+    return fieldName in backends.get().field_names(in_fc)
+
+
+def coord_key(x, y, tolerance=None):
+    """Hashable key for a coordinate pair. With a tolerance, coordinates are snapped to a grid with that spacing, so
+    that coordinates that differ by floating point noise share the same key."""
+    if tolerance:
+        return int(round(x / tolerance)), int(round(y / tolerance))
+    return x, y
+
+
+@profiling.timed()
+def raster_poly(in_raster, in_strm, in_strm_area, scratch):
+    """Rasterizes the stream network and stream area polygons onto the grid of a raster, without modifying the
+    input feature classes.
+
+    Args:
+        in_raster: Raster dataset that sets the output grid (i.e. the DEM)
+        in_strm: Stream network polyline feature class or layer
+        in_strm_area: Stream area polygon feature class or layer
+        scratch: RunScratch namespace of the run. The rasters are written to its folder as BIL flat files.
+
+    Returns:
+        A tuple of the stream line raster and the stream area polygon raster. Both rasters have a value of 1 for
+        stream cells and 0 elsewhere.
+    """
+    backends.message("Converting stream polyline and area vectors to raster format...")
+    grid = rio.grid_from_raster(in_raster)
+    strm_ras = rz.burn(in_strm, grid, scratch.file("strm_ras.bil"), "POLYLINE")
+    poly_ras = rz.burn(in_strm_area, grid, scratch.file("poly_ras.bil"), "POLYGON")
+    return strm_ras, poly_ras
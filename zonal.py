@@ -0,0 +1,215 @@
+# file name:	zonal.py
+# description:	Zonal statistics of a value raster for stream segment zones, calculated with NumPy. The segment zone
+#               raster and the value raster are read block by block and the statistics for every zone are accumulated
+#               in a single pass, so processing time is linear in the number of cells rather than in the number of
+#               segments. Results are written directly to an attribute field. The zone cells can be saved as a
+#               run-length ZoneIndex and reused with later value rasters on the same grid.
+# author:		South Fork Research, Inc.
+# dependencies: numpy, raster_io.py, backends
+
+import numpy as np
+import raster_io as rio
+import backends
+
+
+class _Accumulator(object):
+    """Accumulates per-zone statistics from batches of (zone ID, value) cells"""
+
+    def __init__(self, percentiles=()):
+        self.percentiles = percentiles
+        self.size = 0
+        self.count = np.zeros(0, dtype=np.int64)
+        self.total = np.zeros(0, dtype=np.float64)
+        self.zmax = np.zeros(0, dtype=np.float64)
+        self.zmin = np.zeros(0, dtype=np.float64)
+        self.kept_zones = []
+        self.kept_values = []
+
+    def add(self, zones, values):
+        """Adds a batch of cells, given as 1D arrays of non-negative integer zone IDs and non-NaN values"""
+        if zones.size == 0:
+            return
+        values = values.astype(np.float64)
+        block_size = int(zones.max()) + 1
+        if block_size > self.size:
+            grow = block_size - self.size
+            self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int64)])
+            self.total = np.concatenate([self.total, np.zeros(grow)])
+            self.zmax = np.concatenate([self.zmax, np.full(grow, -np.inf)])
+            self.zmin = np.concatenate([self.zmin, np.full(grow, np.inf)])
+            self.size = block_size
+        self.count += np.bincount(zones, minlength=self.size)
+        self.total += np.bincount(zones, weights=values, minlength=self.size)
+        np.maximum.at(self.zmax, zones, values)
+        np.minimum.at(self.zmin, zones, values)
+        if self.percentiles:
+            self.kept_zones.append(zones)
+            self.kept_values.append(values)
+
+    def result(self):
+        count = self.count
+        empty = count == 0
+        stats = {"COUNT": count,
+                 "SUM": np.where(empty, np.nan, self.total),
+                 "MEAN": np.where(empty, np.nan, self.total / np.maximum(count, 1)),
+                 "MAX": np.where(empty, np.nan, self.zmax),
+                 "MIN": np.where(empty, np.nan, self.zmin)}
+        if self.percentiles:
+            zones = np.concatenate(self.kept_zones) if self.kept_zones else np.zeros(0, dtype=np.int64)
+            values = np.concatenate(self.kept_values) if self.kept_values else np.zeros(0)
+            values = values[np.lexsort((values, zones))]
+            starts = np.concatenate([[0], np.cumsum(count)[:-1]]).astype(np.int64)
+            for pct in self.percentiles:
+                # nearest rank within each zone's sorted values
+                rank = np.ceil(pct / 100.0 * count).astype(np.int64) - 1
+                rank = np.clip(rank, 0, np.maximum(count - 1, 0))
+                result = np.full(self.size, np.nan)
+                result[~empty] = values[(starts + rank)[~empty]]
+                stats["P{0}".format(int(pct) if float(pct).is_integer() else pct)] = result
+        return stats
+
+
+def zonal_stats(in_zones, in_raster, percentiles=(), block_rows=rio.BLOCK_ROWS):
+    """Calculates statistics of a value raster for each zone of a zone ID raster. NoData cells of either raster are
+    ignored, the same as the DATA option of the Zonal Statistics as Table tool.
+
+    Args:
+        in_zones: Zone ID raster dataset, with non-negative integer zone IDs
+        in_raster: Value raster dataset. The zone raster is aligned to the grid of this raster.
+        percentiles: Optional percentiles (0 to 100) to calculate for each zone, which requires keeping the values of
+            all zone cells in memory.
+
+    Returns:
+        A dictionary of statistic name (MAX, MEAN, MIN, SUM, COUNT and P<percentile>) to an array indexed by zone ID.
+        Statistics are NaN for zones without any data cells.
+    """
+    grid = rio.grid_from_raster(in_raster)
+    acc = _Accumulator(percentiles)
+    for window in rio.iter_windows(grid, block_rows):
+        zones = rio.read_window(in_zones, grid, window)
+        values = rio.read_window(in_raster, grid, window)
+        valid = ~np.isnan(zones) & ~np.isnan(values)
+        acc.add(zones[valid].astype(np.int64), values[valid])
+    return acc.result()
+
+
+class ZoneIndex(object):
+    """Run-length index of the cells of each zone on a raster grid. The index is built once from a zone ID raster and
+    saved, so that later runs against new value rasters on the same grid can summarize zones without rasterizing the
+    zone polygons again.
+
+    Args:
+        grid: RasterGrid of the zone cells
+        rows: Row of each run
+        cols: First column of each run
+        lengths: Number of cells in each run
+        zones: Zone ID of each run
+    """
+
+    def __init__(self, grid, rows, cols, lengths, zones):
+        self.grid = grid
+        self.rows = rows
+        self.cols = cols
+        self.lengths = lengths
+        self.zones = zones
+
+    @classmethod
+    def from_raster(cls, in_zones, grid, block_rows=rio.BLOCK_ROWS):
+        """Builds the index from a zone ID raster, aligned to a grid"""
+        rows, cols, lengths, zones = [], [], [], []
+        for window in rio.iter_windows(grid, block_rows):
+            block = rio.read_window(in_zones, grid, window)
+            block = np.where(np.isnan(block), -1, block).astype(np.int64)
+            # a run starts at the first column of each row and wherever the zone ID changes along a row
+            starts = np.ones(block.shape, dtype=bool)
+            starts[:, 1:] = block[:, 1:] != block[:, :-1]
+            idx = np.flatnonzero(starts)
+            run_len = np.diff(np.append(idx, block.size))
+            run_zone = block.ravel()[idx]
+            keep = run_zone >= 0
+            rows.append((idx[keep] // grid.ncols + window[0]).astype(np.int32))
+            cols.append((idx[keep] % grid.ncols).astype(np.int32))
+            lengths.append(run_len[keep].astype(np.int32))
+            zones.append(run_zone[keep])
+        return cls(grid, np.concatenate(rows), np.concatenate(cols), np.concatenate(lengths), np.concatenate(zones))
+
+    @classmethod
+    def from_cells(cls, grid, rows, cols, zones):
+        """Builds the index from the row, column and zone ID of each zone cell"""
+        order = np.lexsort((cols, rows))
+        rows, cols, zones = rows[order], cols[order], zones[order]
+        starts = np.ones(len(rows), dtype=bool)
+        starts[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1] + 1) | (zones[1:] != zones[:-1])
+        idx = np.flatnonzero(starts)
+        lengths = np.diff(np.append(idx, len(rows)))
+        return cls(grid, rows[idx].astype(np.int32), cols[idx].astype(np.int32), lengths.astype(np.int32),
+                   zones[idx].astype(np.int64))
+
+    @classmethod
+    def load(cls, index_path):
+        with np.load(index_path) as f:
+            xmin, ymax, cell_size, nrows, ncols = f["grid"]
+            grid = rio.RasterGrid(xmin, ymax, cell_size, nrows, ncols, str(f["spatial_ref"]))
+            return cls(grid, f["rows"], f["cols"], f["lengths"], f["zones"])
+
+    def save(self, index_path):
+        grid = self.grid
+        with open(index_path, "wb") as f:
+            np.savez_compressed(f, grid=np.array([grid.xmin, grid.ymax, grid.cell_size, grid.nrows, grid.ncols]),
+                                spatial_ref=np.array(grid.spatial_ref), rows=self.rows, cols=self.cols,
+                                lengths=self.lengths, zones=self.zones)
+        return index_path
+
+    def cells(self):
+        """Expands the runs to the row, column and zone ID of each zone cell"""
+        offsets = np.arange(self.lengths.sum()) - np.repeat(np.cumsum(self.lengths) - self.lengths, self.lengths)
+        return (np.repeat(self.rows, self.lengths), np.repeat(self.cols, self.lengths) + offsets,
+                np.repeat(self.zones, self.lengths))
+
+    def subset(self, zone_ids):
+        """Returns the index of only the given zones"""
+        keep = np.isin(self.zones, np.asarray(list(zone_ids), dtype=np.int64))
+        return ZoneIndex(self.grid, self.rows[keep], self.cols[keep], self.lengths[keep], self.zones[keep])
+
+    def zonal_stats(self, in_raster, percentiles=(), block_rows=rio.BLOCK_ROWS):
+        """Calculates statistics of a value raster for each zone, reading only the row blocks that contain zone cells.
+        See zonal_stats() for the returned statistics."""
+        grid = rio.grid_from_raster(in_raster)
+        if not grid.same_as(self.grid):
+            raise ValueError("The raster {0} is not on the grid of the zone index.".format(in_raster))
+        acc = _Accumulator(percentiles)
+        for window in rio.iter_windows(grid, block_rows):
+            lo, hi = np.searchsorted(self.rows, [window[0], window[1]])
+            if lo == hi:
+                continue
+            lengths = self.lengths[lo:hi]
+            offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            cell_rows = np.repeat(self.rows[lo:hi] - window[0], lengths)
+            cell_cols = np.repeat(self.cols[lo:hi], lengths) + offsets
+            values = rio.read_window(in_raster, grid, window)[cell_rows, cell_cols]
+            valid = ~np.isnan(values)
+            acc.add(np.repeat(self.zones[lo:hi], lengths)[valid], values[valid])
+        return acc.result()
+
+
+def write_field(in_fc, id_field, values, out_field, cast=float):
+    """Writes per-zone values to an existing attribute field, matching features to zones by an ID field. Features
+    without a value (zones outside of the array or without data) are set to Null.
+
+    Args:
+        in_fc: Feature class or layer to update
+        id_field: Field with the zone ID of each feature (i.e. the OID field of the stream network)
+        values: Array of values indexed by zone ID
+        out_field: Field to write the values to
+        cast: Type that the values are converted to (i.e. int for integer fields)
+    """
+    def update(row):
+        zone = row[0]
+        if zone is not None and 0 <= zone < len(values) and not np.isnan(values[zone]):
+            row[1] = cast(values[zone])
+        else:
+            row[1] = None
+        return row
+
+    backends.get().update_features(in_fc, [id_field, out_field], update)
+    return